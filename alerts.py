@@ -0,0 +1,128 @@
+import heapq
+import itertools
+import threading
+
+RAISED = 'raised'
+CLEARED = 'cleared'
+
+
+class AlertManager:
+    # Turns the anomalies found on every frame into alerts with a lifecycle:
+    #   raised  - the first frame an anomaly (bottle_id, type) is seen;
+    #   cleared - once it has not been seen for clear_after frames.
+    # After an alert is raised, the same (bottle_id, type) is suppressed for
+    # a dedup window (dedup_window frames, or cooldowns[type] for that type),
+    # so a flickering anomaly raises once while a recurring one on a recycled
+    # track id is reported again later. Expiry times live in two min-heaps, so
+    # a frame costs O(log n) per anomaly, clear and expiry rather than a scan
+    # of every alert. At most max_entries suppression entries are kept; past
+    # that the ones closest to expiring are dropped first.
+    #
+    # Subscribers are called as fn(event, alert) in subscription order, on
+    # the thread calling update() and outside the manager's lock, so they may
+    # call back into it (e.g. set_text from an LLM callback).
+    def __init__(self, dedup_window=900, cooldowns=None, clear_after=1, max_entries=10000, initial_text=''):
+        self.dedup_window = dedup_window
+        self.cooldowns = dict(cooldowns or {})
+        self.clear_after = clear_after
+        self.max_entries = max_entries
+        self.initial_text = initial_text
+        self.raised = 0
+        self.cleared = 0
+        self.suppressed = 0
+        self._active = {}
+        self._suppressed_until = {}
+        self._clear_heap = []
+        self._expiry_heap = []
+        self._subscribers = []
+        self._snapshot = {}
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+
+    def subscribe(self, fn):
+        self._subscribers.append(fn)
+
+    def _window(self, anomaly_type):
+        return self.cooldowns.get(anomaly_type, self.dedup_window)
+
+    def update(self, anomalies, now):
+        # now is the current frame index. Returns (raised, cleared) alerts.
+        raised, cleared = [], []
+        with self._lock:
+            for anomaly in anomalies:
+                key = (anomaly['bottle_id'], anomaly['type'])
+                alert = self._active.get(key)
+                if alert is not None:
+                    alert['last_seen'] = now
+                    continue
+                if self._suppressed_until.get(key, now) > now:
+                    self.suppressed += 1
+                    continue
+
+                alert = {'bottle_id': key[0], 'type': key[1], 'anomaly': anomaly, 'raised_at': now,
+                         'last_seen': now, 'text': self.initial_text}
+                self._active[key] = alert
+                until = now + self._window(key[1])
+                self._suppressed_until[key] = until
+                heapq.heappush(self._expiry_heap, (until, next(self._sequence), key))
+                heapq.heappush(self._clear_heap, (now + self.clear_after, next(self._sequence), key))
+                raised.append(alert)
+
+            while self._clear_heap and self._clear_heap[0][0] <= now:
+                _, _, key = heapq.heappop(self._clear_heap)
+                alert = self._active.get(key)
+                if alert is None:
+                    continue
+                deadline = alert['last_seen'] + self.clear_after
+                if deadline > now:
+                    # Seen again since this entry was pushed.
+                    heapq.heappush(self._clear_heap, (deadline, next(self._sequence), key))
+                    continue
+                del self._active[key]
+                alert['cleared_at'] = now
+                cleared.append(alert)
+
+            while self._expiry_heap and (self._expiry_heap[0][0] <= now
+                                         or len(self._suppressed_until) > self.max_entries):
+                until, _, key = heapq.heappop(self._expiry_heap)
+                if self._suppressed_until.get(key) == until:
+                    del self._suppressed_until[key]
+
+            self.raised += len(raised)
+            self.cleared += len(cleared)
+            if raised or cleared:
+                self._refresh_snapshot()
+
+        for alert in raised:
+            self._publish(RAISED, alert)
+        for alert in cleared:
+            self._publish(CLEARED, alert)
+        return raised, cleared
+
+    def _publish(self, event, alert):
+        for fn in self._subscribers:
+            fn(event, alert)
+
+    def set_text(self, alert, text):
+        # Replaces an alert's on-screen text, e.g. with the LLM explanation.
+        # Ignored if the alert has already been cleared.
+        with self._lock:
+            alert['text'] = text
+            if self._active.get((alert['bottle_id'], alert['type'])) is alert:
+                self._refresh_snapshot()
+
+    def _refresh_snapshot(self):
+        # One line per bottle, from its most recently raised alert. Rebuilt
+        # only when alerts change; readers get an immutable-by-convention dict.
+        snapshot = {}
+        for alert in sorted(self._active.values(), key=lambda a: a['raised_at']):
+            snapshot[alert['bottle_id']] = alert['text']
+        self._snapshot = snapshot
+
+    def snapshot(self):
+        return self._snapshot
+
+    def stats(self):
+        with self._lock:
+            return {'raised': self.raised, 'cleared': self.cleared, 'suppressed': self.suppressed,
+                    'active': len(self._active), 'tracked_keys': len(self._suppressed_until)}
@@ -1,3 +1,6 @@
+import numpy as np
+from line_layout import LineLayout, NO_STATION
+
 EXPECTED_SEQUENCE = [
     'bottle_empty',
     'bottle_filling',
@@ -6,61 +9,268 @@ EXPECTED_SEQUENCE = [
     'bottle_labeled'
 ]
 
+STUCK_FRAME_COUNT = 10
+STUCK_PIXEL_THRESHOLD = 5
+LABEL_MISSING_MARGIN = 50
+
+
 class AnomalyDetector:
-    def __init__(self, zones=None):
-        self.zones = zones or {}
+    def __init__(self, layout=None, history_window=50, stale_after=90, initial_capacity=64,
+                 stuck_frame_count=STUCK_FRAME_COUNT, stuck_pixel_threshold=STUCK_PIXEL_THRESHOLD):
+        # Without a layout there are no stations, and so no zone checks.
+        self.layout = layout or LineLayout()
+        self.zones = self.layout.ranges
+        self.history_window = history_window
+        self.stale_after = stale_after
+        self.stuck_frame_count = stuck_frame_count
+        self.stuck_pixel_threshold = stuck_pixel_threshold
+        self.frame_index = -1
+        # States in the order the line produces them. A line without stations
+        # falls back to the full bottling sequence for the order check.
+        self.sequence = list(self.layout.states) if self.layout.stations else list(EXPECTED_SEQUENCE)
+        self.stage_index = {state: index for index, state in enumerate(self.sequence)}
+
+        # Lookup tables indexed by state code + 1, so the unknown code -1 maps
+        # to row 0 and never needs a special case in the vectorized pass.
+        # Station bounds are inclusive here, as in check_anomalies().
+        self._expected_station = np.array(
+            [NO_STATION] + [self._station_for_state(state) for state in self.sequence], dtype=np.int16)
+        self._has_station = self._expected_station != NO_STATION
+        bounds = [self.layout.stations[station]['x_range'] if station != NO_STATION else (0, 0)
+                  for station in self._expected_station]
+        self._zone_lo = np.array([lo for lo, _ in bounds], dtype=np.int32)
+        self._zone_hi = np.array([hi for _, hi in bounds], dtype=np.int32)
+        # The label check needs the station that labels bottles, found by its
+        # state rather than its name; a line without one never checks it.
+        self._labeling_end = None
+        labeling = self.layout.station_for_state.get('bottle_labeled')
+        if labeling is not None:
+            station = self.layout.stations[labeling]
+            self._labeling_end = station['x_range'][1]
+            self._before_label_state = self.layout.state_before(station['name'])
+            self._before_label_code = self.stage_index[self._before_label_state]
+            self._labeled_code = self.stage_index['bottle_labeled']
+
+        self._slots = {}
+        self._free_slots = []
+        self._capacity = 0
+        self._allocate(initial_capacity)
+
+    def _allocate(self, capacity):
+        columns = {
+            '_track_ids': np.zeros(capacity, dtype=object),
+            '_count': np.zeros(capacity, dtype=np.int32),
+            '_last_seen': np.full(capacity, -1, dtype=np.int64),
+            '_last_code': np.full(capacity, -2, dtype=np.int8),
+            '_last_x': np.zeros(capacity, dtype=np.int32),
+            '_run_length': np.zeros(capacity, dtype=np.int32),
+            '_stage_last_seen': np.zeros((capacity, len(self.sequence)), dtype=np.int32),
+            '_inversion_expiry': np.zeros(capacity, dtype=np.int32),
+            '_anchor_x': np.zeros(capacity, dtype=np.int32),
+            '_still_frames': np.zeros(capacity, dtype=np.int32),
+        }
+        for name, column in columns.items():
+            if self._capacity:
+                column[:self._capacity] = getattr(self, name)
+            setattr(self, name, column)
+        self._free_slots.extend(range(capacity - 1, self._capacity - 1, -1))
+        self._capacity = capacity
+
+    def _slot_for(self, bottle_id):
+        slot = self._slots.get(bottle_id)
+        if slot is not None:
+            return slot
+        if not self._free_slots:
+            self._allocate(self._capacity * 2)
+        slot = self._free_slots.pop()
+        self._track_ids[slot] = bottle_id
+        self._count[slot] = 0
+        self._last_code[slot] = -2
+        self._run_length[slot] = 0
+        self._stage_last_seen[slot] = 0
+        self._inversion_expiry[slot] = 0
+        self._still_frames[slot] = 0
+        self._slots[bottle_id] = slot
+        return slot
+
+    def update(self, tracked_objects, frame_index=None):
+        self.frame_index = self.frame_index + 1 if frame_index is None else frame_index
+        if tracked_objects:
+            slots = np.array([self._slot_for(obj['id']) for obj in tracked_objects], dtype=np.intp)
+            codes = np.array([self.stage_index.get(obj['label'], -1) for obj in tracked_objects], dtype=np.int8)
+            xs = np.array([(obj['bbox'][0] + obj['bbox'][2]) // 2 for obj in tracked_objects], dtype=np.int32)
+            self.observe(slots, codes, xs)
+        self.evict_stale()
+
+    def observe(self, slots, codes, xs):
+        # Every running statistic is updated in O(1) per observation; nothing
+        # here looks back at the history.
+        new_tracks = self._count[slots] == 0
+        self._anchor_x[slots[new_tracks]] = xs[new_tracks]
+        self._still_frames[slots[new_tracks]] = -1
+
+        same_state = codes == self._last_code[slots]
+        self._run_length[slots] = np.where(same_state, self._run_length[slots] + 1, 1)
+
+        # A stage seen after a later one is an inversion that stays inside the
+        # history window until that later observation scrolls out of it.
+        observation = self._count[slots] + 1
+        known = codes >= 0
+        later_stage = np.arange(len(self.sequence))[None, :] > codes[:, None]
+        last_later = np.where(later_stage, self._stage_last_seen[slots], 0).max(axis=1)
+        inverted = known & (last_later > 0)
+        self._inversion_expiry[slots] = np.where(
+            inverted,
+            np.maximum(self._inversion_expiry[slots], last_later + self.history_window),
+            self._inversion_expiry[slots]
+        )
+        self._stage_last_seen[slots[known], codes[known]] = observation[known]
+
+        moved = np.abs(xs - self._anchor_x[slots]) >= self.stuck_pixel_threshold
+        self._anchor_x[slots] = np.where(moved, xs, self._anchor_x[slots])
+        self._still_frames[slots] = np.where(moved, 0, self._still_frames[slots] + 1)
+
+        self._count[slots] += 1
+        self._last_code[slots] = codes
+        self._last_x[slots] = xs
+        self._last_seen[slots] = self.frame_index
+
+    def evict_stale(self):
+        if self.stale_after is None or not self._slots:
+            return []
+        stale_slots = np.flatnonzero((self._count > 0) & (self._last_seen < self.frame_index - self.stale_after))
+        evicted = []
+        for slot in stale_slots:
+            bottle_id = self._track_ids[slot]
+            del self._slots[bottle_id]
+            self._count[slot] = 0
+            self._track_ids[slot] = None
+            self._free_slots.append(int(slot))
+            evicted.append(bottle_id)
+        return evicted
+
+    def evaluate(self, history_lookup=None):
+        active = self._count > 0
+        if not active.any():
+            return []
+
+        lookup = self._last_code.astype(np.intp) + 1
+        last_x = self._last_x
+
+        out_of_order = active & (self._count < self._inversion_expiry)
+        stuck = (
+            active
+            & (self._count > self.stuck_frame_count)
+            & (self._run_length >= self.stuck_frame_count)
+            & (self._still_frames >= self.stuck_frame_count - 1)
+        )
+        if self._labeling_end is not None:
+            # Ready for labeling (e.g. capped) but not labeled within the last
+            # history_window observations, like the bounded state history
+            # check_anomalies() is given.
+            window_start = np.maximum(self._count - self.history_window, 0)
+            label_missing = (
+                active
+                & (self._stage_last_seen[:, self._before_label_code] > window_start)
+                & (self._stage_last_seen[:, self._labeled_code] <= window_start)
+                & (last_x > self._labeling_end + LABEL_MISSING_MARGIN)
+            )
+        else:
+            label_missing = np.zeros_like(active)
+        if self.zones:
+            misaligned = (
+                active & self._has_station[lookup]
+                & ((last_x < self._zone_lo[lookup]) | (last_x > self._zone_hi[lookup]))
+            )
+        else:
+            misaligned = np.zeros_like(active)
+
+        flagged = np.flatnonzero(out_of_order | stuck | label_missing | misaligned)
+        anomalies = []
+        for slot in flagged:
+            bottle_id = self._track_ids[slot]
+            history = history_lookup(bottle_id) if history_lookup is not None else []
+            station = self._expected_station[lookup[slot]]
+
+            if out_of_order[slot]:
+                anomalies.append({
+                    "bottle_id": bottle_id,
+                    "type": "Stage out of order",
+                    "details": history
+                })
+            if label_missing[slot]:
+                anomalies.append({
+                    "bottle_id": bottle_id,
+                    "type": "Label missing",
+                    "details": history
+                })
+            if stuck[slot]:
+                stuck_state = self.sequence[lookup[slot] - 1] if lookup[slot] > 0 else 'unknown'
+                anomalies.append({
+                    "bottle_id": bottle_id,
+                    "type": "Stuck bottle",
+                    "details": f"Stuck in state '{stuck_state}' and position for {self.stuck_frame_count} frames."
+                })
+            if misaligned[slot]:
+                zone = self.layout.names[station]
+                anomalies.append({
+                    "bottle_id": bottle_id,
+                    "type": "Misaligned in " + zone,
+                    "position": int(last_x[slot]),
+                    "expected_range": self.zones[zone]
+                })
+        return anomalies
 
     def check_anomalies(self, bottle_id, state_history, position_history):
         anomalies = []
-        if not position_history: 
+        if not position_history:
             return []
-            
+
         current_position = position_history[-1]
 
-        index_list = [EXPECTED_SEQUENCE.index(s) for s in state_history if s in EXPECTED_SEQUENCE]
-        if index_list != sorted(index_list):
+        index_list = [self.stage_index[s] for s in state_history if s in self.stage_index]
+        if any(a > b for a, b in zip(index_list, index_list[1:])):
             anomalies.append({
                 "bottle_id": bottle_id,
                 "type": "Stage out of order",
                 "details": state_history
             })
 
-        if self.zones and 'bottle_capped' in state_history and 'bottle_labeled' not in state_history:
-             labeling_zone_end = self.zones.get('labeling', (0, 0))[1]
-             if current_position[0] > labeling_zone_end + 50:
+        if self._labeling_end is not None and self._before_label_state in state_history \
+                and 'bottle_labeled' not in state_history:
+            if current_position[0] > self._labeling_end + LABEL_MISSING_MARGIN:
                 anomalies.append({
                     "bottle_id": bottle_id,
                     "type": "Label missing",
                     "details": state_history
                 })
 
-        STUCK_FRAME_COUNT = 10
-        STUCK_PIXEL_THRESHOLD = 5 
-        if len(state_history) > STUCK_FRAME_COUNT:
-            last_n_states = state_history[-STUCK_FRAME_COUNT:]
-           
+        if len(state_history) > self.stuck_frame_count:
+            last_n_states = state_history[-self.stuck_frame_count:]
+
             if len(set(last_n_states)) == 1:
-                last_n_positions = position_history[-STUCK_FRAME_COUNT:]
-                
+                last_n_positions = position_history[-self.stuck_frame_count:]
+
                 start_x = last_n_positions[0][0]
                 end_x = last_n_positions[-1][0]
                 distance_moved = abs(end_x - start_x)
 
-                if distance_moved < STUCK_PIXEL_THRESHOLD:
+                if distance_moved < self.stuck_pixel_threshold:
                     stuck_state = last_n_states[0]
                     anomalies.append({
                         "bottle_id": bottle_id,
                         "type": "Stuck bottle",
-                        "details": f"Stuck in state '{stuck_state}' and position for {STUCK_FRAME_COUNT} frames."
+                        "details": f"Stuck in state '{stuck_state}' and position for {self.stuck_frame_count} frames."
                     })
 
         if self.zones and state_history:
             last_state = state_history[-1]
-            zone = self._zone_for_state(last_state)
-            if zone and current_position:
+            station = self._station_for_state(last_state)
+            if station != NO_STATION and current_position:
                 x = current_position[0]
-                zone_x1, zone_x2 = self.zones.get(zone, (None, None))
-                if zone_x1 is not None and not (zone_x1 <= x <= zone_x2):
+                zone = self.layout.names[station]
+                zone_x1, zone_x2 = self.zones[zone]
+                if not (zone_x1 <= x <= zone_x2):
                     anomalies.append({
                         "bottle_id": bottle_id,
                         "type": "Misaligned in " + zone,
@@ -70,8 +280,5 @@ class AnomalyDetector:
 
         return anomalies
 
-    def _zone_for_state(self, state):
-        if 'filling' in state: return 'filling'
-        if 'capped' in state: return 'capping'
-        if 'labeled' in state: return 'labeling'
-        return None
\ No newline at end of file
+    def _station_for_state(self, state):
+        return self.layout.station_for_state.get(state, NO_STATION)
@@ -0,0 +1,88 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class BatchedDetector:
+    # Shares one detector between several production lines. Each line submits
+    # its frames; a single worker gathers them into batches of up to
+    # max_batch_size, waiting at most max_wait seconds after the first frame
+    # arrives, and runs them through detect_batch() in one model call.
+    def __init__(self, detector, max_batch_size=8, max_wait=0.01):
+        self.detector = detector
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.frames = 0
+        self._requests = queue.Queue()
+        self._stop_event = threading.Event()
+        self._submit_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name='batched-detector', daemon=True)
+        self._worker.start()
+
+    def submit(self, frame):
+        future = Future()
+        with self._submit_lock:
+            if not self._stop_event.is_set():
+                self._requests.put((frame, future))
+                return future
+        # Frames arriving during shutdown get no detections rather than an
+        # error in the detect stage.
+        future.set_result([])
+        return future
+
+    def detect(self, frame):
+        return self.submit(frame).result()
+
+    def _collect(self):
+        try:
+            batch = [self._requests.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+            live = [(frame, future) for frame, future in batch if future.set_running_or_notify_cancel()]
+            if not live:
+                continue
+            frames = [frame for frame, _ in live]
+            futures = [future for _, future in live]
+            try:
+                results = self.detector.detect_batch(frames)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.frames += len(frames)
+            for future, detections in zip(futures, results):
+                future.set_result(detections)
+
+    def mean_batch_size(self):
+        return self.frames / self.batches if self.batches else 0.0
+
+    def stop(self):
+        with self._submit_lock:
+            self._stop_event.set()
+        self._worker.join(timeout=1.0)
+        while True:
+            try:
+                _, future = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if future.set_running_or_notify_cancel():
+                future.set_result([])
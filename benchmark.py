@@ -0,0 +1,311 @@
+import argparse
+import contextlib
+import copy
+import io
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+import cv2
+import numpy as np
+from sim_clock import SteppedClock
+from scenario_generator import ScenarioGenerator
+from bottle_tracker import BottleTracker
+from anomaly_detector import AnomalyDetector
+from llm_reasoner import LLMReasoner, TemplateBackend
+from simulation_elements import (
+    compose_environment,
+    default_layout,
+    BELT_SPEED,
+    WIDTH,
+    HEIGHT
+)
+
+# --- Configuration ---
+# Scenes are simulated with a stepped clock and a fixed seed, so every run
+# times exactly the same frames. A density is the number of bottles on the
+# belt at once once the scene has filled up.
+DENSITIES = (3, 8, 16)
+FRAMES = 300
+SEED = 0
+FRAME_DURATION = 1.0 / 30
+MODEL_PATH = 'best.pt'
+DETECTOR_BACKEND = 'torch'
+CONFIDENCE_THRESHOLD = 0.7
+RESULTS_PATH = 'benchmark_results.json'
+BASELINE_PATH = 'benchmark_baseline.json'
+# A component counts as regressed when its median latency grows by more than
+# this fraction over the baseline.
+REGRESSION_THRESHOLD = 0.10
+
+
+def build_scene(density, frames=FRAMES, seed=SEED):
+    # Returns one list of bottle snapshots per frame, recorded after the first
+    # bottle has crossed the whole belt so every frame is at steady state.
+    spawn_interval = WIDTH / density / BELT_SPEED
+    warmup = int(math.ceil(WIDTH / BELT_SPEED / FRAME_DURATION))
+    total_bottles = int(math.ceil((warmup + frames) * FRAME_DURATION / spawn_interval)) + 3
+
+    clock = SteppedClock()
+    scene = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        scenario = ScenarioGenerator(total_bottles=total_bottles, spawn_interval=spawn_interval,
+                                     clock=clock, seed=seed)
+        for frame_index in range(warmup + frames):
+            clock.advance(FRAME_DURATION)
+            bottles_on_belt = scenario.update()
+            for bottle in bottles_on_belt:
+                bottle.update_position(FRAME_DURATION)
+                bottle.update_state()
+            bottles_on_belt[:] = [b for b in bottles_on_belt if b.x < WIDTH]
+            if frame_index >= warmup:
+                scene.append([copy.copy(b) for b in bottles_on_belt])
+    return scene
+
+
+def ground_truth_detections(scene, seed=SEED):
+    # Detector-like input for the trackers: ground-truth boxes with a few
+    # pixels of jitter and a spread of confidences, seeded per run.
+    rng = np.random.default_rng(seed)
+    frames = []
+    for bottles in scene:
+        detections = []
+        for bottle in bottles:
+            data = bottle.get_tracker_format()
+            jitter = rng.integers(-2, 3, size=4)
+            detections.append({
+                'bbox': [int(v) + int(j) for v, j in zip(data['bbox'], jitter)],
+                'conf': float(rng.uniform(0.5, 0.99)),
+                'label': data['label']
+            })
+        frames.append(detections)
+    return frames
+
+
+def render(environment, bottles):
+    frame = environment.copy()
+    for bottle in bottles:
+        bottle.draw(frame)
+    return frame
+
+
+def summarize(timings):
+    timings = np.asarray(timings)
+    total = timings.sum()
+    return {
+        'calls': len(timings),
+        'fps': len(timings) / total if total > 0 else 0.0,
+        'mean_ms': timings.mean() * 1000,
+        'p50_ms': np.percentile(timings, 50) * 1000,
+        'p95_ms': np.percentile(timings, 95) * 1000,
+        'p99_ms': np.percentile(timings, 99) * 1000
+    }
+
+
+def time_calls(fn, inputs, prepare=None):
+    # Only fn() is timed; prepare() builds its argument outside the clock.
+    timings = []
+    for item in inputs:
+        argument = prepare(item) if prepare is not None else item
+        started = time.perf_counter()
+        fn(argument)
+        timings.append(time.perf_counter() - started)
+    return summarize(timings)
+
+
+def load_detector():
+    try:
+        from yolo_detector import YoloDetector
+        return YoloDetector(model_path=MODEL_PATH, confidence_threshold=CONFIDENCE_THRESHOLD, backend=DETECTOR_BACKEND)
+    except Exception as e:
+        print(f"[BENCH] Skipping the YOLO detector ({e}). Trackers use ground-truth detections.")
+        return None
+
+
+def create_trackers():
+    trackers = {}
+    from sort_tracker import SortTracker
+    trackers['sort'] = SortTracker
+    try:
+        from deep_sort_tracker import DeepSortTracker
+        trackers['deepsort'] = DeepSortTracker
+    except ImportError as e:
+        print(f"[BENCH] Skipping the DeepSORT tracker ({e}).")
+    return trackers
+
+
+def bench_density(density, environment, detector, trackers):
+    scene = build_scene(density)
+    detections = ground_truth_detections(scene)
+    truth = [[bottle.get_tracker_format() for bottle in bottles] for bottles in scene]
+    results = {'render': time_calls(lambda bottles: render(environment, bottles), scene)}
+
+    if detector is not None:
+        detector.detect(render(environment, scene[0]))
+        results['detector'] = time_calls(detector.detect, scene, prepare=lambda b: render(environment, b))
+
+    for name, tracker_class in trackers.items():
+        tracker = tracker_class()
+        if name == 'deepsort':
+            # The appearance embedder needs the rendered frame.
+            frames = [(d, render(environment, b)) for d, b in zip(detections, scene)]
+            results[f'tracker_{name}'] = time_calls(lambda item: tracker.update_tracks(item[0], frame=item[1]),
+                                                    frames)
+        else:
+            results[f'tracker_{name}'] = time_calls(tracker.update_tracks, detections)
+
+    bottle_tracker = BottleTracker(max_history=50)
+    results['bottle_tracker'] = time_calls(bottle_tracker.update, truth)
+
+    bottle_tracker = BottleTracker(max_history=50)
+    anomaly_detector = AnomalyDetector(layout=default_layout(), history_window=50)
+    anomalies = []
+
+    def evaluate(frame_index):
+        anomaly_detector.update(truth[frame_index], frame_index=frame_index)
+        anomalies.extend(anomaly_detector.evaluate(history_lookup=bottle_tracker.get_state_history))
+
+    def track_history(frame_index):
+        bottle_tracker.update(truth[frame_index], frame_index=frame_index)
+        return frame_index
+
+    results['anomaly_evaluate'] = time_calls(evaluate, range(len(truth)), prepare=track_history)
+
+    bottle_tracker = BottleTracker(max_history=50)
+    legacy = AnomalyDetector(layout=default_layout(), history_window=50)
+
+    def check_anomalies(tracked):
+        for obj in tracked:
+            legacy.check_anomalies(obj['id'], bottle_tracker.get_state_history(obj['id']),
+                                   bottle_tracker.get_position_history(obj['id']))
+
+    def record_history(tracked):
+        bottle_tracker.update(tracked)
+        return tracked
+
+    results['anomaly_check_anomalies'] = time_calls(check_anomalies, truth, prepare=record_history)
+
+    if anomalies:
+        reasoner = LLMReasoner(backend=TemplateBackend(), cache=None)
+        results['llm_template'] = time_calls(lambda anomaly: reasoner.explain_anomalies([anomaly]), anomalies)
+        reasoner.shutdown()
+
+    results['end_to_end'] = bench_end_to_end(scene, detections, environment, detector, trackers['sort'])
+    return results
+
+
+def bench_end_to_end(scene, detections, environment, detector, tracker_class):
+    # The serial per-frame loop of main.py's stages: render, detect (ground
+    # truth without a model), track, history, anomalies and LLM dispatch.
+    tracker = tracker_class()
+    bottle_tracker = BottleTracker(max_history=50)
+    anomaly_detector = AnomalyDetector(layout=default_layout(), history_window=50)
+    reasoner = LLMReasoner(backend=TemplateBackend(), cache=None)
+    reported = set()
+
+    def step(frame_index):
+        frame = render(environment, scene[frame_index])
+        frame_detections = detector.detect(frame) if detector is not None else detections[frame_index]
+        tracked_objects = tracker.update_tracks(frame_detections, frame=frame)
+        bottle_tracker.update(tracked_objects, frame_index=frame_index)
+        anomaly_detector.update(tracked_objects, frame_index=frame_index)
+        for anomaly in anomaly_detector.evaluate(history_lookup=bottle_tracker.get_state_history):
+            key = (anomaly['bottle_id'], anomaly['type'])
+            if key not in reported:
+                reported.add(key)
+                reasoner.explain_async(anomaly)
+
+    summary = time_calls(step, range(len(scene)))
+    reasoner.shutdown()
+    return summary
+
+
+def environment_info():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'frames': FRAMES,
+        'seed': SEED
+    }
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    # Prints the median latency of every component against the baseline and
+    # returns the names of those that got slower than the threshold allows.
+    regressions = []
+    print(f"\n{'benchmark':<36}{'baseline p50':>14}{'p50':>10}{'change':>10}")
+    for key, summary in sorted(results.items()):
+        if key not in baseline:
+            print(f"{key:<36}{'-':>14}{summary['p50_ms']:>8.3f}ms{'new':>10}")
+            continue
+        before, after = baseline[key]['p50_ms'], summary['p50_ms']
+        change = (after - before) / before if before > 0 else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(key)
+            flag = '  REGRESSION'
+        print(f"{key:<36}{before:>12.3f}ms{after:>8.3f}ms{change:>+10.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the FactorySense detection-tracking-anomaly stack.")
+    parser.add_argument('--densities', type=int, nargs='+', default=list(DENSITIES))
+    parser.add_argument('--output', default=RESULTS_PATH)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="Also store this run as the new baseline.")
+    args = parser.parse_args()
+
+    environment = compose_environment(np.full((HEIGHT, WIDTH, 3), (60, 60, 60), dtype=np.uint8))
+    detector = load_detector()
+    trackers = create_trackers()
+
+    results = {}
+    for density in args.densities:
+        print(f"[BENCH] {density} bottles on the belt, {FRAMES} frames...")
+        for component, summary in bench_density(density, environment, detector, trackers).items():
+            results[f'{component}@{density}'] = summary
+            print(f"  {component:<26}{summary['fps']:>10.1f} fps   p50 {summary['p50_ms']:.3f} ms   "
+                  f"p95 {summary['p95_ms']:.3f} ms   p99 {summary['p99_ms']:.3f} ms")
+
+    report = {'environment': environment_info(), 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one.")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline['results'])
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed by more than {REGRESSION_THRESHOLD:.0%}: "
+              f"{', '.join(regressions)}")
+        return 1
+    print("\nNo regressions against the baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
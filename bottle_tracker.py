@@ -1,33 +1,170 @@
-from collections import defaultdict, deque
+import numpy as np
+
+STATE_LABELS = [
+    'bottle_empty',
+    'bottle_filling',
+    'bottle_filled',
+    'bottle_capped',
+    'bottle_labeled'
+]
+UNKNOWN_STATE = -1
+
 
 class BottleTracker:
-    def __init__(self, max_history=30):
-        self.bottle_states = defaultdict(lambda: deque(maxlen=max_history))
-        self.bottle_positions = {}  
-        self.bottle_position_history = defaultdict(lambda: deque(maxlen=max_history)) 
-
-    def update(self, tracked_bottles):
-        
-        for bottle in tracked_bottles:
-            bottle_id = bottle['id']
-            label = bottle['label']
-            bbox = bottle['bbox']
-            center_x = (bbox[0] + bbox[2]) // 2
-            center_y = (bbox[1] + bbox[3]) // 2
-            current_position = (center_x, center_y)
-
-            self.bottle_states[bottle_id].append(label)
-            self.bottle_positions[bottle_id] = current_position
-            self.bottle_position_history[bottle_id].append(current_position) 
+    # Every track owns one row in a set of preallocated ring buffers. Each
+    # sample is written twice, at `w` and `w + max_history`, so the most recent
+    # `n` samples are always one contiguous slice and can be handed out as a
+    # zero-copy NumPy view regardless of where the ring currently wraps.
+    def __init__(self, max_history=30, stale_after=90, initial_capacity=64):
+        self.max_history = max_history
+        self.stale_after = stale_after
+        self.frame_index = -1
+
+        self.state_labels = list(STATE_LABELS)
+        self._state_codes = {label: code for code, label in enumerate(self.state_labels)}
+
+        self._slots = {}
+        self._capacity = 0
+        self._free_slots = []
+        self._allocate(initial_capacity)
+
+    def _allocate(self, capacity):
+        doubled = 2 * self.max_history
+        states = np.full((capacity, doubled), UNKNOWN_STATE, dtype=np.int8)
+        positions = np.zeros((capacity, doubled, 2), dtype=np.int16)
+        frames = np.zeros((capacity, doubled), dtype=np.int32)
+        write_index = np.full(capacity, -1, dtype=np.int32)
+        counts = np.zeros(capacity, dtype=np.int32)
+        last_seen = np.full(capacity, -1, dtype=np.int64)
+        track_ids = np.zeros(capacity, dtype=object)
+
+        if self._capacity:
+            old = self._capacity
+            states[:old] = self._states
+            positions[:old] = self._positions
+            frames[:old] = self._frames
+            write_index[:old] = self._write_index
+            counts[:old] = self._counts
+            last_seen[:old] = self._last_seen
+            track_ids[:old] = self._track_ids
+
+        self._states = states
+        self._positions = positions
+        self._frames = frames
+        self._write_index = write_index
+        self._counts = counts
+        self._last_seen = last_seen
+        self._track_ids = track_ids
+        self._free_slots.extend(range(capacity - 1, self._capacity - 1, -1))
+        self._capacity = capacity
+
+    def _slot_for(self, bottle_id):
+        slot = self._slots.get(bottle_id)
+        if slot is not None:
+            return slot
+        if not self._free_slots:
+            self._allocate(self._capacity * 2)
+        slot = self._free_slots.pop()
+        self._write_index[slot] = -1
+        self._counts[slot] = 0
+        self._track_ids[slot] = bottle_id
+        self._slots[bottle_id] = slot
+        return slot
+
+    def encode_state(self, label):
+        code = self._state_codes.get(label)
+        if code is None:
+            if len(self.state_labels) >= np.iinfo(np.int8).max:
+                return UNKNOWN_STATE
+            code = len(self.state_labels)
+            self.state_labels.append(label)
+            self._state_codes[label] = code
+        return code
+
+    def decode_state(self, code):
+        return self.state_labels[code] if code != UNKNOWN_STATE else None
+
+    def update(self, tracked_bottles, frame_index=None):
+        self.frame_index = self.frame_index + 1 if frame_index is None else frame_index
+
+        if tracked_bottles:
+            history = self.max_history
+            slots = np.array([self._slot_for(bottle['id']) for bottle in tracked_bottles], dtype=np.intp)
+            codes = np.array([self.encode_state(bottle['label']) for bottle in tracked_bottles], dtype=np.int8)
+            bboxes = np.array([bottle['bbox'] for bottle in tracked_bottles], dtype=np.int32)
+            centers = np.empty((len(slots), 2), dtype=np.int32)
+            centers[:, 0] = (bboxes[:, 0] + bboxes[:, 2]) // 2
+            centers[:, 1] = (bboxes[:, 1] + bboxes[:, 3]) // 2
+
+            w = (self._write_index[slots] + 1) % history
+            self._write_index[slots] = w
+            self._counts[slots] = np.minimum(self._counts[slots] + 1, history)
+            self._last_seen[slots] = self.frame_index
+
+            for offset in (w, w + history):
+                self._states[slots, offset] = codes
+                self._positions[slots, offset] = centers
+                self._frames[slots, offset] = self.frame_index
+
+        self.evict_stale()
+
+    def evict_stale(self):
+        if self.stale_after is None or not self._slots:
+            return []
+        cutoff = self.frame_index - self.stale_after
+        stale_slots = np.flatnonzero((self._counts > 0) & (self._last_seen < cutoff))
+        evicted = []
+        for slot in stale_slots:
+            bottle_id = self._track_ids[slot]
+            del self._slots[bottle_id]
+            self._counts[slot] = 0
+            self._track_ids[slot] = None
+            self._free_slots.append(int(slot))
+            evicted.append(bottle_id)
+        return evicted
+
+    def _window(self, slot):
+        count = self._counts[slot]
+        end = self._write_index[slot] + self.max_history + 1
+        return slice(end - count, end)
+
+    def get_state_codes(self, bottle_id):
+        slot = self._slots.get(bottle_id)
+        if slot is None:
+            return self._states[0, :0]
+        return self._states[slot, self._window(slot)]
+
+    def get_positions(self, bottle_id):
+        slot = self._slots.get(bottle_id)
+        if slot is None:
+            return self._positions[0, :0]
+        return self._positions[slot, self._window(slot)]
+
+    def get_frame_indices(self, bottle_id):
+        slot = self._slots.get(bottle_id)
+        if slot is None:
+            return self._frames[0, :0]
+        return self._frames[slot, self._window(slot)]
 
     def get_state_history(self, bottle_id):
-        return list(self.bottle_states[bottle_id])
+        return [self.state_labels[code] for code in self.get_state_codes(bottle_id) if code != UNKNOWN_STATE]
 
     def get_position(self, bottle_id):
-        return self.bottle_positions.get(bottle_id, None)
+        slot = self._slots.get(bottle_id)
+        if slot is None:
+            return None
+        x, y = self._positions[slot, self._write_index[slot]]
+        return (int(x), int(y))
 
     def get_position_history(self, bottle_id):
-        return list(self.bottle_position_history[bottle_id])
+        return [(int(x), int(y)) for x, y in self.get_positions(bottle_id)]
+
+    def get_last_seen(self, bottle_id):
+        slot = self._slots.get(bottle_id)
+        return None if slot is None else int(self._last_seen[slot])
 
     def get_all_bottles(self):
-        return list(self.bottle_states.keys())
\ No newline at end of file
+        return list(self._slots.keys())
+
+    def __len__(self):
+        return len(self._slots)
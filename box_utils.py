@@ -0,0 +1,77 @@
+import warnings
+
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+
+def as_xyxy_array(boxes):
+    boxes = np.asarray(boxes, dtype=np.float32)
+    return boxes.reshape(-1, 4)
+
+
+def ltwh_to_xyxy(boxes):
+    boxes = as_xyxy_array(boxes).copy()
+    boxes[:, 2] += boxes[:, 0]
+    boxes[:, 3] += boxes[:, 1]
+    return boxes
+
+
+def iou_matrix(boxes_a, boxes_b):
+    a = as_xyxy_array(boxes_a)
+    b = as_xyxy_array(boxes_b)
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), dtype=np.float32)
+
+    inter_w = np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0])
+    inter_h = np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1])
+    inter = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0).astype(np.float32)
+
+
+def assign_by_iou(iou, iou_threshold, method='hungarian'):
+    if iou.size == 0:
+        return []
+
+    if method == 'hungarian' and linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(-iou)
+        return [(r, c) for r, c in zip(rows.tolist(), cols.tolist()) if iou[r, c] > iou_threshold]
+    if method == 'hungarian':
+        # Shown once per process by the default warnings filter.
+        warnings.warn("scipy is not installed; falling back to greedy IoU assignment.", RuntimeWarning)
+
+    # Greedy: repeatedly take the best remaining pair above the threshold.
+    matches = []
+    order = np.argsort(-iou, axis=None)
+    used_rows, used_cols = set(), set()
+    for flat_index in order:
+        r, c = divmod(int(flat_index), iou.shape[1])
+        if iou[r, c] <= iou_threshold:
+            break
+        if r in used_rows or c in used_cols:
+            continue
+        matches.append((r, c))
+        used_rows.add(r)
+        used_cols.add(c)
+    return matches
+
+
+def non_max_suppression(boxes, scores, iou_threshold=0.5):
+    boxes = as_xyxy_array(boxes)
+    order = np.argsort(-np.asarray(scores, dtype=np.float32))
+    keep = []
+    while len(order):
+        best = order[0]
+        keep.append(int(best))
+        if len(order) == 1:
+            break
+        overlaps = iou_matrix(boxes[best:best + 1], boxes[order[1:]])[0]
+        order = order[1:][overlaps <= iou_threshold]
+    return keep
@@ -0,0 +1,209 @@
+import cv2
+import numpy as np
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_FORMATS = ('png', 'jpeg')
+LABEL_FLUSH_EVERY = 200
+
+
+def encode_image(frame, image_format='png', jpeg_quality=90, png_compression=1):
+    if image_format == 'jpeg':
+        ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+    elif image_format == 'png':
+        ok, buffer = cv2.imencode('.png', frame, [cv2.IMWRITE_PNG_COMPRESSION, png_compression])
+    else:
+        raise ValueError(f"Unknown image format '{image_format}'. Use one of {IMAGE_FORMATS}.")
+    if not ok:
+        raise RuntimeError(f"Could not encode frame as {image_format}.")
+    return buffer.tobytes()
+
+
+def image_extension(image_format):
+    return '.jpg' if image_format == 'jpeg' else '.png'
+
+
+def parse_label_lines(frame_index, label_lines):
+    rows = []
+    for line in label_lines:
+        class_id, x_center, y_center, width, height = line.split()
+        rows.append((frame_index, int(class_id), float(x_center), float(y_center), float(width), float(height)))
+    return rows
+
+
+class _EncodingWriter:
+    # Frames are encoded on a small thread pool (cv2.imencode releases the
+    # GIL); at most max_pending encodes are queued so memory stays bounded.
+    def __init__(self, image_format='png', jpeg_quality=90, png_compression=1, encoder_threads=4, max_pending=16):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unknown image format '{image_format}'. Use one of {IMAGE_FORMATS}.")
+        self.image_format = image_format
+        self.jpeg_quality = jpeg_quality
+        self.png_compression = png_compression
+        self.images = 0
+        self.bytes = 0
+        self.started = time.time()
+        self._executor = ThreadPoolExecutor(max_workers=encoder_threads, thread_name_prefix='encode')
+        self._slots = threading.Semaphore(max_pending)
+        self._pending = deque()
+
+    def _encode(self, frame):
+        try:
+            return encode_image(frame, self.image_format, self.jpeg_quality, self.png_compression)
+        finally:
+            self._slots.release()
+
+    def _submit(self, frame):
+        self._slots.acquire()
+        return self._executor.submit(self._encode, frame)
+
+    def stats(self):
+        elapsed = time.time() - self.started
+        return {
+            'images': self.images,
+            'bytes': self.bytes,
+            'seconds': elapsed,
+            'images_per_second': self.images / elapsed if elapsed > 0 else 0.0,
+            'bytes_per_image': self.bytes / self.images if self.images else 0.0
+        }
+
+    def _shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class YoloDirectoryWriter(_EncodingWriter):
+    # Writes the images/ + labels/ layout expected by dataset.yaml. Label files
+    # are buffered and written in bulk every LABEL_FLUSH_EVERY frames.
+    def __init__(self, root='data', **kwargs):
+        super().__init__(**kwargs)
+        self.images_dir = os.path.join(root, 'images')
+        self.labels_dir = os.path.join(root, 'labels')
+        os.makedirs(self.images_dir, exist_ok=True)
+        os.makedirs(self.labels_dir, exist_ok=True)
+        self._labels = []
+
+    def _write_image(self, frame, path):
+        data = self._encode(frame)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return len(data)
+
+    def write(self, frame_index, frame, label_lines):
+        path = os.path.join(self.images_dir, f'frame_{frame_index:05d}{image_extension(self.image_format)}')
+        self._slots.acquire()
+        self._pending.append(self._executor.submit(self._write_image, frame, path))
+        while self._pending and self._pending[0].done():
+            self._collect(self._pending.popleft())
+
+        if label_lines:
+            self._labels.append((frame_index, label_lines))
+            if len(self._labels) >= LABEL_FLUSH_EVERY:
+                self._flush_labels()
+
+    def _collect(self, future):
+        self.bytes += future.result()
+        self.images += 1
+
+    def _flush_labels(self):
+        for frame_index, label_lines in self._labels:
+            with open(os.path.join(self.labels_dir, f'frame_{frame_index:05d}.txt'), 'w') as f:
+                f.writelines(label_lines)
+        self._labels = []
+
+    def close(self):
+        while self._pending:
+            self._collect(self._pending.popleft())
+        self._flush_labels()
+        self._shutdown()
+        return self.stats()
+
+
+class ShardArchiveWriter(_EncodingWriter):
+    # One archive per shard instead of thousands of small files:
+    #   <name>.bin        encoded images, back to back
+    #   <name>.index.npy  int64 rows of (frame_index, offset, length)
+    #   <name>.labels.npy float32 rows of (frame_index, class, xc, yc, w, h)
+    # Both .npy files can be memory-mapped for random access.
+    def __init__(self, root='data/shards', name='shard_000000', **kwargs):
+        super().__init__(**kwargs)
+        os.makedirs(root, exist_ok=True)
+        self.base_path = os.path.join(root, name)
+        self._archive = open(self.base_path + '.bin', 'wb')
+        self._index = []
+        self._labels = []
+
+    def write(self, frame_index, frame, label_lines):
+        self._pending.append((frame_index, self._submit(frame)))
+        while self._pending and self._pending[0][1].done():
+            self._append(*self._pending.popleft())
+        if label_lines:
+            self._labels.extend(parse_label_lines(frame_index, label_lines))
+
+    def _append(self, frame_index, future):
+        data = future.result()
+        self._index.append((frame_index, self._archive.tell(), len(data)))
+        self._archive.write(data)
+        self.bytes += len(data)
+        self.images += 1
+
+    def close(self):
+        while self._pending:
+            self._append(*self._pending.popleft())
+        self._archive.close()
+        np.save(self.base_path + '.index.npy', np.array(self._index, dtype=np.int64).reshape(-1, 3))
+        np.save(self.base_path + '.labels.npy', np.array(self._labels, dtype=np.float32).reshape(-1, 6))
+        self._shutdown()
+        return self.stats()
+
+
+def create_writer(output_format, root='data', shard_name='shard_000000', **kwargs):
+    if output_format in IMAGE_FORMATS:
+        return YoloDirectoryWriter(root, image_format=output_format, **kwargs)
+    if output_format.startswith('shards'):
+        # 'shards' stores PNG inside the archive, 'shards-jpeg' stores JPEG.
+        image_format = output_format.partition('-')[2] or 'png'
+        return ShardArchiveWriter(os.path.join(root, 'shards'), shard_name, image_format=image_format, **kwargs)
+    raise ValueError(f"Unknown output format '{output_format}'. Use 'png', 'jpeg', 'shards' or 'shards-jpeg'.")
+
+
+def iter_shard(base_path):
+    index = np.load(base_path + '.index.npy', mmap_mode='r')
+    labels = np.load(base_path + '.labels.npy', mmap_mode='r')
+    label_frames = labels[:, 0]
+    with open(base_path + '.bin', 'rb') as archive:
+        for frame_index, offset, length in index:
+            archive.seek(offset)
+            # Labels are written in frame order, so each frame's rows are one run.
+            lo = np.searchsorted(label_frames, frame_index, side='left')
+            hi = np.searchsorted(label_frames, frame_index, side='right')
+            yield int(frame_index), archive.read(length), labels[lo:hi, 1:]
+
+
+def export_yolo(shards_dir='data/shards', output_root='data'):
+    images_dir = os.path.join(output_root, 'images')
+    labels_dir = os.path.join(output_root, 'labels')
+    os.makedirs(images_dir, exist_ok=True)
+    os.makedirs(labels_dir, exist_ok=True)
+
+    exported = 0
+    for name in sorted(os.listdir(shards_dir)):
+        if not name.endswith('.bin'):
+            continue
+        for frame_index, data, rows in iter_shard(os.path.join(shards_dir, name[:-len('.bin')])):
+            # Encoded bytes are copied as-is; sniff the format from the header.
+            extension = '.png' if data[:8] == b'\x89PNG\r\n\x1a\n' else '.jpg'
+            with open(os.path.join(images_dir, f'frame_{frame_index:05d}{extension}'), 'wb') as f:
+                f.write(data)
+            if len(rows):
+                with open(os.path.join(labels_dir, f'frame_{frame_index:05d}.txt'), 'w') as f:
+                    f.writelines(f"{int(row[0])} {row[1]:.6f} {row[2]:.6f} {row[3]:.6f} {row[4]:.6f}\n" for row in rows)
+            exported += 1
+    return exported
+
+
+if __name__ == '__main__':
+    count = export_yolo()
+    print(f"Exported {count} frames from 'data/shards' to the YOLO layout in 'data/'.")
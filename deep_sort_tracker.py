@@ -1,9 +1,27 @@
+import logging
 from deep_sort_realtime.deepsort_tracker import DeepSort
 import numpy as np
+from box_utils import iou_matrix, ltwh_to_xyxy, assign_by_iou
+
+logger = logging.getLogger('factorysense.tracker')
+# Quiet unless the application explicitly turns tracker diagnostics on, e.g.
+# logging.getLogger('factorysense.tracker').setLevel(logging.DEBUG).
+logger.addHandler(logging.NullHandler())
+
+LABEL_IOU_THRESHOLD = 0.3
+
 
 class DeepSortTracker:
-    def __init__(self, max_age=60, n_init=3, max_cosine_distance=0.6):
-        self.tracker = DeepSort(max_age=max_age, n_init=n_init, max_cosine_distance=max_cosine_distance)
+    def __init__(self, max_age=60, n_init=3, max_cosine_distance=0.6, assignment='hungarian', embedder='mobilenet'):
+        # embedder=None runs without appearance features, e.g. when replaying
+        # recorded detections that have no frames: every detection then gets
+        # the same embedding and association relies on the Kalman gate alone.
+        self.tracker = DeepSort(max_age=max_age, n_init=n_init, max_cosine_distance=max_cosine_distance,
+                                embedder=embedder)
+        self.use_appearance = embedder is not None
+        self.assignment = assignment
+        self._last_labels = {}
+        self._last_conf = {}
 
     def update_tracks(self, detections, frame=None):
         formatted_detections = []
@@ -17,67 +35,97 @@ class DeepSortTracker:
                 ([int(x1), int(y1), int(width), int(height)], det['conf'], generic_class_for_tracker)
             )
 
-        tracked_objects = self.tracker.update_tracks(formatted_detections, frame=frame)
+        embeds = None if self.use_appearance else [np.ones(1, dtype=np.float32)] * len(formatted_detections)
+        tracked_objects = self.tracker.update_tracks(formatted_detections, embeds=embeds, frame=frame)
+        confirmed = [track for track in tracked_objects if track.is_confirmed()]
+        live_ids = {track.track_id for track in tracked_objects}
+        self._last_labels = {k: v for k, v in self._last_labels.items() if k in live_ids}
+        self._last_conf = {k: v for k, v in self._last_conf.items() if k in live_ids}
+        if not confirmed:
+            return []
+
+        track_boxes = np.array([track.to_ltwh() for track in confirmed], dtype=np.float32)
+        matches = self._match_labels(ltwh_to_xyxy(track_boxes), detections)
 
         output = []
-        for track in tracked_objects:
-            if not track.is_confirmed():
+        for track_index, det_index in matches:
+            track = confirmed[track_index]
+            if track.det_conf is None:
+                # Coasting track without a detection this frame.
+                logger.debug("Skipping track %s without a current detection.", track.track_id)
                 continue
-
             try:
-                track_id = track.track_id
-                l, t, w, h = track.to_ltwh()
-
-                original_detection = self._find_best_match_by_iou([l,t,w,h], detections)
-                if original_detection:
-                    specific_label = original_detection['label']
-                    output.append({
-                        'id': track_id,
-                        'label': specific_label,
-                        'bbox': [int(l), int(t), int(l + w), int(t + h)],
-                        'conf': round(track.det_conf, 2)
-                    })
+                l, t, w, h = track_boxes[track_index]
+                self._last_labels[track.track_id] = detections[det_index]['label']
+                self._last_conf[track.track_id] = track.det_conf
+                output.append({
+                    'id': track.track_id,
+                    'label': detections[det_index]['label'],
+                    'bbox': [int(l), int(t), int(l + w), int(t + h)],
+                    'conf': round(track.det_conf, 2)
+                })
             except Exception as e:
-                print(f"[WARN] Could not process track: {e}")
+                logger.warning("Could not process track: %s", e)
 
         return output
 
-    def _calculate_iou(self, boxA, boxB):
-        boxA = [boxA[0], boxA[1], boxA[0] + boxA[2], boxA[1] + boxA[3]]
-
-        xA = max(boxA[0], boxB[0])
-        yA = max(boxA[1], boxB[1])
-        xB = min(boxA[2], boxB[2])
-        yB = min(boxA[3], boxB[3])
-
-        interArea = max(0, xB - xA) * max(0, yB - yA)
-        boxAArea = (boxA[2] - boxA[0]) * (boxA[3] - boxA[1])
-        boxBArea = (boxB[2] - boxB[0]) * (boxB[3] - boxB[1])
-
-        iou = interArea / float(boxAArea + boxBArea - interArea)
-        return iou
-
-    def _find_best_match_by_iou(self, track_bbox, detections):
-        best_iou = 0.0
-        best_match = None
-        iou_threshold = 0.3 
-
-        print(f"[TRACKER_DEBUG] Finding match for track_bbox: {[int(x) for x in track_bbox]}")
-
-        for det in detections:
-            iou = self._calculate_iou(track_bbox, det['bbox'])
-
-            print(f"[TRACKER_DEBUG]  ... vs detection_bbox: {det['bbox']} (label: {det['label']}) -> IoU: {iou:.2f}")
-
-            if iou > best_iou:
-                best_iou = iou
-                best_match = det
-
-        if best_iou > iou_threshold:
-            
-            print(f"[TRACKER_SUCCESS] Match found with IoU: {best_iou:.2f}! Assigning label: '{best_match['label']}'")
-            return best_match
-        if detections: 
-            print(f"[TRACKER_FAILURE] No suitable match found for track. Best IoU was {best_iou:.2f}, but threshold is {iou_threshold}.")
+    def _match_labels(self, track_boxes, detections):
+        if not detections:
+            return []
+
+        det_boxes = np.array([det['bbox'] for det in detections], dtype=np.float32)
+        iou = iou_matrix(track_boxes, det_boxes)
+        matches = assign_by_iou(iou, LABEL_IOU_THRESHOLD, method=self.assignment)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            matched_tracks = {r for r, _ in matches}
+            for r, c in matches:
+                logger.debug("Track box %s matched detection %s (label: %s) with IoU %.2f",
+                             track_boxes[r].astype(int).tolist(), detections[c]['bbox'], detections[c]['label'], iou[r, c])
+            for r in range(len(track_boxes)):
+                if r not in matched_tracks:
+                    best_iou = float(iou[r].max()) if iou.shape[1] else 0.0
+                    logger.debug("No suitable match for track box %s. Best IoU was %.2f, threshold is %s.",
+                                 track_boxes[r].astype(int).tolist(), best_iou, LABEL_IOU_THRESHOLD)
+        return matches
+
+    def predict_tracks(self, track_ids=None):
+        # Advances DeepSORT's Kalman filters one frame without a measurement,
+        # for frames on which the detector is skipped. time_since_update keeps
+        # growing, so the next real update still ages out lost tracks.
+        self.tracker.tracker.predict()
+        wanted = None if track_ids is None else set(track_ids)
+        output = []
+        for track in self.tracker.tracker.tracks:
+            if not track.is_confirmed() or track.track_id not in self._last_labels:
+                continue
+            if wanted is not None and track.track_id not in wanted:
+                continue
+            l, t, w, h = track.to_ltwh()
+            output.append({
+                'id': track.track_id,
+                'label': self._last_labels[track.track_id],
+                'bbox': [int(l), int(t), int(l + w), int(t + h)],
+                'conf': round(self._last_conf[track.track_id], 2)
+            })
+        return output
 
-        return None
\ No newline at end of file
+    def predicted_detections(self, track_ids=None):
+        # One-step-ahead boxes from DeepSORT's Kalman state (x, y, a, h and
+        # their velocities), in detection format.
+        wanted = None if track_ids is None else set(track_ids)
+        detections = []
+        for track in self.tracker.tracker.tracks:
+            if not track.is_confirmed() or track.track_id not in self._last_labels:
+                continue
+            if wanted is not None and track.track_id not in wanted:
+                continue
+            x, y, a, h = np.asarray(track.mean[:4]) + np.asarray(track.mean[4:8])
+            w = a * h
+            detections.append({
+                'id': track.track_id,
+                'bbox': [int(x - w / 2), int(y - h / 2), int(x + w / 2), int(y + h / 2)],
+                'conf': track.det_conf if track.det_conf is not None else 1.0,
+                'label': self._last_labels[track.track_id]
+            })
+        return detections
@@ -0,0 +1,359 @@
+import argparse
+import itertools
+import json
+import os
+import re
+import time
+import numpy as np
+from multiprocessing import Pool
+from bottle_tracker import BottleTracker
+from anomaly_detector import AnomalyDetector
+from motion_gate import DETECT, PREDICT, box_center_x, settled_predictions
+from line_layout import LineLayout, load_line_layout
+
+# Replays use the frame width the recording was made with to drop predicted
+# boxes that have left the belt, exactly as the live track stage does.
+DEFAULT_FRAME_WIDTH = 1280
+# Frames per part file: a minute of video at 30 fps.
+CHUNK_FRAMES = 1800
+
+# Parameter grid for `python detection_log.py <log>`; every combination is
+# replayed in its own worker process.
+SWEEP_GRID = {
+    'tracker': {'max_age': [30, 60], 'n_init': [2, 3]},
+    'anomaly': {'stuck_frame_count': [5, 10], 'stuck_pixel_threshold': [3, 5]}
+}
+
+
+def _code(vocabulary, value):
+    if value not in vocabulary:
+        vocabulary[value] = len(vocabulary)
+    return vocabulary[value]
+
+
+def part_path(path, index):
+    base, extension = os.path.splitext(path)
+    return f"{base}.{index:05d}{extension or '.npz'}"
+
+
+def list_parts(path):
+    # Part files of the log at path, in recording order.
+    base, extension = os.path.splitext(path)
+    directory = os.path.dirname(base) or '.'
+    pattern = re.compile(re.escape(os.path.basename(base)) + r'\.(\d{5})' + re.escape(extension or '.npz') + '$')
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    parts = sorted((int(match.group(1)), name) for name in names for match in [pattern.match(name)] if match)
+    return [os.path.join(os.path.dirname(base), name) for _, name in parts]
+
+
+class DetectionLogWriter:
+    # Columnar log of what the track stage saw on every frame: the detector
+    # output (or None on frames the motion gate skipped), the tracker output
+    # and the simulator's ground-truth states. Rows are buffered for
+    # chunk_frames frames at a time, then written as the next compressed part
+    # file (recording.00000.npz, recording.00001.npz, ... for recording.npz),
+    # so memory stays flat however long the run and a crash loses at most the
+    # frames since the last part. Each part holds:
+    #   frame_index, frame_mode, det_count, track_count, gt_count  per frame
+    #   det_boxes/det_conf/det_label                                per detection
+    #   track_id/track_boxes/track_conf/track_label                 per tracked object
+    #   gt_bottle/gt_label                                          per ground-truth bottle
+    # Strings (labels, track ids, modes) are stored once per part in
+    # vocabulary arrays, and the line layout the recording was made with as a
+    # JSON string.
+    def __init__(self, path, layout=None, frame_width=DEFAULT_FRAME_WIDTH, chunk_frames=CHUNK_FRAMES):
+        self.path = path
+        self.layout = layout or LineLayout(width=frame_width)
+        self.frame_width = frame_width
+        self.chunk_frames = chunk_frames
+        self.parts = 0
+        self.frames_written = 0
+        # Parts left by an earlier recording to the same path would otherwise
+        # be read back as part of this one.
+        for stale_part in list_parts(path):
+            os.remove(stale_part)
+        self._reset()
+
+    def _reset(self):
+        self._frames = []
+        self._det_boxes, self._det_conf, self._det_label = [], [], []
+        self._track_id, self._track_boxes, self._track_conf, self._track_label = [], [], [], []
+        self._gt_bottle, self._gt_label = [], []
+        self._labels, self._track_ids, self._modes = {}, {}, {}
+
+    def record(self, frame_index, detections, tracked_objects, ground_truth_states, detection_mode=DETECT):
+        if detections is None:
+            det_count = -1
+        else:
+            det_count = len(detections)
+            for det in detections:
+                self._det_boxes.append(det['bbox'])
+                self._det_conf.append(det['conf'])
+                self._det_label.append(_code(self._labels, det['label']))
+
+        for obj in tracked_objects:
+            self._track_id.append(_code(self._track_ids, str(obj['id'])))
+            self._track_boxes.append(obj['bbox'])
+            self._track_conf.append(obj['conf'] if obj['conf'] is not None else np.nan)
+            self._track_label.append(_code(self._labels, obj['label']))
+
+        for bottle_id, state in ground_truth_states.items():
+            self._gt_bottle.append(bottle_id)
+            self._gt_label.append(_code(self._labels, state))
+
+        self._frames.append((frame_index, _code(self._modes, detection_mode), det_count,
+                             len(tracked_objects), len(ground_truth_states)))
+        if len(self._frames) >= self.chunk_frames:
+            self.flush()
+
+    def __len__(self):
+        return self.frames_written + len(self._frames)
+
+    def flush(self):
+        # Writes the buffered frames as the next part. The part appears under
+        # its final name only once it is complete.
+        if not self._frames:
+            return
+        path = part_path(self.path, self.parts)
+        with open(path + '.tmp', 'wb') as f:
+            self._write_part(f)
+        os.replace(path + '.tmp', path)
+        self.parts += 1
+        self.frames_written += len(self._frames)
+        self._reset()
+
+    def _write_part(self, f):
+        frames = np.array(self._frames, dtype=np.int64).reshape(-1, 5)
+        np.savez_compressed(
+            f,
+            frame_index=frames[:, 0].astype(np.int32),
+            frame_mode=frames[:, 1].astype(np.int8),
+            det_count=frames[:, 2].astype(np.int32),
+            track_count=frames[:, 3].astype(np.int32),
+            gt_count=frames[:, 4].astype(np.int32),
+            det_boxes=np.array(self._det_boxes, dtype=np.int32).reshape(-1, 4),
+            det_conf=np.array(self._det_conf, dtype=np.float32),
+            det_label=np.array(self._det_label, dtype=np.int16),
+            track_id=np.array(self._track_id, dtype=np.int32),
+            track_boxes=np.array(self._track_boxes, dtype=np.int32).reshape(-1, 4),
+            track_conf=np.array(self._track_conf, dtype=np.float32),
+            track_label=np.array(self._track_label, dtype=np.int16),
+            gt_bottle=np.array(self._gt_bottle, dtype=np.int32),
+            gt_label=np.array(self._gt_label, dtype=np.int16),
+            labels=np.array(list(self._labels), dtype=np.str_),
+            track_ids=np.array(list(self._track_ids), dtype=np.str_),
+            modes=np.array(list(self._modes), dtype=np.str_),
+            layout=np.array(json.dumps(self.layout.to_dict()), dtype=np.str_),
+            frame_width=np.int32(self.frame_width)
+        )
+
+    def close(self):
+        self.flush()
+        return len(self)
+
+
+class DetectionLog:
+    # Loads a log written by DetectionLogWriter, joining its parts into one
+    # set of columns, and hands its frames back in the same shape as the live
+    # pipeline's packets. A single .npz from before logs were split into parts
+    # loads the same way.
+    def __init__(self, path):
+        paths = list_parts(path) or ([path] if os.path.exists(path) else [])
+        if not paths:
+            raise FileNotFoundError(f"Detection log '{path}' not found.")
+
+        vocabularies = {'labels': {}, 'track_ids': {}, 'modes': {}}
+        coded_columns = {'labels': ('det_label', 'track_label', 'gt_label'), 'track_ids': ('track_id',),
+                         'modes': ('frame_mode',)}
+        columns = {}
+        for part in paths:
+            with np.load(part) as data:
+                part_data = {name: data[name] for name in data.files}
+            # Codes are local to each part; map them onto one vocabulary.
+            for vocabulary, names in coded_columns.items():
+                codes = np.array([_code(vocabularies[vocabulary], value)
+                                  for value in part_data[vocabulary].tolist()], dtype=np.int64)
+                for name in names:
+                    part_data[name] = codes[part_data[name]].astype(part_data[name].dtype)
+            for name, column in part_data.items():
+                columns.setdefault(name, []).append(column)
+
+        d = {name: np.concatenate(parts) if parts[0].ndim else parts[0] for name, parts in columns.items()}
+        self._data = d
+        self.labels = list(vocabularies['labels'])
+        self.track_ids = list(vocabularies['track_ids'])
+        self.modes = list(vocabularies['modes'])
+        self.frame_width = int(d['frame_width'])
+        if 'layout' in d:
+            self.layout = LineLayout.from_dict(json.loads(str(d['layout'])), self.frame_width)
+        else:
+            # Logs from before line_layout.yaml were all recorded on the line
+            # it now describes.
+            self.layout = load_line_layout(width=self.frame_width)
+        self.zones = self.layout.ranges
+        self._det_offsets = np.concatenate([[0], np.cumsum(np.maximum(d['det_count'], 0))])
+        self._track_offsets = np.concatenate([[0], np.cumsum(d['track_count'])])
+        self._gt_offsets = np.concatenate([[0], np.cumsum(d['gt_count'])])
+
+    def __len__(self):
+        return len(self._data['frame_index'])
+
+    def __getitem__(self, i):
+        d = self._data
+        labels = self.labels
+
+        detections = None
+        if d['det_count'][i] >= 0:
+            lo, hi = self._det_offsets[i], self._det_offsets[i + 1]
+            detections = [
+                {'bbox': box, 'conf': conf, 'label': labels[label]}
+                for box, conf, label in zip(d['det_boxes'][lo:hi].tolist(), d['det_conf'][lo:hi].tolist(),
+                                            d['det_label'][lo:hi].tolist())
+            ]
+
+        lo, hi = self._track_offsets[i], self._track_offsets[i + 1]
+        tracked_objects = [
+            {'id': self.track_ids[track_id], 'label': labels[label], 'bbox': box, 'conf': conf}
+            for track_id, box, conf, label in zip(d['track_id'][lo:hi].tolist(), d['track_boxes'][lo:hi].tolist(),
+                                                  d['track_conf'][lo:hi].tolist(), d['track_label'][lo:hi].tolist())
+        ]
+
+        lo, hi = self._gt_offsets[i], self._gt_offsets[i + 1]
+        ground_truth_states = {bottle_id: labels[label]
+                               for bottle_id, label in zip(d['gt_bottle'][lo:hi].tolist(),
+                                                           d['gt_label'][lo:hi].tolist())}
+
+        return {
+            'frame_index': int(d['frame_index'][i]),
+            'detection_mode': self.modes[d['frame_mode'][i]],
+            'detections': detections,
+            'tracked_objects': tracked_objects,
+            'ground_truth_states': ground_truth_states
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def create_replay_tracker(backend='sort', **params):
+    if backend == 'sort':
+        from sort_tracker import SortTracker
+        return SortTracker(**params)
+    if backend == 'deepsort':
+        # No frames are recorded, so DeepSORT runs without its embedder.
+        from deep_sort_tracker import DeepSortTracker
+        return DeepSortTracker(embedder=None, **params)
+    raise ValueError(f"Unknown tracker backend '{backend}'. Use 'sort' or 'deepsort'.")
+
+
+def replay(log, tracker_backend='sort', tracker_params=None, anomaly_params=None, history_length=50,
+           stale_after=90, use_recorded_tracks=False):
+    # Runs the track stage of main.py over a recorded log: the tracker (unless
+    # use_recorded_tracks), BottleTracker and AnomalyDetector, with no
+    # rendering or inference. Returns when each anomaly was first raised.
+    tracker = None if use_recorded_tracks else create_replay_tracker(tracker_backend, **(tracker_params or {}))
+    bottle_tracker = BottleTracker(max_history=history_length, stale_after=stale_after)
+    anomaly_detector = AnomalyDetector(layout=log.layout, history_window=history_length, stale_after=stale_after,
+                                       **(anomaly_params or {}))
+
+    detected_x = {}
+    first_raised = {}
+    track_ids = set()
+    tracked_total = 0
+    started = time.perf_counter()
+
+    for frame in log:
+        if use_recorded_tracks:
+            tracked_objects = frame['tracked_objects']
+        else:
+            if frame['detection_mode'] == PREDICT:
+                tracked_objects = [obj for obj in tracker.predict_tracks(detected_x)
+                                   if 0 <= box_center_x(obj['bbox']) < log.frame_width]
+            else:
+                tracked_objects = tracker.update_tracks(frame['detections'] or [])
+
+        # Same handling of predicted boxes as the live track stage.
+        observed = tracked_objects
+        if frame['detection_mode'] == DETECT:
+            detected_x = {obj['id']: box_center_x(obj['bbox']) for obj in tracked_objects}
+        elif frame['detection_mode'] == PREDICT:
+            observed = settled_predictions(tracked_objects, detected_x, log.layout)
+
+        frame_index = frame['frame_index']
+        bottle_tracker.update(observed, frame_index=frame_index)
+        anomaly_detector.update(observed, frame_index=frame_index)
+        for anomaly in anomaly_detector.evaluate(history_lookup=bottle_tracker.get_state_history):
+            first_raised.setdefault((str(anomaly['bottle_id']), anomaly['type']), frame_index)
+
+        track_ids.update(obj['id'] for obj in tracked_objects)
+        tracked_total += len(tracked_objects)
+
+    elapsed = time.perf_counter() - started
+    return {
+        'frames': len(log),
+        'frames_per_second': len(log) / elapsed if elapsed > 0 else 0.0,
+        'tracks': len(track_ids),
+        'tracked_per_frame': tracked_total / len(log) if len(log) else 0.0,
+        'anomalies': [{'bottle_id': bottle_id, 'type': anomaly_type, 'frame_index': frame_index}
+                      for (bottle_id, anomaly_type), frame_index in sorted(first_raised.items(),
+                                                                           key=lambda item: item[1])]
+    }
+
+
+def parameter_grid(grid=SWEEP_GRID):
+    # Expands {'tracker': {...}, 'anomaly': {...}} into one dict of tracker
+    # and anomaly parameters per combination.
+    keys = [(group, name) for group in sorted(grid) for name in sorted(grid[group])]
+    for values in itertools.product(*(grid[group][name] for group, name in keys)):
+        params = {group: {} for group in grid}
+        for (group, name), value in zip(keys, values):
+            params[group][name] = value
+        yield params
+
+
+_replay_log = None
+
+
+def _load_replay_log(path):
+    # Pool initializer: each worker decodes the log once for all its runs.
+    global _replay_log
+    _replay_log = DetectionLog(path)
+
+
+def _replay_one(job):
+    tracker_backend, params = job
+    result = replay(_replay_log, tracker_backend, params.get('tracker'), params.get('anomaly'))
+    result['params'] = params
+    return result
+
+
+def sweep(path, grid=SWEEP_GRID, tracker_backend='sort', workers=None):
+    jobs = [(tracker_backend, params) for params in parameter_grid(grid)]
+    with Pool(workers or os.cpu_count() or 1, initializer=_load_replay_log, initargs=(path,)) as pool:
+        return pool.map(_replay_one, jobs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a detection log through the tracker and anomaly detector.")
+    parser.add_argument('log', help="Log written with RECORD_PATH set in main.py.")
+    parser.add_argument('--tracker', default='sort', choices=('sort', 'deepsort'))
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default=None, help="Write all results to this JSON file.")
+    args = parser.parse_args()
+
+    results = sweep(args.log, SWEEP_GRID, args.tracker, args.workers)
+    for result in results:
+        print(f"{json.dumps(result['params'], sort_keys=True)}: {len(result['anomalies'])} anomalies, "
+              f"{result['tracks']} tracks, {result['tracked_per_frame']:.1f} tracked per frame, "
+              f"{result['frames_per_second']:.0f} frames/s")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+SECONDS_PER_HOUR = 3600
+# A batch that fails to write (e.g. the store is locked or the disk is full)
+# is retried with the next one, and only given up after this many attempts.
+WRITE_ATTEMPTS = 3
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS events ("
+    "id INTEGER PRIMARY KEY, time REAL NOT NULL, line INTEGER NOT NULL, bottle_id TEXT NOT NULL, "
+    "type TEXT NOT NULL, frame_index INTEGER, position INTEGER, state_history TEXT, details TEXT, "
+    "explanation TEXT)",
+    "CREATE INDEX IF NOT EXISTS idx_events_time ON events (time)",
+    "CREATE INDEX IF NOT EXISTS idx_events_type_time ON events (type, time)",
+    "CREATE INDEX IF NOT EXISTS idx_events_bottle ON events (bottle_id, time)",
+    # Per-hour counts maintained by the writer, so questions like "stuck
+    # bottles per hour" never scan the events themselves.
+    "CREATE TABLE IF NOT EXISTS hourly_counts ("
+    "hour INTEGER NOT NULL, line INTEGER NOT NULL, type TEXT NOT NULL, count INTEGER NOT NULL, "
+    "PRIMARY KEY (type, hour, line)) WITHOUT ROWID"
+)
+
+
+def _compact_history(states):
+    # Runs of the same state are stored once with their length, e.g.
+    # 'filling*40>filled*12', which keeps a 50-frame history to a few bytes.
+    runs = []
+    for state in states:
+        state = str(state).replace('bottle_', '')
+        if runs and runs[-1][0] == state:
+            runs[-1][1] += 1
+        else:
+            runs.append([state, 1])
+    return '>'.join(f'{state}*{n}' if n > 1 else state for state, n in runs)
+
+
+def _event_row(event_id, event):
+    details = event.get('details')
+    if details is not None and not isinstance(details, str):
+        details = json.dumps(details, default=str)
+    return (
+        event_id, event['time'], event.get('line', 1), str(event['bottle_id']), event['type'],
+        event.get('frame_index'), event.get('position'), _compact_history(event.get('state_history') or ()),
+        details, event.get('explanation')
+    )
+
+
+class _BatchedEventSink:
+    # record() only assigns an id and enqueues the event; a writer thread
+    # drains the queue and stores whatever has accumulated, up to batch_size
+    # events, at least every flush_interval seconds. Explanations arrive
+    # later from the LLM and are queued as updates of an earlier event. When
+    # the queue is full new events are dropped and counted rather than
+    # stalling the pipeline.
+    def __init__(self, batch_size=500, flush_interval=1.0, queue_size=10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self._last_id_time = 0
+        self._id_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = threading.Thread(target=self._run, name=f'{type(self).__name__}-writer', daemon=True)
+        self._writer.start()
+
+    def _next_id(self):
+        # Ids are handed out before the rows are written so explanations can
+        # refer to them: microseconds since the epoch (47 bits, unique within
+        # this process) above 16 bits of the process id, so several processes
+        # writing to one store never collide.
+        with self._id_lock:
+            self._last_id_time = max(time.time_ns() // 1000, self._last_id_time + 1)
+            return (self._last_id_time % (1 << 47)) << 16 | (os.getpid() & 0xffff)
+
+    def record(self, event):
+        event_id = self._next_id()
+        try:
+            self._queue.put_nowait(('event', event_id, event))
+            self.recorded += 1
+        except queue.Full:
+            self.dropped += 1
+        return event_id
+
+    def set_explanation(self, event_id, explanation):
+        try:
+            self._queue.put_nowait(('explanation', event_id, explanation))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        stopping = False
+        failed, attempts = [], 0
+        while not stopping or failed:
+            batch = list(failed)
+            deadline = time.time() + self.flush_interval
+            if stopping:
+                # Nothing more to collect; give the store time to recover.
+                time.sleep(self.flush_interval)
+            while not stopping and len(batch) < len(failed) + self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            if not batch:
+                continue
+            events = [(event_id, event) for kind, event_id, event in batch if kind == 'event']
+            explanations = [(event_id, text) for kind, event_id, text in batch if kind == 'explanation']
+            try:
+                self._write_batch(events, explanations)
+                self.written += len(events)
+                failed, attempts = [], 0
+            except Exception as e:
+                attempts += 1
+                if attempts < WRITE_ATTEMPTS:
+                    print(f"[EVENTS] Could not write {len(events)} events and {len(explanations)} explanations, "
+                          f"retrying: {e}")
+                    failed = batch
+                else:
+                    print(f"[EVENTS] Dropping {len(events)} events and {len(explanations)} explanations after "
+                          f"{attempts} failed writes: {e}")
+                    self.dropped += len(batch)
+                    failed, attempts = [], 0
+        self._close_output()
+
+    def _write_batch(self, events, explanations):
+        raise NotImplementedError
+
+    def _close_output(self):
+        pass
+
+    def stats(self):
+        return {'recorded': self.recorded, 'written': self.written, 'dropped': self.dropped,
+                'pending': self._queue.qsize()}
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
+
+
+class SqliteEventSink(_BatchedEventSink):
+    def __init__(self, path='anomaly_events.sqlite3', batch_size=500, flush_interval=1.0, queue_size=10000):
+        self.path = path
+        # Several processes may write to the same store (one per line under
+        # the supervisor), so writers wait for each other instead of failing.
+        self._conn = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self._conn.execute(statement)
+        self._conn.commit()
+        super().__init__(batch_size, flush_interval, queue_size)
+
+    def _write_batch(self, events, explanations):
+        rows = [_event_row(event_id, event) for event_id, event in events]
+        hourly = {}
+        for row in rows:
+            key = (int(row[1] // SECONDS_PER_HOUR), row[2], row[4])
+            hourly[key] = hourly.get(key, 0) + 1
+        with self._conn:
+            self._conn.executemany("INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.executemany(
+                "INSERT INTO hourly_counts (hour, line, type, count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (type, hour, line) DO UPDATE SET count = count + excluded.count",
+                [(hour, line, anomaly_type, n) for (hour, line, anomaly_type), n in hourly.items()]
+            )
+            self._conn.executemany("UPDATE events SET explanation = ? WHERE id = ?",
+                                   [(text, event_id) for event_id, text in explanations])
+
+    def _close_output(self):
+        self._conn.close()
+
+
+class JsonlEventSink(_BatchedEventSink):
+    # One JSON object per line. Explanations are appended as their own
+    # {"id", "explanation"} records. The file is rotated to path.1 ... path.N
+    # once it grows past max_bytes.
+    def __init__(self, path='anomaly_events.jsonl', max_bytes=64 * 1024 * 1024, backups=5, batch_size=500,
+                 flush_interval=1.0, queue_size=10000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file = open(path, 'a')
+        super().__init__(batch_size, flush_interval, queue_size)
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'):
+                os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+        os.replace(self.path, f'{self.path}.1')
+        self._file = open(self.path, 'a')
+
+    def _write_batch(self, events, explanations):
+        lines = []
+        for event_id, event in events:
+            row = _event_row(event_id, event)
+            lines.append(json.dumps(dict(zip(('id', 'time', 'line', 'bottle_id', 'type', 'frame_index', 'position',
+                                               'state_history', 'details', 'explanation'), row))))
+        for event_id, text in explanations:
+            lines.append(json.dumps({'id': event_id, 'explanation': text}))
+        self._file.write('\n'.join(lines) + '\n')
+        self._file.flush()
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _close_output(self):
+        self._file.close()
+
+
+def create_event_sink(kind, path):
+    if kind == 'sqlite':
+        return SqliteEventSink(path)
+    if kind == 'jsonl':
+        return JsonlEventSink(path)
+    raise ValueError(f"Unknown event sink '{kind}'. Use 'sqlite' or 'jsonl'.")
+
+
+class EventStore:
+    # Read side of a SqliteEventSink database.
+    def __init__(self, path='anomaly_events.sqlite3'):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Event store '{path}' not found.")
+        self._conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+
+    def types(self):
+        return dict(self._conn.execute("SELECT type, SUM(count) FROM hourly_counts GROUP BY type ORDER BY type"))
+
+    def counts_per_hour(self, anomaly_type=None, since=None, until=None, line=None):
+        # Returns [(hour start as a unix timestamp, count)] from the rollup
+        # table, so the cost depends on the number of hours, not of events.
+        query = "SELECT hour, SUM(count) FROM hourly_counts WHERE 1"
+        params = []
+        if anomaly_type is not None:
+            query += " AND type = ?"
+            params.append(anomaly_type)
+        if since is not None:
+            query += " AND hour >= ?"
+            params.append(int(since // SECONDS_PER_HOUR))
+        if until is not None:
+            # Hours that start before `until`.
+            query += " AND hour < ?"
+            params.append(int(-(-until // SECONDS_PER_HOUR)))
+        if line is not None:
+            query += " AND line = ?"
+            params.append(line)
+        query += " GROUP BY hour ORDER BY hour"
+        return [(hour * SECONDS_PER_HOUR, count) for hour, count in self._conn.execute(query, params)]
+
+    def events(self, anomaly_type=None, bottle_id=None, since=None, until=None, line=None, limit=100):
+        query = ("SELECT id, time, line, bottle_id, type, frame_index, position, state_history, details, explanation "
+                 "FROM events WHERE 1")
+        params = []
+        if anomaly_type is not None:
+            query += " AND type = ?"
+            params.append(anomaly_type)
+        if bottle_id is not None:
+            query += " AND bottle_id = ?"
+            params.append(str(bottle_id))
+        if since is not None:
+            query += " AND time >= ?"
+            params.append(since)
+        if until is not None:
+            query += " AND time < ?"
+            params.append(until)
+        if line is not None:
+            query += " AND line = ?"
+            params.append(line)
+        query += " ORDER BY time DESC LIMIT ?"
+        params.append(limit)
+        columns = ('id', 'time', 'line', 'bottle_id', 'type', 'frame_index', 'position', 'state_history', 'details',
+                   'explanation')
+        return [dict(zip(columns, row)) for row in self._conn.execute(query, params)]
+
+    def close(self):
+        self._conn.close()
+
+
+# Times are shown and read as UTC: hour buckets are whole UTC hours, which
+# would start at hh:30 in a timezone like UTC+5:30.
+def _parse_time(value):
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _format_time(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the anomaly events recorded by main.py.")
+    parser.add_argument('store', nargs='?', default='anomaly_events.sqlite3')
+    parser.add_argument('--per-hour', action='store_true', help="Count events per hour instead of listing them.")
+    parser.add_argument('--type', default=None, help="e.g. 'Stuck bottle'.")
+    parser.add_argument('--bottle', default=None)
+    parser.add_argument('--line', type=int, default=None)
+    parser.add_argument('--since', default=None, help="ISO date/time in UTC, e.g. 2024-05-01T06:00.")
+    parser.add_argument('--until', default=None)
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    store = EventStore(args.store)
+    since, until = _parse_time(args.since), _parse_time(args.until)
+    if args.per_hour:
+        for hour, count in store.counts_per_hour(args.type, since, until, args.line):
+            print(f"{_format_time(hour)}  {count}")
+    elif args.type is None and args.bottle is None and args.line is None and since is None and until is None:
+        for anomaly_type, count in store.types().items():
+            print(f"{anomaly_type:<32}{count:>10}")
+    else:
+        for event in store.events(args.type, args.bottle, since, until, args.line, args.limit):
+            print(f"{_format_time(event['time'])}  line {event['line']}  bottle {event['bottle_id']}  "
+                  f"{event['type']}  frame {event['frame_index']}  x={event['position']}  "
+                  f"[{event['state_history']}]  {event['explanation'] or ''}")
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import sqlite3
+import threading
+import time
+
+POSITION_BUCKET_PX = 50
+STATE_PREFIX = 'bottle_'
+# Every line process opens the same cache file. WAL lets their lookups run
+# alongside another process's write; a writer waits up to this long for the
+# lock instead of failing with "database is locked".
+BUSY_TIMEOUT_SECONDS = 5.0
+
+
+def anomaly_signature(anomaly):
+    anomaly_type = anomaly['type']
+
+    zone = ''
+    if anomaly_type.startswith('Misaligned in '):
+        zone = anomaly_type[len('Misaligned in '):]
+
+    position_bucket = ''
+    if anomaly.get('position') is not None:
+        position_bucket = str(int(anomaly['position']) // POSITION_BUCKET_PX)
+
+    # Only the shape of the history matters for the explanation: collapse runs
+    # of the same state so 40 frames of 'bottle_filling' and 12 frames of it
+    # produce the same key.
+    details = anomaly.get('details', '')
+    if isinstance(details, (list, tuple)):
+        shape = []
+        for state in details:
+            state = str(state).replace(STATE_PREFIX, '')
+            if not shape or shape[-1] != state:
+                shape.append(state)
+        history_shape = '>'.join(shape)
+    else:
+        history_shape = str(details)
+
+    return '|'.join((anomaly_type, zone, position_bucket, history_shape))
+
+
+class ExplanationCache:
+    def __init__(self, path='llm_cache.sqlite3', max_entries=1000, ttl_seconds=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Hits only note when an entry was used; the times are written in one
+        # batch before the next eviction, purge or close, so a hit never
+        # waits for the disk.
+        self._last_used = {}
+        self._conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS explanations ("
+            "signature TEXT PRIMARY KEY, text TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_explanations_last_used ON explanations (last_used)")
+        self._conn.commit()
+        self.purge_expired()
+
+    def get(self, anomaly):
+        signature = anomaly_signature(anomaly)
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT text, created_at FROM explanations WHERE signature = ?", (signature,)
+                ).fetchone()
+            except sqlite3.OperationalError:
+                # Still locked by another line's process after the busy
+                # timeout: answer from the backend instead of failing.
+                row = None
+            # Expired rows are left for the next put or purge to delete, so
+            # a lookup never writes.
+            if row is None or now - row[1] > self.ttl_seconds:
+                self.misses += 1
+                return None
+            self._last_used[signature] = now
+            self.hits += 1
+            return row[0]
+
+    def put(self, anomaly, text):
+        signature = anomaly_signature(anomaly)
+        now = time.time()
+        with self._lock:
+            self._last_used.pop(signature, None)
+            self._flush_last_used()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO explanations (signature, text, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (signature, text, now, now)
+            )
+            self._conn.execute("DELETE FROM explanations WHERE created_at < ?", (now - self.ttl_seconds,))
+            # Least recently used entries go first once the cache is full.
+            self._conn.execute(
+                "DELETE FROM explanations WHERE signature IN ("
+                "SELECT signature FROM explanations ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def _flush_last_used(self):
+        # Called with the lock held; the caller commits.
+        if self._last_used:
+            self._conn.executemany("UPDATE explanations SET last_used = ? WHERE signature = ?",
+                                   [(used, signature) for signature, used in self._last_used.items()])
+            self._last_used.clear()
+
+    def purge_expired(self):
+        with self._lock:
+            self._flush_last_used()
+            self._conn.execute("DELETE FROM explanations WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM explanations").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': size
+        }
+
+    def close(self):
+        with self._lock:
+            self._flush_last_used()
+            self._conn.commit()
+            self._conn.close()
@@ -0,0 +1,236 @@
+import os
+import queue
+import threading
+import time
+import cv2
+from pipeline import StageQueue, DROP_OLDEST, BLOCK, END_OF_STREAM
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+# --- Frame sources ---
+# A source is called by the pipeline's source stage and returns the next
+# packet, or None once the input is exhausted. Decoding happens on a reader
+# thread that keeps up to `prefetch` frames ready. Files use BLOCK so no frame
+# is skipped; a camera uses DROP_OLDEST so a slow consumer always gets the
+# newest frame instead of an ever older backlog.
+
+class ThreadedFrameSource:
+    def __init__(self, prefetch=8, policy=BLOCK):
+        self.frames_read = 0
+        self._buffer = StageQueue(maxsize=prefetch, policy=policy)
+        self._stop_event = threading.Event()
+        self._reader = None
+
+    def _read_frames(self):
+        # Yields decoded BGR frames until the input runs out.
+        raise NotImplementedError
+
+    def _close_input(self):
+        pass
+
+    def start(self):
+        if self._reader is None:
+            self._reader = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+            self._reader.start()
+        return self
+
+    def _run(self):
+        try:
+            for frame in self._read_frames():
+                if self._stop_event.is_set():
+                    break
+                self._buffer.put(frame, self._stop_event)
+        except Exception as e:
+            print(f"[SOURCE] {type(self).__name__} failed: {e}")
+        finally:
+            self._close_input()
+            self._buffer.put(END_OF_STREAM, self._stop_event)
+
+    def __call__(self):
+        self.start()
+        while True:
+            try:
+                frame = self._buffer.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if self._stop_event.is_set():
+                    return None
+        if frame is END_OF_STREAM:
+            return None
+
+        self.frames_read += 1
+        return {
+            'frame_index': self.frames_read,
+            'created': time.perf_counter(),
+            'frame': frame,
+            # Real footage has no simulator behind it.
+            'ground_truth_states': {}
+        }
+
+    def stop(self):
+        self._stop_event.set()
+        if self._reader is not None:
+            self._reader.join(timeout=2.0)
+
+
+class VideoFileSource(ThreadedFrameSource):
+    def __init__(self, path, prefetch=8):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Video file '{path}' not found.")
+        super().__init__(prefetch, BLOCK)
+        self.path = path
+        self._capture = None
+
+    def _read_frames(self):
+        self._capture = cv2.VideoCapture(self.path)
+        if not self._capture.isOpened():
+            raise RuntimeError(f"Could not open video file '{self.path}'.")
+        while True:
+            ok, frame = self._capture.read()
+            if not ok:
+                return
+            yield frame
+
+    def _close_input(self):
+        if self._capture is not None:
+            self._capture.release()
+
+
+class ImageDirectorySource(ThreadedFrameSource):
+    def __init__(self, path, prefetch=8):
+        if not os.path.isdir(path):
+            raise FileNotFoundError(f"Image directory '{path}' not found.")
+        super().__init__(prefetch, BLOCK)
+        self.paths = sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+    def _read_frames(self):
+        for path in self.paths:
+            frame = cv2.imread(path)
+            if frame is None:
+                print(f"[SOURCE] Skipping unreadable image '{path}'.")
+                continue
+            yield frame
+
+
+class CameraSource(ThreadedFrameSource):
+    def __init__(self, device=0, prefetch=2):
+        super().__init__(prefetch, DROP_OLDEST)
+        self.device = device
+        self._capture = None
+
+    def _read_frames(self):
+        self._capture = cv2.VideoCapture(self.device)
+        if not self._capture.isOpened():
+            raise RuntimeError(f"Could not open camera device {self.device}.")
+        while not self._stop_event.is_set():
+            ok, frame = self._capture.read()
+            if not ok:
+                return
+            yield frame
+
+    def _close_input(self):
+        if self._capture is not None:
+            self._capture.release()
+
+
+def create_frame_source(kind, path=None, prefetch=8):
+    # 'simulator' is built by main.py itself since it needs the scenario.
+    if kind == 'video':
+        return VideoFileSource(path, prefetch)
+    if kind == 'images':
+        return ImageDirectorySource(path, prefetch)
+    if kind == 'camera':
+        return CameraSource(int(path) if path is not None else 0)
+    raise ValueError(f"Unknown frame source '{kind}'. Use 'simulator', 'video', 'images' or 'camera'.")
+
+
+# --- Frame sinks ---
+# Sinks receive annotated frames on the main thread. stop_requested() is
+# polled once per loop so a window can end the run on 'q'.
+
+class NullSink:
+    # Headless and without output: frames are not even annotated.
+    wants_frames = False
+
+    def write(self, frame):
+        pass
+
+    def stop_requested(self):
+        return False
+
+    def close(self):
+        pass
+
+
+class VideoFileSink:
+    # Encodes on a writer thread so the main loop only pays for a queue put.
+    # BLOCK keeps every frame; the loop slows down if encoding can't keep up.
+    wants_frames = True
+
+    def __init__(self, path, fps=30, fourcc='mp4v', queue_size=16):
+        self.path = path
+        self.fps = fps
+        self.fourcc = fourcc
+        self.frames_written = 0
+        self._queue = StageQueue(maxsize=queue_size, policy=BLOCK)
+        self._writer = None
+        self._thread = threading.Thread(target=self._run, name='video-sink', daemon=True)
+        self._thread.start()
+
+    def write(self, frame):
+        self._queue.put(frame)
+
+    def _run(self):
+        while True:
+            frame = self._queue.get()
+            if frame is END_OF_STREAM:
+                break
+            if self._writer is None:
+                height, width = frame.shape[:2]
+                self._writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps,
+                                               (width, height))
+                if not self._writer.isOpened():
+                    print(f"[SINK] Could not open '{self.path}' for writing; frames are discarded.")
+            # Frames are still taken off the queue so the loop never blocks
+            # on a sink that cannot write.
+            if self._writer.isOpened():
+                self._writer.write(frame)
+                self.frames_written += 1
+        if self._writer is not None:
+            self._writer.release()
+
+    def stop_requested(self):
+        return False
+
+    def close(self):
+        self._queue.put(END_OF_STREAM)
+        self._thread.join()
+        print(f"[SINK] Wrote {self.frames_written} frames to {self.path}")
+
+
+class WindowSink:
+    wants_frames = True
+
+    def __init__(self, window_name):
+        self.window_name = window_name
+        cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
+
+    def write(self, frame):
+        cv2.imshow(self.window_name, frame)
+
+    def stop_requested(self):
+        return cv2.waitKey(1) & 0xFF == ord('q')
+
+    def close(self):
+        pass
+
+
+def create_frame_sink(kind, window_name=None, path=None, fps=30):
+    if kind == 'window':
+        return WindowSink(window_name)
+    if kind == 'video':
+        return VideoFileSink(path, fps)
+    if kind == 'none':
+        return NullSink()
+    raise ValueError(f"Unknown frame sink '{kind}'. Use 'window', 'video' or 'none'.")
@@ -1,19 +1,34 @@
 import cv2
 import numpy as np
-import time
 import os
-import random
+import time
+from multiprocessing import Pool, shared_memory
+from sim_clock import SteppedClock
+from dataset_writer import create_writer
 from simulation_elements import (
     VirtualBottle,
-    draw_environment, 
-    BACKGROUND_PATHS,          
+    compose_environment,
+    list_background_paths,
     WIDTH,
     HEIGHT
 )
 
 # --- Configuration ---
-MAX_FRAMES = 5000  
-SPAWN_INTERVAL = 5 
+MAX_FRAMES = 5000
+SPAWN_INTERVAL = 5
+# Motion advances by a fixed simulated timestep, so the dataset no longer
+# depends on how fast the generating machine is.
+SIM_TIMESTEP = 1.0 / 30
+SEED = 0
+SHARD_SIZE = 500
+NUM_WORKERS = os.cpu_count() or 1
+# 'png' (lossless), 'jpeg' (JPEG_QUALITY) or 'shards'/'shards-jpeg', which
+# packs each shard into one archive with a label index instead of thousands
+# of small files. Run dataset_writer.py to export shards to the YOLO layout.
+OUTPUT_FORMAT = 'png'
+JPEG_QUALITY = 90
+PNG_COMPRESSION = 1
+ENCODER_THREADS = 4
 
 CLASS_MAPPING = {
     'bottle_empty': 0,
@@ -23,88 +38,164 @@ CLASS_MAPPING = {
     'bottle_labeled': 4
 }
 
-def setup_directories():
-    os.makedirs('data/images', exist_ok=True)
-    os.makedirs('data/labels', exist_ok=True)
+_backgrounds = None
+_backgrounds_shm = None
+
+
+def load_backgrounds():
+    # Each background is returned with the zone overlay already drawn on it.
+    background_paths = list_background_paths()
+    if not background_paths:
+        backgrounds = [np.full((HEIGHT, WIDTH, 3), (60, 60, 60), dtype=np.uint8)]
+    else:
+        backgrounds = [cv2.resize(cv2.imread(path), (WIDTH, HEIGHT)) for path in background_paths]
+    return np.stack([compose_environment(background) for background in backgrounds])
+
+
+def _attach_backgrounds(shm_name, shape):
+    # Pool initializer: every worker maps the backgrounds decoded once by the
+    # parent instead of reading and resizing them from disk per frame.
+    global _backgrounds, _backgrounds_shm
+    _backgrounds_shm = shared_memory.SharedMemory(name=shm_name)
+    _backgrounds = np.ndarray(shape, dtype=np.uint8, buffer=_backgrounds_shm.buf)
+
+
+class Belt:
+    # The belt without any drawing. The parent runs it once and records a
+    # checkpoint at the first frame of every shard; each worker resumes from
+    # its checkpoint, so shards stay independent and still produce exactly
+    # the same scene as a serial run.
+    def __init__(self, checkpoint=None):
+        checkpoint = checkpoint or {'frame': 0, 'time': 0.0, 'next_bottle_id': 1, 'last_spawn_time': 0.0,
+                                    'bottles': []}
+        self.frame_index = checkpoint['frame']
+        self.clock = SteppedClock(checkpoint['time'])
+        self.next_bottle_id = checkpoint['next_bottle_id']
+        self.last_spawn_time = checkpoint['last_spawn_time']
+        self.bottles = []
+        for bottle_id, x, state in checkpoint['bottles']:
+            bottle = VirtualBottle(bottle_id, clock=self.clock)
+            bottle.x, bottle.state = x, state
+            self.bottles.append(bottle)
+
+    def step(self):
+        self.clock.advance(SIM_TIMESTEP)
+        if self.clock.now() - self.last_spawn_time > SPAWN_INTERVAL:
+            self.bottles.append(VirtualBottle(self.next_bottle_id, clock=self.clock))
+            self.next_bottle_id += 1
+            self.last_spawn_time = self.clock.now()
+
+        for bottle in self.bottles:
+            bottle.update_position(SIM_TIMESTEP)
+            bottle.update_state()
+        self.bottles = [b for b in self.bottles if b.x < WIDTH]
+        self.frame_index += 1
+
+    def checkpoint(self):
+        return {
+            'frame': self.frame_index,
+            'time': self.clock.now(),
+            'next_bottle_id': self.next_bottle_id,
+            'last_spawn_time': self.last_spawn_time,
+            'bottles': [(bottle.id, bottle.x, bottle.state) for bottle in self.bottles]
+        }
+
+
+def belt_checkpoints(start_frames):
+    # One pass over the belt up to the last shard, O(MAX_FRAMES) in total.
+    belt = Belt()
+    checkpoints = {}
+    for start_frame in sorted(start_frames):
+        while belt.frame_index < start_frame:
+            belt.step()
+        checkpoints[start_frame] = belt.checkpoint()
+    return checkpoints
+
+
+def simulate(start_frame, end_frame, checkpoint=None):
+    # Resumes the belt from a checkpoint taken at or before start_frame and
+    # yields every frame of [start_frame, end_frame) with the bottles on it.
+    belt = Belt(checkpoint)
+    while belt.frame_index < end_frame:
+        frame_index = belt.frame_index
+        belt.step()
+        if frame_index >= start_frame:
+            yield frame_index, belt.bottles
+
+
+def render_frame(frame_index, bottles_on_belt, backgrounds):
+    # Per-frame randomness comes from (SEED, frame_index), so the output is
+    # identical no matter how frames are split across workers.
+    rng = np.random.default_rng([SEED, frame_index])
+    frame = backgrounds[rng.integers(len(backgrounds))].copy()
+
+    label_lines = []
+    for bottle in bottles_on_belt:
+        bottle.draw(frame)
+
+        data = bottle.get_tracker_format()
+        bbox = data['bbox']
+
+        if data['label'] in CLASS_MAPPING:
+            class_id = CLASS_MAPPING[data['label']]
+
+            x1, y1, x2, y2 = bbox
+            box_width = x2 - x1
+            box_height = y2 - y1
+            x_center = x1 + box_width / 2
+            y_center = y1 + box_height / 2
+
+            x_center_norm = x_center / WIDTH
+            y_center_norm = y_center / HEIGHT
+            width_norm = box_width / WIDTH
+            height_norm = box_height / HEIGHT
+
+            label_lines.append(f"{class_id} {x_center_norm} {y_center_norm} {width_norm} {height_norm}\n")
+
+    if rng.random() < 0.5:
+        frame = cv2.GaussianBlur(frame, (5,5), 0)
+
+    return frame, label_lines
+
+
+def generate_shard(shard):
+    start_frame, end_frame, checkpoint = shard
+    writer = create_writer(OUTPUT_FORMAT, root='data', shard_name=f'shard_{start_frame:06d}',
+                           jpeg_quality=JPEG_QUALITY, png_compression=PNG_COMPRESSION,
+                           encoder_threads=ENCODER_THREADS)
+    for frame_index, bottles_on_belt in simulate(start_frame, end_frame, checkpoint):
+        frame, label_lines = render_frame(frame_index, bottles_on_belt, _backgrounds)
+        writer.write(frame_index, frame, label_lines)
+    return writer.close()
+
 
 def main():
-    setup_directories()
+    backgrounds = load_backgrounds()
+    shm = shared_memory.SharedMemory(create=True, size=backgrounds.nbytes)
+    np.ndarray(backgrounds.shape, dtype=np.uint8, buffer=shm.buf)[:] = backgrounds
 
-    bottles_on_belt = []
-    next_bottle_id = 1
-    last_spawn_time = time.time()
-    last_frame_time = time.time()
-    frame_count = 0
+    starts = range(0, MAX_FRAMES, SHARD_SIZE)
+    checkpoints = belt_checkpoints(starts)
+    shards = [(start, min(start + SHARD_SIZE, MAX_FRAMES), checkpoints[start]) for start in starts]
+    print(f"Starting data generation for {MAX_FRAMES} frames in {len(shards)} shards on {NUM_WORKERS} workers...")
 
-    print(f"Starting data generation for {MAX_FRAMES} frames...")
-
-    while frame_count < MAX_FRAMES:
-        current_time = time.time()
-        delta_time = current_time - last_frame_time
-        if delta_time == 0: continue
-        last_frame_time = current_time
-
-        if BACKGROUND_PATHS:
-           
-            bg_path = random.choice(BACKGROUND_PATHS)
-            frame = cv2.imread(bg_path)
-            frame = cv2.resize(frame, (WIDTH, HEIGHT))
-        else:
-            
-            frame = np.full((HEIGHT, WIDTH, 3), (60, 60, 60), dtype=np.uint8)
-
-        
-        draw_environment(frame)
-
-        if current_time - last_spawn_time > SPAWN_INTERVAL:
-            
-            bottles_on_belt.append(VirtualBottle(next_bottle_id))
-            next_bottle_id += 1
-            last_spawn_time = current_time
-
-        label_lines = []
-        for bottle in bottles_on_belt:
-            bottle.update_position(delta_time)
-            bottle.update_state()
-            bottle.draw(frame)
-
-            data = bottle.get_tracker_format()
-            bbox = data['bbox']
-            
-            if data['label'] in CLASS_MAPPING:
-                class_id = CLASS_MAPPING[data['label']]
-                
-                x1, y1, x2, y2 = bbox
-                box_width = x2 - x1
-                box_height = y2 - y1
-                x_center = x1 + box_width / 2
-                y_center = y1 + box_height / 2
-                
-                x_center_norm = x_center / WIDTH
-                y_center_norm = y_center / HEIGHT
-                width_norm = box_width / WIDTH
-                height_norm = box_height / HEIGHT
-                
-                label_lines.append(f"{class_id} {x_center_norm} {y_center_norm} {width_norm} {height_norm}\n")
-
-        
-        if random.random() < 0.5: 
-            frame = cv2.GaussianBlur(frame, (5,5), 0)
-
-        image_path = f'data/images/frame_{frame_count:05d}.png'
-        label_path = f'data/labels/frame_{frame_count:05d}.txt'
-
-        cv2.imwrite(image_path, frame)
-        if label_lines: 
-            with open(label_path, 'w') as f:
-                f.writelines(label_lines)
-
-        frame_count += 1
-        
-        if frame_count % 100 == 0:
-            print(f"Generated {frame_count}/{MAX_FRAMES} frames...")
-
-    print(f"\nData generation complete. {MAX_FRAMES} images and labels saved in the 'data/' directory.")
+    start_time = time.time()
+    frame_count = 0
+    total_bytes = 0
+    try:
+        with Pool(NUM_WORKERS, initializer=_attach_backgrounds, initargs=(shm.name, backgrounds.shape)) as pool:
+            for shard_stats in pool.imap_unordered(generate_shard, shards):
+                frame_count += shard_stats['images']
+                total_bytes += shard_stats['bytes']
+                print(f"Generated {frame_count}/{MAX_FRAMES} frames...")
+    finally:
+        shm.close()
+        shm.unlink()
+
+    elapsed = time.time() - start_time
+    print(f"\nData generation complete. {frame_count} images and labels saved in the 'data/' directory "
+          f"as '{OUTPUT_FORMAT}'.")
+    print(f"{frame_count / elapsed:.0f} images/s, {total_bytes / max(frame_count, 1) / 1024:.1f} KiB/image.")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
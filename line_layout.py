@@ -0,0 +1,118 @@
+import functools
+import numpy as np
+
+LAYOUT_PATH = 'line_layout.yaml'
+DEFAULT_WIDTH = 1280
+NO_STATION = -1
+
+
+class LineLayout:
+    # Compiled form of line_layout.yaml. Zone membership is precomputed per
+    # pixel along the belt, so the simulator, the anomaly detector and the
+    # renderer answer "which station is x in" and "what state should a bottle
+    # at x have" with one array index, however many stations the line has:
+    #   zone_at[x]    - index of the station covering x, or NO_STATION
+    #   state_at[x]   - code (into states) of the state a bottle has at x
+    #   segment_at[x] - stretch of the belt over which neither changes
+    # station_for_state maps a state to the station it belongs to.
+    def __init__(self, stations=(), initial_state='bottle_empty', width=DEFAULT_WIDTH):
+        self.width = width
+        self.initial_state = initial_state
+        self.stations = []
+        for station in stations:
+            lo, hi = (int(v) for v in station['x_range'])
+            self.stations.append({
+                'name': station['name'],
+                'x_range': (lo, hi),
+                'state': station.get('state'),
+                'after': station.get('after') or station.get('state'),
+                'color': tuple(int(c) for c in station.get('color', (255, 255, 255)))
+            })
+
+        previous_end = 0
+        for station in self.stations:
+            lo, hi = station['x_range']
+            if not previous_end <= lo < hi <= width:
+                raise ValueError(f"Station '{station['name']}' with x_range {list(station['x_range'])} must lie "
+                                 f"within [0, {width}) to the right of the previous station.")
+            previous_end = hi
+
+        self.names = [station['name'] for station in self.stations]
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.ranges = {station['name']: station['x_range'] for station in self.stations}
+
+        self.states = [initial_state]
+        for station in self.stations:
+            for state in (station['state'], station['after']):
+                if state is not None and state not in self.states:
+                    self.states.append(state)
+        self.state_codes = {state: code for code, state in enumerate(self.states)}
+
+        self.station_for_state = {}
+        for i, station in enumerate(self.stations):
+            if station['state'] is not None:
+                self.station_for_state.setdefault(station['state'], i)
+
+        self.zone_at = np.full(width, NO_STATION, dtype=np.int16)
+        self.state_at = np.zeros(width, dtype=np.int16)
+        current = self.state_codes[initial_state]
+        previous_end = 0
+        for i, station in enumerate(self.stations):
+            lo, hi = station['x_range']
+            self.state_at[previous_end:lo] = current
+            self.zone_at[lo:hi] = i
+            if station['state'] is not None:
+                self.state_at[lo:hi] = self.state_codes[station['state']]
+                current = self.state_codes[station['after']]
+            else:
+                self.state_at[lo:hi] = current
+            previous_end = hi
+        self.state_at[previous_end:] = current
+
+        changes = np.ones(width, dtype=bool)
+        changes[1:] = (self.zone_at[1:] != self.zone_at[:-1]) | (self.state_at[1:] != self.state_at[:-1])
+        self.segment_at = (np.cumsum(changes) - 1).astype(np.int16)
+
+    @classmethod
+    def from_dict(cls, data, width=DEFAULT_WIDTH):
+        return cls(data.get('stations') or (), data.get('initial_state', 'bottle_empty'), width)
+
+    @classmethod
+    def load(cls, path=LAYOUT_PATH, width=DEFAULT_WIDTH):
+        import yaml
+        with open(path) as f:
+            return cls.from_dict(yaml.safe_load(f) or {}, width)
+
+    def to_dict(self):
+        return {
+            'initial_state': self.initial_state,
+            'stations': [dict(station, x_range=list(station['x_range']), color=list(station['color']))
+                         for station in self.stations]
+        }
+
+    def zone(self, x):
+        return int(self.zone_at[x]) if 0 <= x < self.width else NO_STATION
+
+    def zones(self, xs):
+        # Vectorized zone(); positions off the belt are in no station.
+        xs = np.asarray(xs)
+        inside = (xs >= 0) & (xs < self.width)
+        return np.where(inside, self.zone_at[np.clip(xs, 0, self.width - 1)], NO_STATION)
+
+    def segment(self, x):
+        return int(self.segment_at[min(max(int(x), 0), self.width - 1)])
+
+    def state(self, x):
+        return self.states[self.state_at[min(max(int(x), 0), self.width - 1)]]
+
+    def state_before(self, name):
+        # The state a bottle has on arriving at a station, e.g. for a bottle
+        # that passes through it without being processed.
+        lo = self.ranges[name][0]
+        return self.states[self.state_at[lo - 1]] if lo > 0 else self.initial_state
+
+
+@functools.lru_cache(maxsize=None)
+def load_line_layout(path=LAYOUT_PATH, width=DEFAULT_WIDTH):
+    # Read once per process on first use, never at import time.
+    return LineLayout.load(path, width)
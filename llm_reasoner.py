@@ -1,9 +1,28 @@
-import google.generativeai as genai
+import heapq
+import itertools
 import os
-from dotenv import load_dotenv
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from startup import Deferred
+from explanation_cache import anomaly_signature
 
-class LLMReasoner:
+DEFAULT_TIMEOUT = 10.0
+PENDING_TEXT = "Analyzing anomaly..."
+
+TEMPLATE_ACTIONS = {
+    'Stuck bottle': "Check conveyor belt for obstructions",
+    'Stage out of order': "Inspect station sequencing and sensor triggers",
+    'Label missing': "Check labeling station label feed and applicator",
+    'Misaligned': "Realign bottle guides before the {zone} station",
+}
+
+
+class GeminiBackend:
     def __init__(self, model_name="models/gemini-1.5-flash"):
+        import google.generativeai as genai
+        from dotenv import load_dotenv
+
         load_dotenv()
         api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
@@ -11,18 +30,162 @@ class LLMReasoner:
         genai.configure(api_key=api_key)
         self.model = genai.GenerativeModel(model_name)
 
-    def explain_anomalies(self, anomaly_list):
-        responses = []
-        for anomaly in anomaly_list:
-            prompt = self._build_prompt(anomaly)
+    def generate(self, prompt, anomaly):
+        response = self.model.generate_content(prompt)
+        return response.text.strip().replace('*', '')
+
+
+class TemplateBackend:
+    def generate(self, prompt, anomaly):
+        anomaly_type = anomaly['type']
+        if anomaly_type.startswith('Misaligned in '):
+            zone = anomaly_type[len('Misaligned in '):]
+            action = TEMPLATE_ACTIONS['Misaligned'].format(zone=zone)
+        else:
+            action = TEMPLATE_ACTIONS.get(anomaly_type, "Stop the line and inspect the bottle")
+        return f"Problem: {anomaly_type}\nAction: {action}"
+
+
+def create_backend(name='auto', model_name="models/gemini-1.5-flash"):
+    if name == 'template':
+        return TemplateBackend()
+    if name == 'gemini':
+        return GeminiBackend(model_name)
+    if name == 'auto':
+        from dotenv import load_dotenv
+        load_dotenv()
+        if os.getenv("GEMINI_API_KEY"):
+            return GeminiBackend(model_name)
+        print("[LLM] GEMINI_API_KEY not set. Falling back to the local template backend.")
+        return TemplateBackend()
+    raise ValueError(f"Unknown LLM backend '{name}'. Use 'auto', 'gemini' or 'template'.")
+
+
+class LLMReasoner:
+    def __init__(self, model_name="models/gemini-1.5-flash", backend='auto', max_workers=2, timeout=DEFAULT_TIMEOUT,
+                 cache=None, metrics=None):
+        # backend may also be a Deferred that is still being created; requests
+        # submitted meanwhile wait for it on the worker threads.
+        if isinstance(backend, str):
+            backend = create_backend(backend, model_name)
+        self.backend = backend
+        self.timeout = timeout
+        self.cache = cache
+        self._latency = metrics.histogram('llm_seconds') if metrics is not None else None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm')
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        # Deadlines of dispatched requests, expired by one sweeper thread.
+        self._deadlines = []
+        self._sequence = itertools.count()
+        self._deadline_changed = threading.Condition(self._lock)
+        self._closed = False
+        self._sweeper = threading.Thread(target=self._expire_timeouts, name='llm-timeouts', daemon=True)
+        self._sweeper.start()
+
+    def explain_async(self, anomaly, callback=None):
+        cached = self.cache.get(anomaly) if self.cache is not None else None
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+            if callback is not None:
+                callback(anomaly, cached)
+            return future
+
+        # Grouped by the cache key rather than the prompt, which names the
+        # bottle: the same anomaly on several bottles shares one backend call.
+        key = anomaly_signature(anomaly)
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                future = Future()
+                self._in_flight[key] = future
+                self._dispatch(key, self._build_prompt(anomaly), anomaly, future)
+
+        if callback is not None:
+            future.add_done_callback(lambda f: callback(anomaly, f.result()))
+        return future
+
+    def _dispatch(self, key, prompt, anomaly, future):
+        # Called with the lock held.
+        heapq.heappush(self._deadlines, (time.monotonic() + self.timeout, next(self._sequence), key, future))
+        self._deadline_changed.notify()
+
+        def call_backend():
+            started = time.perf_counter()
             try:
-                response = self.model.generate_content(prompt)
-                clean_response = response.text.strip().replace('*', '')
-                responses.append(clean_response)
-                
+                backend = self.backend.get() if isinstance(self.backend, Deferred) else self.backend
+                text = backend.generate(prompt, anomaly)
             except Exception as e:
-                responses.append(f"⚠️ Gemini API error: {e}")
-        return responses
+                text = None
+                error = f"⚠️ LLM backend error: {e}"
+            if self._latency is not None:
+                with self._lock:
+                    self._latency.observe(time.perf_counter() - started)
+            if text is None:
+                self._resolve(key, future, error)
+                return
+            self._resolve(key, future, text)
+            if self.cache is not None:
+                # Cached even if the request already timed out, so the next
+                # occurrence of this anomaly is answered instantly. A cache
+                # failure never replaces the explanation itself.
+                try:
+                    self.cache.put(anomaly, text)
+                except Exception as e:
+                    print(f"[LLM] Could not cache explanation: {e}")
+
+        self.executor.submit(call_backend)
+
+    def _expire_timeouts(self):
+        # Resolves requests still pending at their deadline. Entries of
+        # requests that finished in time simply find their future done.
+        while True:
+            expired = []
+            with self._deadline_changed:
+                while not self._closed and (not self._deadlines or self._deadlines[0][0] > time.monotonic()):
+                    self._deadline_changed.wait(self._deadlines[0][0] - time.monotonic() if self._deadlines else None)
+                if self._closed:
+                    return
+                now = time.monotonic()
+                while self._deadlines and self._deadlines[0][0] <= now:
+                    expired.append(heapq.heappop(self._deadlines))
+            for _, _, key, future in expired:
+                self._resolve(key, future, f"⚠️ LLM timed out after {self.timeout:g}s")
+
+    def _resolve(self, key, future, text):
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+            if future.done() or future.running():
+                return
+            # Claim the future under the lock, but run callbacks outside it.
+            claimed = future.set_running_or_notify_cancel()
+        if claimed:
+            future.set_result(text)
+
+    def explain_anomalies(self, anomaly_list):
+        futures = [self.explain_async(anomaly) for anomaly in anomaly_list]
+        return [future.result() for future in futures]
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._in_flight)
+
+    def cache_stats(self):
+        return self.cache.stats() if self.cache is not None else None
+
+    def shutdown(self):
+        # Requests not yet started are dropped; running ones finish first so
+        # none of them writes to the cache after it is closed.
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        with self._deadline_changed:
+            self._closed = True
+            self._deadline_changed.notify()
+        self._sweeper.join()
+        if self.cache is not None:
+            self.cache.close()
 
     def _build_prompt(self, anomaly):
         bottle_id = anomaly['bottle_id']
@@ -46,4 +209,4 @@ class LLMReasoner:
             "Action: Check conveyor belt for obstructions"
         )
 
-        return context + instruction
\ No newline at end of file
+        return context + instruction
@@ -1,68 +1,204 @@
+from startup import StartupTimer, Deferred, WARMING_UP
 import cv2
+import functools
 import numpy as np
-import time
 import random
 import os
+import time
 from yolo_detector import YoloDetector
-from deep_sort_tracker import DeepSortTracker
 from bottle_tracker import BottleTracker
 from anomaly_detector import AnomalyDetector
-from llm_reasoner import LLMReasoner
+from llm_reasoner import LLMReasoner, create_backend, PENDING_TEXT
+from explanation_cache import ExplanationCache
 from scenario_generator import ScenarioGenerator 
+from pipeline import Pipeline, DROP_OLDEST, BLOCK, END_OF_STREAM
+from batched_detector import BatchedDetector
+from sim_clock import create_clock
+from motion_gate import MotionGate, DETECT, PREDICT, box_center_x, settled_predictions
+from metrics import MetricsRegistry, MetricsExporter, COUNT_BUCKETS
+from detection_log import DetectionLogWriter
+from frame_io import create_frame_source, create_frame_sink
+from event_store import create_event_sink
+from alerts import AlertManager, RAISED
 
 from simulation_elements import (
-    draw_environment,
-    BACKGROUND_PATHS,
+    compose_environment,
+    default_layout,
+    list_background_paths,
     WIDTH,
-    HEIGHT
+    HEIGHT,
+    CONVEYOR_Y
 )
 
 MODEL_PATH = 'best.pt'
 CONFIDENCE_THRESHOLD = 0.7
-ZONES = {
-    'filling': (250, 450),
-    'capping': (550, 750),
-    'labeling': (850, 1050)
-}
+# Stations of the line, shared by the simulator, the anomaly detector and
+# the zone overlay. Any number of stations may be listed.
+LINE_LAYOUT_PATH = 'line_layout.yaml'
+# Bottles only appear in a band just above the conveyor line, so the
+# detector only looks there. Set DETECTION_ROIS to None for full frames.
+DETECTION_ROIS = [(0, CONVEYOR_Y - 280, WIDTH, CONVEYOR_Y + 20)]
+DETECTION_IMGSZ = 640
+# 'torch' runs best.pt through ultralytics. 'onnx' exports it once to a
+# fixed-size ONNX model next to best.pt and runs it with ONNX Runtime on the
+# CPU, with DETECTOR_THREADS intra-op threads (None lets ONNX Runtime choose)
+# and optional dynamic int8 quantization. Both are warmed up at load.
+DETECTOR_BACKEND = 'torch'
+DETECTOR_THREADS = None
+DETECTOR_QUANTIZE = False
+# Run YOLO at most every DETECTION_STRIDE frames while all motion on the belt
+# is explained by the tracker's predictions; new or unexpected motion forces
+# a detection straight away. 1 detects on every frame.
+DETECTION_STRIDE = 3
+# Number of simulated production lines. With more than one, all lines share
+# a single detector that batches their frames into one model call.
+NUM_LINES = 1
+DETECTION_MAX_BATCH = 8
+DETECTION_MAX_WAIT = 0.01
 TARGET_FPS = 30
 FRAME_DURATION = 1.0 / TARGET_FPS
 
-def main():
-    print("Initializing system components...")
-    cv2.namedWindow('FactorySense - Live Simulation', cv2.WINDOW_NORMAL)
+# 'realtime' paces the simulation against the wall clock. 'stepped' advances
+# simulated time by one FRAME_DURATION per frame without sleeping, so a
+# scenario runs as fast as the pipeline allows and, with a fixed seed,
+# produces the same result every time. Stepped runs use BLOCK queues so no
+# frame is ever dropped.
+SIMULATION_CLOCK = 'realtime'
+SIMULATION_SEED = None
+
+# --- Pipeline configuration ---
+# Each stage runs on its own worker thread with a bounded queue in front of
+# the next one. DROP_OLDEST keeps latency low by discarding stale frames when
+# a downstream stage falls behind; BLOCK slows the producer down instead.
+STAGE_QUEUE_SIZE = 2
+STAGE_POLICIES = {
+    'render': DROP_OLDEST,
+    'detect': DROP_OLDEST,
+    'track': BLOCK
+}
+WINDOW_NAME = 'FactorySense - Live Simulation'
+
+# --- Input and output ---
+# FRAME_SOURCE is 'simulator', 'video' (a file), 'images' (a directory) or
+# 'camera' (FRAME_SOURCE_PATH is the device index); a list of paths gives one
+# per line. Recorded footage is decoded on a reader thread FRAME_PREFETCH
+# frames ahead and processed as fast as the pipeline allows.
+# FRAME_SINK is 'window', 'video' (annotated frames to OUTPUT_VIDEO_PATH on a
+# writer thread) or 'none'. 'video' and 'none' need no display.
+FRAME_SOURCE = 'simulator'
+FRAME_SOURCE_PATH = None
+FRAME_PREFETCH = 8
+FRAME_SINK = 'window'
+OUTPUT_VIDEO_PATH = 'annotated.mp4'
+
+# 'deepsort' runs deep_sort_realtime with its appearance embedder; 'sort'
+# uses the appearance-free Kalman/IoU tracker, which is much cheaper on CPU
+# because identical-looking bottles gain little from appearance features.
+TRACKER_BACKEND = 'sort'
+
+# Per-bottle history length, and how many frames a track may go unseen
+# before its history and anomaly state are dropped.
+HISTORY_LENGTH = 50
+STALE_TRACK_FRAMES = 90
+
+# An alert is raised the first frame an anomaly (bottle, type) appears and
+# cleared once it is gone. The same bottle and type is not raised again for
+# ALERT_DEDUP_FRAMES frames, or ALERT_COOLDOWN_FRAMES[type] for the types
+# listed there (e.g. {'Stuck bottle': 300}); a recycled track id can alert
+# again afterwards. At most ALERT_MAX_ENTRIES suppressed keys are remembered.
+ALERT_DEDUP_FRAMES = 900
+ALERT_COOLDOWN_FRAMES = {}
+ALERT_MAX_ENTRIES = 10000
+
+# 'auto' uses Gemini when GEMINI_API_KEY is set and the offline template
+# backend otherwise; 'gemini' or 'template' force one of them.
+LLM_BACKEND = 'auto'
+LLM_TIMEOUT = 10.0
+# With several processes (PROCESS_LAYOUT) every track process opens this
+# same file. It is kept in WAL mode so lookups never wait for another
+# process's write; a write waits for the lock and is skipped if it cannot
+# get it, which only costs a later cache miss.
+LLM_CACHE_PATH = 'llm_cache.sqlite3'
+LLM_CACHE_MAX_ENTRIES = 1000
+LLM_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
+# --- Metrics ---
+# Stage latencies, queue depths, drops and tracks/anomalies per frame are
+# always recorded (a few microseconds per frame). Set METRICS_JSONL_PATH to
+# append a snapshot every METRICS_INTERVAL seconds, METRICS_PORT to serve
+# Prometheus text at http://127.0.0.1:<port>/metrics, and SHOW_METRICS_HUD to
+# draw per-stage p50/p95/p99 latencies on the frame.
+METRICS_JSONL_PATH = None
+METRICS_INTERVAL = 5.0
+METRICS_PORT = None
+SHOW_METRICS_HUD = False
 
-    if BACKGROUND_PATHS:
-        selected_bg_path = random.choice(BACKGROUND_PATHS)
+# Set to e.g. 'recording.npz' to log every frame's detections, tracked objects
+# and ground-truth states, written as recording.00000.npz, recording.00001.npz,
+# ... as the run goes. `python detection_log.py recording.npz` replays the log
+# through the tracker and anomaly detector without rendering or YOLO.
+RECORD_PATH = None
+
+# Every new anomaly (bottle, type, frame, position, state history and the
+# LLM explanation once it arrives) is written in batches by a background
+# thread to EVENT_STORE_PATH. 'sqlite' keeps an indexed store that
+# `python event_store.py --per-hour --type "Stuck bottle"` queries; 'jsonl'
+# appends to a rotating JSON-lines file; None stores nothing.
+EVENT_SINK = 'sqlite'
+EVENT_STORE_PATH = 'anomaly_events.sqlite3'
+
+# --- Multi-process mode ---
+# None runs every line as threads of this process. 'stages' gives each line a
+# source, a detect and a track process; 'lines' runs each line in one process
+# of its own. Frames pass between processes through a shared-memory ring of
+# RING_SLOTS frame slots per line, and every process reports its health every
+# HEALTH_INTERVAL seconds. Each detect process loads its own model.
+PROCESS_LAYOUT = None
+RING_SLOTS = 8
+HEALTH_INTERVAL = 5.0
+
+
+def create_tracker(backend):
+    if backend == 'sort':
+        from sort_tracker import SortTracker
+        return SortTracker()
+    if backend == 'deepsort':
+        from deep_sort_tracker import DeepSortTracker
+        return DeepSortTracker()
+    raise ValueError(f"Unknown tracker backend '{backend}'. Use 'sort' or 'deepsort'.")
+
+
+def load_static_background():
+    background_paths = list_background_paths()
+    if background_paths:
+        # Seeded like the scenario, and sorted since directory order varies.
+        selected_bg_path = random.Random(SIMULATION_SEED).choice(sorted(background_paths))
         static_background = cv2.imread(selected_bg_path)
-        static_background = cv2.resize(static_background, (WIDTH, HEIGHT))
-    else:
-        static_background = np.full((HEIGHT, WIDTH, 3), (60, 60, 60), dtype=np.uint8)
+        return cv2.resize(static_background, (WIDTH, HEIGHT))
+    return np.full((HEIGHT, WIDTH, 3), (60, 60, 60), dtype=np.uint8)
 
+
+def show_loading_screen(static_background):
     loading_frame = static_background.copy()
     loading_text = "Initializing... Please Wait."
     text_size, _ = cv2.getTextSize(loading_text, cv2.FONT_HERSHEY_SIMPLEX, 1.2, 2)
     text_x = (WIDTH - text_size[0]) // 2
     text_y = (HEIGHT + text_size[1]) // 2
     cv2.putText(loading_frame, loading_text, (text_x, text_y), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (255, 255, 255), 3)
-    cv2.imshow('FactorySense - Live Simulation', loading_frame)
+    cv2.imshow(WINDOW_NAME, loading_frame)
     cv2.waitKey(1)
-    
-    detector = YoloDetector(model_path=MODEL_PATH, confidence_threshold=CONFIDENCE_THRESHOLD)
-    tracker = DeepSortTracker()
-    bottle_tracker = BottleTracker(max_history=50)
-    anomaly_detector = AnomalyDetector(zones=ZONES)
-    llm_reasoner = LLMReasoner()
 
-    scenario = ScenarioGenerator(total_bottles=5, spawn_interval=10)
 
-    reported_anomalies = set()
-    on_screen_alerts = {}
+def make_render_stage(scenario, environment, clock):
+    state = {'frame_index': 0, 'next_frame_time': clock.now()}
 
-    print("System initialized. Starting simulation...")
-    while True:
-        loop_start_time = time.time()
-        frame = static_background.copy()
-        draw_environment(frame)
+    def render():
+        # Pace the simulation itself so bottles move at belt speed regardless
+        # of how quickly the downstream stages consume frames.
+        clock.wait_until(state['next_frame_time'])
+        state['next_frame_time'] = max(state['next_frame_time'] + FRAME_DURATION, clock.now())
+
+        frame = environment.copy()
 
         bottles_on_belt = scenario.update()
 
@@ -70,81 +206,430 @@ def main():
             bottle.update_position(FRAME_DURATION)
             bottle.update_state()
             bottle.draw(frame)
-        
+
         bottles_on_belt[:] = [b for b in bottles_on_belt if b.x < WIDTH]
-        
+
         if scenario.is_complete():
             print("Scenario complete. All bottles have run. Ending simulation.")
-            break
-        
-        ground_truth_states = {b.id: b.state for b in bottles_on_belt}
-        detections = detector.detect(frame)
-        tracked_objects = tracker.update_tracks(detections, frame=frame)
-        bottle_tracker.update(tracked_objects)
-
-        current_anomalies = []
-        for bottle_id in bottle_tracker.get_all_bottles():
-            history = bottle_tracker.get_state_history(bottle_id)
-            position_history = bottle_tracker.get_position_history(bottle_id)
-            if history and position_history:
-                anomalies = anomaly_detector.check_anomalies(bottle_id, history, position_history)
-                if anomalies:
-                    current_anomalies.extend(anomalies)
-        
-        anomalous_ids = {a['bottle_id'] for a in current_anomalies}
-
-        for anomaly in current_anomalies:
-            anomaly_key = (anomaly['bottle_id'], anomaly['type'])
-            if anomaly_key not in reported_anomalies:
-                print(f"[ALERT] New anomaly detected: {anomaly}")
-                explanation = llm_reasoner.explain_anomalies([anomaly])[0]
-                on_screen_alerts[anomaly['bottle_id']] = explanation
-                reported_anomalies.add(anomaly_key)
+            return None
+
+        state['frame_index'] += 1
+        return {
+            'frame_index': state['frame_index'],
+            'created': time.perf_counter(),
+            'frame': frame,
+            'ground_truth_states': {b.id: b.state for b in bottles_on_belt}
+        }
+
+    return render
+
+
+def make_detect_stage(detector, gate, metrics, **labels):
+    # detector is a Deferred. Live input keeps flowing while the model loads
+    # and those frames are marked WARMING_UP; otherwise the stage waits for it
+    # so no frame goes undetected.
+    gate_seconds = metrics.histogram('step_seconds', step='gate', **labels)
+    detector_seconds = metrics.histogram('step_seconds', step='detector', **labels)
+    wait = not live_input()
+
+    def detect(packet):
+        model = detector.get() if wait else detector.peek()
+        if model is None:
+            packet['detection_mode'] = WARMING_UP
+            packet['detections'] = None
+            return packet
+
+        started = time.perf_counter()
+        mode = gate.decide(packet['frame'])
+        gated = time.perf_counter()
+        gate_seconds.observe(gated - started)
+        packet['detection_mode'] = mode
+        packet['detections'] = None
+        if mode == DETECT:
+            packet['detections'] = model.detect(packet['frame'])
+            detector_seconds.observe(time.perf_counter() - gated)
+        return packet
+
+    return detect
+
+
+def make_track_stage(tracker, bottle_tracker, anomaly_detector, alert_manager, llm_reasoner, gate, metrics,
+                     recorder=None, events=None, **labels):
+    # tracker is a Deferred, loaded like the detector in make_detect_stage.
+    # Tracks confirmed by the most recent real detection, with the x where
+    # they were detected; only these are carried forward on predicted frames
+    # so lost tracks still age out.
+    detected_x = {}
+    layout = anomaly_detector.layout
+    wait = not live_input()
+    tracker_seconds = metrics.histogram('step_seconds', step='tracker', **labels)
+    anomaly_seconds = metrics.histogram('step_seconds', step='anomaly', **labels)
+    tracks_per_frame = metrics.histogram('tracks_per_frame', bounds=COUNT_BUCKETS, **labels)
+    anomalies_per_frame = metrics.histogram('anomalies_per_frame', bounds=COUNT_BUCKETS, **labels)
+
+    # Subscribers run in this order when an alert is raised, so the event id
+    # exists before a cached explanation comes back on this thread.
+    def print_alert(event, alert):
+        if event == RAISED:
+            print(f"[ALERT] New anomaly detected: {alert['anomaly']}")
+
+    def record_event(event, alert):
+        if event != RAISED:
+            return
+        anomaly = alert['anomaly']
+        bottle_id = alert['bottle_id']
+        position = anomaly.get('position')
+        if position is None:
+            position = (bottle_tracker.get_position(bottle_id) or (None,))[0]
+        alert['event_id'] = events.record({
+            'time': time.time(),
+            'line': labels.get('line', 1),
+            'bottle_id': bottle_id,
+            'type': alert['type'],
+            'frame_index': alert['raised_at'],
+            'position': position,
+            'state_history': bottle_tracker.get_state_history(bottle_id),
+            'details': anomaly.get('details')
+        })
+
+    def on_explanation(alert, anomaly, explanation):
+        alert_manager.set_text(alert, explanation)
+        if alert.get('event_id') is not None:
+            events.set_explanation(alert['event_id'], explanation)
+
+    def explain_alert(event, alert):
+        if event == RAISED:
+            llm_reasoner.explain_async(alert['anomaly'], callback=functools.partial(on_explanation, alert))
+
+    metrics.gauge('alerts_active', lambda: alert_manager.stats()['active'], **labels)
+    metrics.counter('alerts_raised', lambda: alert_manager.raised, **labels)
+    metrics.counter('alerts_suppressed', lambda: alert_manager.suppressed, **labels)
+    alert_manager.subscribe(print_alert)
+    if events is not None:
+        alert_manager.subscribe(record_event)
+    alert_manager.subscribe(explain_alert)
+
+    def track(packet):
+        nonlocal detected_x
+        active_tracker = tracker.get() if wait else tracker.peek()
+        if active_tracker is None:
+            packet['tracked_objects'] = []
+            packet['anomalous_ids'] = set()
+            packet['on_screen_alerts'] = alert_manager.snapshot()
+            return packet
+
+        started = time.perf_counter()
+        if packet['detection_mode'] == PREDICT:
+            # No detections to correct the tracks with: they coast on their
+            # motion model and keep ageing until the detector sees them again.
+            tracked_objects = [obj for obj in active_tracker.predict_tracks(detected_x)
+                               if 0 <= box_center_x(obj['bbox']) < WIDTH]
+        else:
+            tracked_objects = active_tracker.update_tracks(packet['detections'] or [], frame=packet['frame'])
+        observed = tracked_objects
+        if packet['detection_mode'] == DETECT:
+            detected_x = {obj['id']: box_center_x(obj['bbox']) for obj in tracked_objects}
+        elif packet['detection_mode'] == PREDICT:
+            # Predicted boxes that have left the stretch of the line where
+            # their track was detected carry a stale label, so they are kept
+            # out of the state history until the detector confirms them.
+            observed = settled_predictions(tracked_objects, detected_x, layout)
+        # Boxes about to leave their stretch are not handed to the gate, so
+        # their motion is unexplained and the next frame is detected.
+        upcoming = active_tracker.predicted_detections(detected_x)
+        gate.set_predicted_boxes(d['bbox'] for d in settled_predictions(upcoming, detected_x, layout))
+        tracked = time.perf_counter()
+        tracker_seconds.observe(tracked - started)
+
+        bottle_tracker.update(observed, frame_index=packet['frame_index'])
+        anomaly_detector.update(observed, frame_index=packet['frame_index'])
+        current_anomalies = anomaly_detector.evaluate(history_lookup=bottle_tracker.get_state_history)
+        anomaly_seconds.observe(time.perf_counter() - tracked)
+        tracks_per_frame.observe(len(tracked_objects))
+        anomalies_per_frame.observe(len(current_anomalies))
+        if recorder is not None:
+            recorder.record(packet['frame_index'], packet['detections'], tracked_objects,
+                            packet['ground_truth_states'], packet['detection_mode'])
+
+        alert_manager.update(current_anomalies, packet['frame_index'])
+
+        packet['tracked_objects'] = tracked_objects
+        packet['anomalous_ids'] = {a['bottle_id'] for a in current_anomalies}
+        packet['on_screen_alerts'] = alert_manager.snapshot()
+        return packet
+
+    return track
+
+
+def annotate_frame(packet):
+    frame = packet['frame']
+    ground_truth_states = packet['ground_truth_states']
+    anomalous_ids = packet['anomalous_ids']
+
+    for obj in packet['tracked_objects']:
+        x1, y1, x2, y2 = obj['bbox']
+        track_id = obj['id']
+        detected_label = obj['label']
+
+        box_color = (0, 255, 0) 
+        if track_id in anomalous_ids:
+            box_color = (0, 0, 255) 
+
+        cv2.rectangle(frame, (x1, y1), (x2, y2), box_color, 2)
         
-        active_ids = {obj['id'] for obj in tracked_objects}
-        for bottle_id in list(on_screen_alerts.keys()):
-            if bottle_id not in active_ids or bottle_id not in anomalous_ids:
-                del on_screen_alerts[bottle_id]
-
-        for obj in tracked_objects:
-            x1, y1, x2, y2 = obj['bbox']
-            track_id = obj['id']
-            detected_label = obj['label']
-
-            box_color = (0, 255, 0) 
-            if track_id in anomalous_ids:
-                box_color = (0, 0, 255) 
-
-            cv2.rectangle(frame, (x1, y1), (x2, y2), box_color, 2)
-            
-            gt_state = ground_truth_states.get(track_id, "N/A")
-            display_text = f"ID: {track_id} [Detected: {detected_label} | GT: {gt_state}]"
-            
-            text_color = (255, 255, 255)
-            if detected_label != gt_state:
-                text_color = (0, 255, 255) 
-
-            cv2.putText(frame, display_text, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, text_color, 2)
-
-        alert_y_pos = 30
-        for bottle_id, text in on_screen_alerts.items():
-            alert_text = f"ALERT [ID: {bottle_id}]: {text}"
-            cv2.putText(frame, alert_text, (10, alert_y_pos), cv2.FONT_HERSHEY_TRIPLEX, 0.6, (0, 0, 220), 2)
-            alert_y_pos += 25
-
-        cv2.imshow('FactorySense - Live Simulation', frame)
+        gt_state = ground_truth_states.get(track_id, "N/A")
+        display_text = f"ID: {track_id} [Detected: {detected_label} | GT: {gt_state}]"
         
-        time_elapsed = time.time() - loop_start_time
-        sleep_time = FRAME_DURATION - time_elapsed
-        if sleep_time > 0:
-            time.sleep(sleep_time)
+        text_color = (255, 255, 255)
+        if detected_label != gt_state:
+            text_color = (0, 255, 255) 
+
+        cv2.putText(frame, display_text, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, text_color, 2)
+
+    alert_y_pos = 30
+    for bottle_id, text in packet['on_screen_alerts'].items():
+        alert_text = f"ALERT [ID: {bottle_id}]: {text}"
+        cv2.putText(frame, alert_text, (10, alert_y_pos), cv2.FONT_HERSHEY_TRIPLEX, 0.6, (0, 0, 220), 2)
+        alert_y_pos += 25
+
+    return frame
+
+
+def draw_metrics_hud(frame, hud_lines):
+    y_pos = HEIGHT - 10 - 18 * (len(hud_lines) - 1)
+    for line in hud_lines:
+        cv2.putText(frame, line, (10, y_pos), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        y_pos += 18
+
+
+def create_detector():
+    return YoloDetector(model_path=MODEL_PATH, confidence_threshold=CONFIDENCE_THRESHOLD,
+                        rois=DETECTION_ROIS, imgsz=DETECTION_IMGSZ, backend=DETECTOR_BACKEND,
+                        intra_op_threads=DETECTOR_THREADS, quantize=DETECTOR_QUANTIZE)
+
+
+def create_shared_detector():
+    # With more than one line, all lines share a single batching detector.
+    detector = create_detector()
+    if NUM_LINES > 1:
+        return BatchedDetector(detector, max_batch_size=DETECTION_MAX_BATCH, max_wait=DETECTION_MAX_WAIT)
+    return detector
+
+
+def create_llm_reasoner(metrics, timer=None):
+    # The LLM client (e.g. google.generativeai) is created in the background.
+    llm_cache = ExplanationCache(LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES, ttl_seconds=LLM_CACHE_TTL_SECONDS)
+    backend = Deferred('llm_backend', lambda: create_backend(LLM_BACKEND), timer)
+    return LLMReasoner(backend=backend, timeout=LLM_TIMEOUT, cache=llm_cache, metrics=metrics)
+
+
+def line_layout():
+    # Compiled once per process on first use.
+    return default_layout(LINE_LAYOUT_PATH)
+
+
+def line_path(path, line_id):
+    # One output file per line when several lines run at once.
+    if NUM_LINES == 1:
+        return path
+    base, extension = os.path.splitext(path)
+    return f"{base}_line{line_id}{extension}"
+
+
+def create_line_source(line_id, environment):
+    # Returns the source stage's name and the source itself.
+    if FRAME_SOURCE == 'simulator':
+        clock = create_clock(SIMULATION_CLOCK)
+        seed = None if SIMULATION_SEED is None else SIMULATION_SEED + line_id
+        scenario = ScenarioGenerator(total_bottles=5, spawn_interval=10, clock=clock, seed=seed,
+                                     layout=line_layout())
+        return 'render', make_render_stage(scenario, environment, clock)
+
+    path = FRAME_SOURCE_PATH[line_id - 1] if isinstance(FRAME_SOURCE_PATH, (list, tuple)) else FRAME_SOURCE_PATH
+    return 'read', create_frame_source(FRAME_SOURCE, path, FRAME_PREFETCH)
+
+
+def create_line_gate(environment):
+    # The motion gate that decides when the detector runs. The background of
+    # real footage is unknown, so there every frame is detected.
+    return MotionGate(environment, stride=DETECTION_STRIDE if FRAME_SOURCE == 'simulator' else 1)
+
+
+def create_line_input(line_id, environment):
+    return (*create_line_source(line_id, environment), create_line_gate(environment))
+
+
+def create_line_track_stage(line_id, llm_reasoner, gate, metrics, recorder=None, timer=None, events=None):
+    # DeepSORT's appearance embedder loads in the background like the detector.
+    tracker = Deferred(f'tracker_line{line_id}', lambda: create_tracker(TRACKER_BACKEND), timer)
+    bottle_tracker = BottleTracker(max_history=HISTORY_LENGTH, stale_after=STALE_TRACK_FRAMES)
+    anomaly_detector = AnomalyDetector(layout=line_layout(), history_window=HISTORY_LENGTH, stale_after=STALE_TRACK_FRAMES)
+    alert_manager = AlertManager(dedup_window=ALERT_DEDUP_FRAMES, cooldowns=ALERT_COOLDOWN_FRAMES,
+                                 max_entries=ALERT_MAX_ENTRIES, initial_text=PENDING_TEXT)
+    return make_track_stage(tracker, bottle_tracker, anomaly_detector, alert_manager, llm_reasoner, gate, metrics,
+                            recorder, events, line=line_id)
 
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
 
-    print("Processing finished. Press any key to exit.")
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
+def create_event_store():
+    return create_event_sink(EVENT_SINK, EVENT_STORE_PATH) if EVENT_SINK else None
+
+
+def create_line_recorder(line_id):
+    if not RECORD_PATH:
+        return None
+    return DetectionLogWriter(line_path(RECORD_PATH, line_id), layout=line_layout(), frame_width=WIDTH)
+
+
+def live_input():
+    # Live input may drop stale frames and starts before the models have
+    # loaded; stepped simulations and recorded footage must not lose any.
+    return SIMULATION_CLOCK == 'realtime' if FRAME_SOURCE == 'simulator' else FRAME_SOURCE == 'camera'
+
+
+def stage_policies():
+    return STAGE_POLICIES if live_input() else dict.fromkeys(STAGE_POLICIES, BLOCK)
+
+
+class ProductionLine:
+    def __init__(self, line_id, detector, llm_reasoner, static_background, metrics, timer, events=None):
+        self.line_id = line_id
+        self.metrics = metrics
+        self.timer = timer
+        self.frames_shown = 0
+        self.frames_warming_up = 0
+        self.first_detection_shown = False
+        self.frame_latency = metrics.histogram('frame_latency_seconds', line=line_id)
+        self.window_name = WINDOW_NAME if NUM_LINES == 1 else f"{WINDOW_NAME} [Line {line_id}]"
+
+        environment = compose_environment(static_background, line_layout())
+        source_name, source, self.gate = create_line_input(line_id, environment)
+        self.source = source if FRAME_SOURCE != 'simulator' else None
+        self.sink = create_frame_sink(FRAME_SINK, window_name=self.window_name,
+                                      path=line_path(OUTPUT_VIDEO_PATH, line_id), fps=TARGET_FPS)
+        self.recorder = create_line_recorder(line_id)
+
+        policies = stage_policies()
+        self.pipeline = Pipeline(queue_size=STAGE_QUEUE_SIZE, metrics=metrics, line=line_id)
+        self.pipeline.add_source(source_name, source, policy=policies['render'])
+        self.pipeline.add_stage('detect', make_detect_stage(detector, self.gate, metrics, line=line_id),
+                                policy=policies['detect'])
+        self.pipeline.add_stage('track', create_line_track_stage(line_id, llm_reasoner, self.gate, metrics,
+                                                                 self.recorder, timer, events),
+                                policy=policies['track'])
+
+    def show(self, packet):
+        if self.sink.wants_frames:
+            frame = annotate_frame(packet)
+            if SHOW_METRICS_HUD:
+                draw_metrics_hud(frame, self.metrics.hud_lines(line=self.line_id))
+            self.sink.write(frame)
+        self.frame_latency.observe(time.perf_counter() - packet['created'])
+
+        self.frames_shown += 1
+        if packet['detection_mode'] == WARMING_UP:
+            self.frames_warming_up += 1
+        if self.frames_shown == 1:
+            self.timer.mark('first_frame')
+        if not self.first_detection_shown and packet['detection_mode'] == DETECT:
+            self.first_detection_shown = True
+            self.timer.mark('first_detection')
+
+    def close(self):
+        if self.source is not None:
+            self.source.stop()
+        self.sink.close()
+        if self.recorder is not None:
+            frames = self.recorder.close()
+            print(f"[Line {self.line_id}] Recorded {frames} frames to {self.recorder.path}")
+
+    def report(self):
+        print(f"[Line {self.line_id}] Frames dropped per stage: {self.pipeline.dropped_counts()}")
+        for line in self.metrics.hud_lines(line=self.line_id):
+            print(f"[Line {self.line_id}] Stage latency {line}")
+        print(f"[Line {self.line_id}] Render-to-display latency: p95 {self.frame_latency.quantile(0.95) * 1000:.1f} ms")
+        print(f"[Line {self.line_id}] Detection gate: {self.gate.counts} "
+              f"(detector ran on {self.gate.detector_fraction():.0%} of frames)")
+        if self.frames_warming_up:
+            print(f"[Line {self.line_id}] {self.frames_warming_up} frames were shown while the models were loading")
+
+
+def main():
+    print("Initializing system components...")
+    timer = StartupTimer()
+    timer.mark('imports')
+    if PROCESS_LAYOUT:
+        static_background = load_static_background()
+        if FRAME_SINK == 'window':
+            cv2.namedWindow(WINDOW_NAME, cv2.WINDOW_NORMAL)
+            show_loading_screen(static_background)
+        import supervisor
+        supervisor.run(PROCESS_LAYOUT, static_background)
+        if FRAME_SINK == 'window':
+            cv2.destroyAllWindows()
+        return
+
+    # The detector, the trackers and the LLM client load in the background
+    # while the window opens and the first frames are rendered.
+    detector = Deferred('detector', create_shared_detector, timer)
+    metrics = MetricsRegistry()
+    timer.register(metrics)
+    exporter = MetricsExporter(metrics, jsonl_path=METRICS_JSONL_PATH, interval=METRICS_INTERVAL,
+                               prometheus_port=METRICS_PORT).start()
+    llm_reasoner = create_llm_reasoner(metrics, timer)
+    events = create_event_store()
+
+    with timer.phase('background'):
+        static_background = load_static_background()
+    if FRAME_SINK == 'window':
+        with timer.phase('window'):
+            cv2.namedWindow(WINDOW_NAME, cv2.WINDOW_NORMAL)
+            show_loading_screen(static_background)
+
+    with timer.phase('pipelines'):
+        lines = [ProductionLine(line_id, detector, llm_reasoner, static_background, metrics, timer, events)
+                 for line_id in range(1, NUM_LINES + 1)]
+
+    print("System initialized. Starting simulation...")
+    for line in lines:
+        line.pipeline.start()
+    running = list(lines)
+    try:
+        while running:
+            for line in list(running):
+                packet = line.pipeline.poll(timeout=0.01)
+                if packet is END_OF_STREAM:
+                    running.remove(line)
+                elif packet is not None:
+                    line.show(packet)
+            if any(line.sink.stop_requested() for line in lines):
+                break
+    finally:
+        for line in lines:
+            line.pipeline.stop()
+            line.close()
+        batched_detector = detector.peek() if NUM_LINES > 1 and detector.ready() else None
+        if batched_detector:
+            batched_detector.stop()
+        print(f"LLM explanation cache: {llm_reasoner.cache_stats()}")
+        llm_reasoner.shutdown()
+        if events is not None:
+            events.close()
+            print(f"Anomaly events: {events.stats()} in {events.path}")
+        exporter.stop()
+
+    for line in lines:
+        line.report()
+    for line in timer.report():
+        print(f"[STARTUP] {line}")
+    if batched_detector:
+        print(f"Batched detection: {batched_detector.batches} batches, "
+              f"mean batch size {batched_detector.mean_batch_size():.1f}")
+    if FRAME_SINK == 'window':
+        print("Processing finished. Press any key to exit.")
+        cv2.waitKey(0)
+        cv2.destroyAllWindows()
+    else:
+        print("Processing finished.")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,197 @@
+import bisect
+import json
+import threading
+import time
+
+# Latency buckets grow by sqrt(2) from 0.1 ms to about 18 s, which keeps the
+# quantile error under ~20% while an observation stays a bisect and an add.
+LATENCY_BUCKETS = tuple(0.0001 * 2 ** (i / 2) for i in range(36))
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30, 50, 100)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _series_name(name, labels, quote='"'):
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{key}={quote}{value}{quote}' for key, value in labels) + '}'
+
+
+class Histogram:
+    # Fixed-bucket histogram in the Prometheus style. Each histogram is meant
+    # to be written by a single thread (one pipeline stage), so observe() takes
+    # no lock; readers may see a count that is one observation behind.
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Linear interpolation inside the bucket holding the q-th observation,
+        # like Prometheus' histogram_quantile().
+        counts = list(self.counts)
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = q * total
+        cumulative = 0
+        for i, n in enumerate(counts):
+            if n and cumulative + n >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.bounds[-1]
+                return lower + (upper - lower) * (rank - cumulative) / n
+            cumulative += n
+        return self.bounds[-1]
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def summary(self):
+        summary = {'count': self.count, 'mean': self.mean()}
+        for q in QUANTILES:
+            summary[f'p{int(q * 100)}'] = self.quantile(q)
+        return summary
+
+
+class MetricsRegistry:
+    # Histograms are recorded as frames flow through the pipeline. Gauges and
+    # counters are callbacks (queue depth, drop counters, ...) that are only
+    # sampled when the metrics are exported, so they cost nothing per frame.
+    def __init__(self):
+        self._histograms = {}
+        self._callbacks = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def histogram(self, name, bounds=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(bounds)
+            return self._histograms[key]
+
+    def gauge(self, name, fn, **labels):
+        self._register_callback(name, fn, 'gauge', labels)
+
+    def counter(self, name, fn, **labels):
+        self._register_callback(name, fn, 'counter', labels)
+
+    def _register_callback(self, name, fn, kind, labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self._callbacks[key] = (kind, fn)
+
+    def _items(self):
+        with self._lock:
+            return sorted(self._histograms.items()), sorted(self._callbacks.items(), key=lambda item: item[0])
+
+    def snapshot(self):
+        histograms, callbacks = self._items()
+        return {
+            'time': time.time(),
+            'uptime': time.time() - self.started,
+            'histograms': {_series_name(name, labels, quote=''): h.summary() for (name, labels), h in histograms},
+            'values': {_series_name(name, labels, quote=''): fn() for (name, labels), (kind, fn) in callbacks}
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), separators=(',', ':'))
+
+    def to_prometheus(self, prefix='factorysense_'):
+        histograms, callbacks = self._items()
+        lines = []
+        declared = set()
+        for (name, labels), (kind, fn) in callbacks:
+            if name not in declared:
+                lines.append(f"# TYPE {prefix}{name} {kind}")
+                declared.add(name)
+            lines.append(f"{_series_name(prefix + name, labels)} {fn()}")
+
+        for (name, labels), h in histograms:
+            if name not in declared:
+                lines.append(f"# TYPE {prefix}{name} histogram")
+                declared.add(name)
+            counts = list(h.counts)
+            cumulative = 0
+            for bound, n in zip(h.bounds + ('+Inf',), counts):
+                cumulative += n
+                le = bound if bound == '+Inf' else f'{bound:.6g}'
+                lines.append(f"{_series_name(prefix + name + '_bucket', labels + (('le', le),))} {cumulative}")
+            lines.append(f"{_series_name(prefix + name + '_sum', labels)} {h.sum}")
+            lines.append(f"{_series_name(prefix + name + '_count', labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+    def hud_lines(self, name='stage_seconds', **labels):
+        # One 'stage p50/p95/p99' line per matching latency histogram, in ms.
+        wanted = {(k, str(v)) for k, v in labels.items()}
+        lines = []
+        for (hist_name, hist_labels), h in self._items()[0]:
+            if hist_name != name or not wanted <= set(hist_labels):
+                continue
+            stage = ' '.join(v for k, v in hist_labels if (k, v) not in wanted)
+            p50, p95, p99 = (h.quantile(q) * 1000 for q in QUANTILES)
+            lines.append(f"{stage}: p50 {p50:.1f} / p95 {p95:.1f} / p99 {p99:.1f} ms")
+        return lines
+
+
+class MetricsExporter:
+    # Writes a JSON snapshot every `interval` seconds to `jsonl_path` and/or
+    # serves the Prometheus text format at http://host:port/metrics. Both run
+    # on background threads so the pipeline never waits on them.
+    def __init__(self, registry, jsonl_path=None, interval=5.0, prometheus_port=None, host='127.0.0.1'):
+        self.registry = registry
+        self.jsonl_path = jsonl_path
+        self.interval = interval
+        self.prometheus_port = prometheus_port
+        self.host = host
+        self._stop_event = threading.Event()
+        self._writer = None
+        self._server = None
+
+    def start(self):
+        if self.jsonl_path:
+            self._writer = threading.Thread(target=self._write_loop, name='metrics-jsonl', daemon=True)
+            self._writer.start()
+        if self.prometheus_port is not None:
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+            registry = self.registry
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] != '/metrics':
+                        self.send_error(404)
+                        return
+                    body = registry.to_prometheus().encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self._server = ThreadingHTTPServer((self.host, self.prometheus_port), MetricsHandler)
+            threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+            print(f"[METRICS] Serving Prometheus metrics at http://{self.host}:{self.prometheus_port}/metrics")
+        return self
+
+    def _write_loop(self):
+        with open(self.jsonl_path, 'a') as f:
+            while not self._stop_event.wait(self.interval):
+                f.write(self.registry.to_json() + '\n')
+                f.flush()
+            f.write(self.registry.to_json() + '\n')
+
+    def stop(self):
+        self._stop_event.set()
+        if self._writer is not None:
+            self._writer.join(timeout=2.0)
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
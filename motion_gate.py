@@ -0,0 +1,88 @@
+import numpy as np
+
+DETECT = 'detect'
+PREDICT = 'predict'
+IDLE = 'idle'
+
+
+class MotionGate:
+    # Decides per frame whether YOLO has to run. The frame is compared with
+    # the static environment (background plus zone overlay) on a subsampled
+    # grid; foreground that is not explained by any of the tracker's
+    # predicted boxes means something new or unexpected is on the belt.
+    #   IDLE    - nothing differs from the background, skip detection.
+    #   PREDICT - every moving pixel sits inside a predicted box, feed the
+    #             tracker its own predictions until the stride is reached.
+    #   DETECT  - run the detector.
+    def __init__(self, background, stride=3, diff_threshold=30, min_changed_pixels=20, subsample=4,
+                 box_margin=12, max_idle_frames=30):
+        self.stride = stride
+        self.diff_threshold = diff_threshold
+        self.min_changed_pixels = min_changed_pixels
+        self.subsample = subsample
+        self.box_margin = box_margin
+        self.max_idle_frames = max_idle_frames
+        self._background = background[::subsample, ::subsample].astype(np.int16)
+        self._predicted_boxes = []
+        self.frames_since_detection = 0
+        self.counts = {DETECT: 0, PREDICT: 0, IDLE: 0}
+
+    def set_predicted_boxes(self, boxes):
+        # Called from the tracking stage; replaced wholesale so readers on
+        # other threads always see a complete list.
+        self._predicted_boxes = list(boxes)
+
+    def foreground_mask(self, frame):
+        sampled = frame[::self.subsample, ::self.subsample].astype(np.int16)
+        return np.abs(sampled - self._background).max(axis=2) > self.diff_threshold
+
+    def decide(self, frame):
+        mode = self._decide(frame)
+        self.counts[mode] += 1
+        self.frames_since_detection = 0 if mode == DETECT else self.frames_since_detection + 1
+        return mode
+
+    def _decide(self, frame):
+        if self.stride <= 1:
+            return DETECT
+
+        foreground = self.foreground_mask(frame)
+        if np.count_nonzero(foreground) < self.min_changed_pixels:
+            # An empty belt still gets an occasional confirmation pass.
+            return DETECT if self.frames_since_detection >= self.max_idle_frames else IDLE
+
+        predicted_boxes = self._predicted_boxes
+        if not predicted_boxes:
+            return DETECT
+
+        s, margin = self.subsample, self.box_margin
+        height, width = foreground.shape
+        for x1, y1, x2, y2 in predicted_boxes:
+            gx1, gy1 = max(0, (x1 - margin) // s), max(0, (y1 - margin) // s)
+            gx2, gy2 = min(width, (x2 + margin) // s + 1), min(height, (y2 + margin) // s + 1)
+            if gx2 > gx1 and gy2 > gy1:
+                foreground[gy1:gy2, gx1:gx2] = False
+
+        if np.count_nonzero(foreground) >= self.min_changed_pixels:
+            return DETECT
+        if self.frames_since_detection + 1 >= self.stride:
+            return DETECT
+        return PREDICT
+
+    def detector_fraction(self):
+        total = sum(self.counts.values())
+        return self.counts[DETECT] / total if total else 0.0
+
+
+def box_center_x(bbox):
+    return (bbox[0] + bbox[2]) // 2
+
+
+def settled_predictions(objects, detected_x, layout):
+    # A predicted box carries the label of its track's last real detection,
+    # which only holds while the bottle stays in the stretch of the line
+    # (same station, same expected state) where it was detected. Returns the
+    # objects that have not left that stretch; the others need the detector.
+    return [obj for obj in objects
+            if obj['id'] in detected_x
+            and layout.segment(box_center_x(obj['bbox'])) == layout.segment(detected_x[obj['id']])]
@@ -0,0 +1,216 @@
+import queue
+import threading
+import time
+
+DROP_OLDEST = 'drop_oldest'
+BLOCK = 'block'
+BACKPRESSURE_POLICIES = (DROP_OLDEST, BLOCK)
+
+# Sentinel pushed through every queue when a source runs dry so downstream
+# stages drain what they already hold and then exit in order.
+END_OF_STREAM = object()
+
+
+class StageQueue:
+    def __init__(self, maxsize=2, policy=DROP_OLDEST):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy '{policy}'. Use one of {BACKPRESSURE_POLICIES}.")
+        self.policy = policy
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def put(self, item, stop_event=None):
+        if item is END_OF_STREAM:
+            self._put_blocking(item, stop_event, force=True)
+            return
+
+        if self.policy == BLOCK:
+            self._put_blocking(item, stop_event)
+            return
+
+        with self._lock:
+            while True:
+                try:
+                    self._queue.put_nowait(item)
+                    return
+                except queue.Full:
+                    try:
+                        self._queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+
+    def _put_blocking(self, item, stop_event, force=False):
+        while True:
+            if stop_event is not None and stop_event.is_set() and not force:
+                return
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if force and stop_event is not None and stop_event.is_set():
+                    # Nobody is consuming any more; make room for the sentinel.
+                    try:
+                        self._queue.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def get(self, timeout=None):
+        return self._queue.get(timeout=timeout)
+
+    def get_nowait(self):
+        return self._queue.get_nowait()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+class PipelineStage(threading.Thread):
+    def __init__(self, name, fn, in_queue, out_queue, stop_event, latency=None):
+        super().__init__(name=name, daemon=True)
+        self.fn = fn
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.stop_event = stop_event
+        self.latency = latency
+        self.processed = 0
+        self.error = None
+
+    def _call(self, *args):
+        if self.latency is None:
+            return self.fn(*args)
+        started = time.perf_counter()
+        result = self.fn(*args)
+        self.latency.observe(time.perf_counter() - started)
+        return result
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                item = self._next_item()
+                if item is None:
+                    continue
+                if item is END_OF_STREAM:
+                    break
+                result = self._call(item)
+                self.processed += 1
+                if result is not None:
+                    self.out_queue.put(result, self.stop_event)
+        except Exception as e:
+            self.error = e
+            print(f"[PIPELINE] Stage '{self.name}' failed: {e}")
+            self.stop_event.set()
+        finally:
+            self.out_queue.put(END_OF_STREAM, self.stop_event)
+
+    def _next_item(self):
+        try:
+            return self.in_queue.get(timeout=0.1)
+        except queue.Empty:
+            return None
+
+
+class SourceStage(PipelineStage):
+    def __init__(self, name, fn, out_queue, stop_event, latency=None):
+        super().__init__(name, fn, None, out_queue, stop_event, latency)
+
+    def _next_item(self):
+        item = self._call()
+        return END_OF_STREAM if item is None else item
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                item = self._next_item()
+                if item is END_OF_STREAM:
+                    break
+                self.processed += 1
+                self.out_queue.put(item, self.stop_event)
+        except Exception as e:
+            self.error = e
+            print(f"[PIPELINE] Source '{self.name}' failed: {e}")
+            self.stop_event.set()
+        finally:
+            self.out_queue.put(END_OF_STREAM, self.stop_event)
+
+
+class Pipeline:
+    # With a MetricsRegistry every stage records its latency in
+    # 'stage_seconds', and each output queue's depth and drop count are
+    # exposed as 'queue_depth' and 'frames_dropped', all tagged with `labels`.
+    def __init__(self, queue_size=2, policy=DROP_OLDEST, metrics=None, **labels):
+        self.queue_size = queue_size
+        self.policy = policy
+        self.metrics = metrics
+        self.labels = labels
+        self.stop_event = threading.Event()
+        self.stages = []
+        self.queues = []
+        self._tail = None
+
+    def add_source(self, name, fn, queue_size=None, policy=None):
+        if self.stages:
+            raise RuntimeError("The source must be the first stage of the pipeline.")
+        out_queue = self._make_queue(name, queue_size, policy)
+        self.stages.append(SourceStage(name, fn, out_queue, self.stop_event, self._latency(name)))
+        self._tail = out_queue
+        return self
+
+    def add_stage(self, name, fn, queue_size=None, policy=None):
+        if self._tail is None:
+            raise RuntimeError("Add a source before adding processing stages.")
+        out_queue = self._make_queue(name, queue_size, policy)
+        self.stages.append(PipelineStage(name, fn, self._tail, out_queue, self.stop_event, self._latency(name)))
+        self._tail = out_queue
+        return self
+
+    def _make_queue(self, name, queue_size, policy):
+        stage_queue = StageQueue(
+            maxsize=queue_size or self.queue_size,
+            policy=policy or self.policy
+        )
+        self.queues.append(stage_queue)
+        if self.metrics is not None:
+            self.metrics.gauge('queue_depth', stage_queue.qsize, stage=name, **self.labels)
+            self.metrics.counter('frames_dropped', lambda: stage_queue.dropped, stage=name, **self.labels)
+        return stage_queue
+
+    def _latency(self, name):
+        if self.metrics is None:
+            return None
+        return self.metrics.histogram('stage_seconds', stage=name, **self.labels)
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+        return self
+
+    def poll(self, timeout=0.0):
+        # Returns the next finished item, None if nothing is ready yet, or
+        # END_OF_STREAM once every stage has shut down.
+        try:
+            return self._tail.get(timeout=timeout) if timeout else self._tail.get_nowait()
+        except queue.Empty:
+            if self.stop_event.is_set() and not any(s.is_alive() for s in self.stages):
+                return END_OF_STREAM
+            return None
+
+    def results(self, poll_interval=0.1):
+        while True:
+            item = self.poll(poll_interval)
+            if item is None:
+                continue
+            if item is END_OF_STREAM:
+                return
+            yield item
+
+    def stop(self, timeout=2.0):
+        self.stop_event.set()
+        deadline = time.time() + timeout
+        for stage in self.stages:
+            stage.join(max(0.0, deadline - time.time()))
+
+    def dropped_counts(self):
+        return {stage.name: q.dropped for stage, q in zip(self.stages, self.queues)}
@@ -0,0 +1,38 @@
+import time
+
+
+class RealTimeClock:
+    def now(self):
+        return time.time()
+
+    def wait_until(self, timestamp):
+        sleep_time = timestamp - time.time()
+        if sleep_time > 0:
+            time.sleep(sleep_time)
+
+
+class SteppedClock:
+    # Simulated time that only moves when the simulation asks it to, so runs
+    # go as fast as the hardware allows and are identical from run to run.
+    def __init__(self, start=0.0):
+        self._now = start
+
+    def now(self):
+        return self._now
+
+    def advance(self, seconds):
+        self._now += seconds
+
+    def wait_until(self, timestamp):
+        self._now = max(self._now, timestamp)
+
+
+REAL_TIME = RealTimeClock()
+
+
+def create_clock(kind):
+    if kind == 'realtime':
+        return RealTimeClock()
+    if kind == 'stepped':
+        return SteppedClock()
+    raise ValueError(f"Unknown simulation clock '{kind}'. Use 'realtime' or 'stepped'.")
@@ -2,27 +2,31 @@ import cv2
 import numpy as np
 import random
 import os
-import time
+from sim_clock import REAL_TIME
+from line_layout import LAYOUT_PATH, load_line_layout
 
 WIDTH, HEIGHT = 1280, 500
 CONVEYOR_Y = 420
 BELT_SPEED = 60
 
-ZONES = {
-    'filling': {'x_range': (250, 450), 'color': (255, 220, 220, 0.5)},
-    'capping': {'x_range': (550, 750), 'color': (220, 255, 220, 0.5)},
-    'labeling': {'x_range': (850, 1050), 'color': (220, 220, 255, 0.5)}
-}
 
-try:
-    BACKGROUND_PATHS = [os.path.join('backgrounds', f) for f in os.listdir('backgrounds') if f.endswith(('.png', '.jpg', '.jpeg'))]
-    if not BACKGROUND_PATHS:
-        print("Warning: 'backgrounds' folder is empty. Using plain background.")
+def default_layout(path=LAYOUT_PATH):
+    return load_line_layout(path, WIDTH)
+
+
+def list_background_paths(directory='backgrounds'):
+    # Looked up when a caller needs a background rather than at import time,
+    # so importing this module touches no files.
+    try:
+        paths = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(('.png', '.jpg', '.jpeg'))]
+    except FileNotFoundError:
+        print(f"Warning: '{directory}' folder not found. Using plain background.")
+        return []
+    if not paths:
+        print(f"Warning: '{directory}' folder is empty. Using plain background.")
     else:
-        print(f"Found {len(BACKGROUND_PATHS)} background images.")
-except FileNotFoundError:
-    print("Warning: 'backgrounds' folder not found. Using plain background.")
-    BACKGROUND_PATHS = []
+        print(f"Found {len(paths)} background images.")
+    return paths
 
 
 def overlay_transparent_image(background, overlay, x, y):
@@ -43,48 +47,106 @@ def overlay_transparent_image(background, overlay, x, y):
     background[y1:y2, x1:x2] = cv2.add(roi_bg, roi_fg)
 
 
-class VirtualBottle:
-    try:
-        BOTTLE_IMAGE = cv2.imread('bottle1.png', cv2.IMREAD_UNCHANGED)
-    except (FileNotFoundError, IndexError):
-        BOTTLE_IMAGE = None
+class PremultipliedSprite:
+    # A BGRA image prepared once for repeated blitting: colour is stored
+    # premultiplied by alpha and the inverse alpha is kept as an integer
+    # mask, so a blit is one integer multiply plus a saturating add. Fully
+    # transparent borders are trimmed so they cost nothing per frame.
+    def __init__(self, image):
+        alpha = image[:, :, 3]
+        rows = np.flatnonzero(alpha.any(axis=1))
+        cols = np.flatnonzero(alpha.any(axis=0))
+        self.height, self.width = image.shape[:2]
+        if len(rows) == 0:
+            self.offset_x = self.offset_y = 0
+            self.premultiplied = np.zeros((0, 0, 3), dtype=np.uint8)
+            self.inverse_alpha = np.zeros((0, 0, 1), dtype=np.uint16)
+            return
+
+        self.offset_y, self.offset_x = int(rows[0]), int(cols[0])
+        trimmed = image[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+        alpha = trimmed[:, :, 3:4].astype(np.uint16)
+        self.premultiplied = (trimmed[:, :, :3] * alpha // 255).astype(np.uint8)
+        self.inverse_alpha = 255 - alpha
+
+    def blit(self, background, x, y):
+        x += self.offset_x
+        y += self.offset_y
+        h, w = self.premultiplied.shape[:2]
+        y1, y2 = max(0, y), min(background.shape[0], y + h)
+        x1, x2 = max(0, x), min(background.shape[1], x + w)
+        if y2 <= y1 or x2 <= x1:
+            return
+        oy1, ox1 = y1 - y, x1 - x
+        oy2, ox2 = oy1 + (y2 - y1), ox1 + (x2 - x1)
+
+        roi = background[y1:y2, x1:x2]
+        roi_bg = (roi * self.inverse_alpha[oy1:oy2, ox1:ox2] // 255).astype(np.uint8)
+        background[y1:y2, x1:x2] = cv2.add(roi_bg, self.premultiplied[oy1:oy2, ox1:ox2])
 
-    def __init__(self, bottle_id, anomaly_type=None):
+
+class VirtualBottle:
+    BOTTLE_IMAGE_PATH = 'bottle1.png'
+    SPRITE_SCALE = 0.5
+    _sprite = None
+    _sprite_loaded = False
+
+    @classmethod
+    def sprite(cls):
+        # The bottle image is read on first use, then scaled and premultiplied
+        # once for all bottles. None if the image is missing.
+        if not cls._sprite_loaded:
+            image = cv2.imread(cls.BOTTLE_IMAGE_PATH, cv2.IMREAD_UNCHANGED)
+            if image is not None:
+                original_h, original_w = image.shape[:2]
+                size = (int(original_w * cls.SPRITE_SCALE), int(original_h * cls.SPRITE_SCALE))
+                cls._sprite = PremultipliedSprite(cv2.resize(image, size))
+            cls._sprite_loaded = True
+        return cls._sprite
+
+    def __init__(self, bottle_id, anomaly_type=None, clock=REAL_TIME, layout=None):
         self.id = bottle_id
+        self.clock = clock
+        self.layout = layout or default_layout()
         self.x = 0
         self.y = CONVEYOR_Y
-        self.state = 'bottle_empty'
-        self.image_to_draw = None
+        self.state = self.layout.initial_state
+        self.sprite_to_draw = self.sprite()
         
         self.anomaly_type = anomaly_type
         self.stuck_info = {'is_stuck': False, 'stuck_until': 0}
 
-        if self.BOTTLE_IMAGE is not None:
-            scale = 0.5  
-            original_h, original_w = self.BOTTLE_IMAGE.shape[:2]
-            self.height = int(original_h * scale)
-            self.width = int(original_w * scale)
-            self.image_to_draw = cv2.resize(self.BOTTLE_IMAGE, (self.width, self.height))
+        if self.sprite_to_draw is not None:
+            self.height = self.sprite_to_draw.height
+            self.width = self.sprite_to_draw.width
         else:
             self.width = 30
             self.height = 50 
             self.color = (180, 105, 50)
 
+    def _in_station(self, name, center_x):
+        # Scripted anomalies name the station they happen in and do nothing
+        # on a line without it.
+        station = self.layout.index.get(name)
+        return station is not None and self.layout.zone(center_x) == station
+
     def update_position(self, delta_time):
         if self.anomaly_type == 'stuck':
             center_x = self.x + self.width // 2
-            if ZONES['filling']['x_range'][0] < center_x < ZONES['filling']['x_range'][1] and not self.stuck_info['is_stuck']:
+            if self._in_station('filling', center_x) and not self.stuck_info['is_stuck']:
                 self.stuck_info['is_stuck'] = True
-                self.stuck_info['stuck_until'] = time.time() + 2
+                self.stuck_info['stuck_until'] = self.clock.now() + 2
                 print(f"[ANOMALY SCRIPT] Bottle {self.id} is now stuck in the filling zone.")
 
-        if self.stuck_info['is_stuck'] and time.time() < self.stuck_info['stuck_until']:
+        if self.stuck_info['is_stuck'] and self.clock.now() < self.stuck_info['stuck_until']:
             return
 
         current_speed = BELT_SPEED
         if self.anomaly_type == 'misaligned':
             center_x = self.x + self.width // 2
-            if ZONES['capping']['x_range'][1] < center_x < ZONES['labeling']['x_range'][0]:
+            ranges = self.layout.ranges
+            if 'capping' in ranges and 'labeling' in ranges and \
+                    ranges['capping'][1] <= center_x < ranges['labeling'][0]:
                 current_speed *= 2.5
 
         self.x += int(current_speed * delta_time)
@@ -92,25 +154,10 @@ class VirtualBottle:
     def update_state(self):
         center_x = self.x + self.width // 2
 
-        if self.anomaly_type == 'missing_label':
-            if ZONES['labeling']['x_range'][0] <= center_x < ZONES['labeling']['x_range'][1]:
-                self.state = 'bottle_capped'
-                return
-        if center_x < ZONES['filling']['x_range'][0]:
-            self.state = 'bottle_empty'
-        elif center_x < ZONES['capping']['x_range'][0]:
-            self.state = 'bottle_filled'
-        elif center_x < ZONES['labeling']['x_range'][0]:
-            self.state = 'bottle_capped'
-        else:
-            self.state = 'bottle_labeled'
-
-        if ZONES['filling']['x_range'][0] <= center_x < ZONES['filling']['x_range'][1]:
-            self.state = 'bottle_filling'
-        elif ZONES['capping']['x_range'][0] <= center_x < ZONES['capping']['x_range'][1]:
-            self.state = 'bottle_capped'
-        elif ZONES['labeling']['x_range'][0] <= center_x < ZONES['labeling']['x_range'][1]:
-            self.state = 'bottle_labeled'
+        if self.anomaly_type == 'missing_label' and self._in_station('labeling', center_x):
+            self.state = self.layout.state_before('labeling')
+            return
+        self.state = self.layout.state(center_x)
 
     def get_tracker_format(self):
         x1, y1 = self.x, self.y - self.height
@@ -118,20 +165,27 @@ class VirtualBottle:
         return {'id': self.id, 'label': self.state, 'bbox': [x1, y1, x2, y2], 'conf': 0.99}
 
     def draw(self, frame):
-        if self.image_to_draw is not None:
+        if self.sprite_to_draw is not None:
             draw_y = self.y - self.height
-            overlay_transparent_image(frame, self.image_to_draw, self.x, draw_y)
+            self.sprite_to_draw.blit(frame, self.x, draw_y)
         else:
             x1, y1, x2, y2 = self.get_tracker_format()['bbox']
             cv2.rectangle(frame, (x1, y1), (x2, y2), self.color, -1)
             cv2.rectangle(frame, (x1, y1), (x2, y2), (255,255,255), 1)
 
-def draw_environment(frame):
+def draw_environment(frame, layout=None):
     overlay = frame.copy()
-    for zone_name, props in ZONES.items():
-        x1, x2 = props['x_range']
-        color = props['color'][:3]
-        cv2.rectangle(overlay, (x1, 50), (x2, HEIGHT - 100), color, -1)
-        cv2.putText(frame, zone_name.upper(), (x1 + 10, 80), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,0,0), 2)
+    for station in (layout or default_layout()).stations:
+        x1, x2 = station['x_range']
+        cv2.rectangle(overlay, (x1, 50), (x2, HEIGHT - 100), station['color'], -1)
+        cv2.putText(frame, station['name'].upper(), (x1 + 10, 80), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,0,0), 2)
     cv2.addWeighted(overlay, 0.3, frame, 0.7, 0, frame)
-    cv2.line(frame, (0, CONVEYOR_Y), (WIDTH, CONVEYOR_Y), (0, 0, 0), 2)
\ No newline at end of file
+    cv2.line(frame, (0, CONVEYOR_Y), (WIDTH, CONVEYOR_Y), (0, 0, 0), 2)
+
+
+def compose_environment(background, layout=None):
+    # The zone overlay never changes, so it is blended into the background
+    # once; per frame the renderer only copies the result and blits bottles.
+    environment = background.copy()
+    draw_environment(environment, layout)
+    return environment
@@ -0,0 +1,197 @@
+import numpy as np
+from box_utils import iou_matrix, assign_by_iou
+
+# Bottles move at BELT_SPEED (60 px/s) and the pipeline runs at 30 FPS.
+BELT_VELOCITY_PX_PER_FRAME = 2.0
+
+
+class SortTracker:
+    # Appearance-free SORT/ByteTrack-style tracker. Each track carries a
+    # constant-velocity Kalman filter on its centre x along the conveyor; y,
+    # width and height are smoothed since the belt keeps them nearly fixed.
+    # High-confidence detections are associated first, the remaining tracks
+    # then get a second chance against the low-confidence ones.
+    def __init__(self, max_age=60, n_init=3, iou_threshold=0.3, high_conf_threshold=0.6,
+                 initial_velocity=BELT_VELOCITY_PX_PER_FRAME, process_noise=0.5, measurement_noise=4.0,
+                 size_smoothing=0.3, assignment='hungarian'):
+        self.max_age = max_age
+        self.n_init = n_init
+        self.iou_threshold = iou_threshold
+        self.high_conf_threshold = high_conf_threshold
+        self.initial_velocity = initial_velocity
+        self.measurement_noise = measurement_noise
+        self.size_smoothing = size_smoothing
+        self.assignment = assignment
+
+        self._F = np.array([[1.0, 1.0], [0.0, 1.0]])
+        self._Q = process_noise * np.array([[0.25, 0.5], [0.5, 1.0]])
+        self._initial_cov = np.array([[measurement_noise, 0.0], [0.0, 4.0]])
+
+        self._next_id = 1
+        self._ids = []
+        self._labels = []
+        self._state = np.zeros((0, 2))
+        self._cov = np.zeros((0, 2, 2))
+        self._cy = np.zeros(0)
+        self._size = np.zeros((0, 2))
+        self._conf = np.zeros(0)
+        self._hits = np.zeros(0, dtype=np.int32)
+        self._time_since_update = np.zeros(0, dtype=np.int32)
+
+    def _predict(self):
+        if not self._ids:
+            return
+        self._state = self._state @ self._F.T
+        self._cov = self._F @ self._cov @ self._F.T + self._Q
+        self._time_since_update += 1
+
+    def _boxes(self, indices=None):
+        cx = self._state[:, 0]
+        cy, w, h = self._cy, self._size[:, 0], self._size[:, 1]
+        boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+        return boxes if indices is None else boxes[indices]
+
+    def _correct(self, track_indices, det_boxes, det_conf, det_labels):
+        track_indices = np.asarray(track_indices, dtype=np.intp)
+        det_cx = (det_boxes[:, 0] + det_boxes[:, 2]) / 2
+        det_cy = (det_boxes[:, 1] + det_boxes[:, 3]) / 2
+        det_size = np.stack([det_boxes[:, 2] - det_boxes[:, 0], det_boxes[:, 3] - det_boxes[:, 1]], axis=1)
+
+        cov = self._cov[track_indices]
+        innovation = det_cx - self._state[track_indices, 0]
+        gain = cov[:, :, 0] / (cov[:, 0, 0] + self.measurement_noise)[:, None]
+        self._state[track_indices] += gain * innovation[:, None]
+        self._cov[track_indices] = cov - gain[:, :, None] * cov[:, 0, None, :]
+
+        alpha = self.size_smoothing
+        self._cy[track_indices] = (1 - alpha) * self._cy[track_indices] + alpha * det_cy
+        self._size[track_indices] = (1 - alpha) * self._size[track_indices] + alpha * det_size
+        self._conf[track_indices] = det_conf
+        self._hits[track_indices] += 1
+        self._time_since_update[track_indices] = 0
+        for track_index, label in zip(track_indices.tolist(), det_labels):
+            self._labels[track_index] = label
+
+    def _spawn(self, det_boxes, det_conf, det_labels):
+        count = len(det_boxes)
+        if count == 0:
+            return
+        cx = (det_boxes[:, 0] + det_boxes[:, 2]) / 2
+        state = np.stack([cx, np.full(count, self.initial_velocity)], axis=1)
+        size = np.stack([det_boxes[:, 2] - det_boxes[:, 0], det_boxes[:, 3] - det_boxes[:, 1]], axis=1)
+
+        self._state = np.concatenate([self._state, state])
+        self._cov = np.concatenate([self._cov, np.repeat(self._initial_cov[None], count, axis=0)])
+        self._cy = np.concatenate([self._cy, (det_boxes[:, 1] + det_boxes[:, 3]) / 2])
+        self._size = np.concatenate([self._size, size])
+        self._conf = np.concatenate([self._conf, det_conf])
+        self._hits = np.concatenate([self._hits, np.ones(count, dtype=np.int32)])
+        self._time_since_update = np.concatenate([self._time_since_update, np.zeros(count, dtype=np.int32)])
+        for label in det_labels:
+            self._ids.append(str(self._next_id))
+            self._labels.append(label)
+            self._next_id += 1
+
+    def _prune(self, coasting=False):
+        # Unconfirmed tracks die on their first miss, confirmed ones after
+        # max_age. Frames without detections are no miss for either.
+        keep = (self._time_since_update <= self.max_age) & (
+            (self._hits >= self.n_init) | (self._time_since_update == 0) | coasting
+        )
+        if keep.all():
+            return
+        kept = np.flatnonzero(keep)
+        self._ids = [self._ids[i] for i in kept]
+        self._labels = [self._labels[i] for i in kept]
+        self._state = self._state[kept]
+        self._cov = self._cov[kept]
+        self._cy = self._cy[kept]
+        self._size = self._size[kept]
+        self._conf = self._conf[kept]
+        self._hits = self._hits[kept]
+        self._time_since_update = self._time_since_update[kept]
+
+    def _associate(self, track_indices, det_indices, det_boxes):
+        if len(track_indices) == 0 or len(det_indices) == 0:
+            return [], list(track_indices), list(det_indices)
+        iou = iou_matrix(self._boxes(track_indices), det_boxes[det_indices])
+        pairs = assign_by_iou(iou, self.iou_threshold, method=self.assignment)
+        matched_tracks = {r for r, _ in pairs}
+        matched_dets = {c for _, c in pairs}
+        matches = [(track_indices[r], det_indices[c]) for r, c in pairs]
+        unmatched_tracks = [t for r, t in enumerate(track_indices) if r not in matched_tracks]
+        unmatched_dets = [d for c, d in enumerate(det_indices) if c not in matched_dets]
+        return matches, unmatched_tracks, unmatched_dets
+
+    def update_tracks(self, detections, frame=None):
+        self._predict()
+
+        det_boxes = np.array([det['bbox'] for det in detections], dtype=np.float64).reshape(-1, 4)
+        det_conf = np.array([det['conf'] for det in detections], dtype=np.float64)
+        det_labels = [det['label'] for det in detections]
+
+        high = [i for i in range(len(detections)) if det_conf[i] >= self.high_conf_threshold]
+        low = [i for i in range(len(detections)) if det_conf[i] < self.high_conf_threshold]
+
+        all_tracks = list(range(len(self._ids)))
+        matches, remaining_tracks, unmatched_high = self._associate(all_tracks, high, det_boxes)
+        low_matches, _, _ = self._associate(remaining_tracks, low, det_boxes)
+        matches += low_matches
+
+        if matches:
+            track_indices = [t for t, _ in matches]
+            det_indices = [d for _, d in matches]
+            self._correct(track_indices, det_boxes[det_indices], det_conf[det_indices],
+                          [det_labels[d] for d in det_indices])
+
+        # Only confident detections may start new tracks.
+        self._spawn(det_boxes[unmatched_high], det_conf[unmatched_high], [det_labels[d] for d in unmatched_high])
+        self._prune()
+
+        return self._output(np.flatnonzero((self._hits >= self.n_init) & (self._time_since_update == 0)))
+
+    def predict_tracks(self, track_ids=None):
+        # Advances every track one frame on the motion model alone, for frames
+        # on which the detector is skipped. Nothing counts as a hit, so tracks
+        # keep ageing until a real detection confirms them. Returns the
+        # confirmed tracks among track_ids in the format of update_tracks.
+        self._predict()
+        self._prune(coasting=True)
+        wanted = None if track_ids is None else set(track_ids)
+        return self._output([i for i in np.flatnonzero(self._hits >= self.n_init)
+                             if wanted is None or self._ids[i] in wanted])
+
+    def _output(self, indices):
+        output = []
+        boxes = self._boxes()
+        for i in indices:
+            x1, y1, x2, y2 = boxes[i]
+            output.append({
+                'id': self._ids[i],
+                'label': self._labels[i],
+                'bbox': [int(x1), int(y1), int(x2), int(y2)],
+                'conf': round(float(self._conf[i]), 2)
+            })
+        return output
+
+    def predicted_detections(self, track_ids=None):
+        # One-step-ahead boxes from the motion model, in detection format:
+        # where each track is expected on the next frame.
+        if not self._ids:
+            return []
+        predicted_cx = self._state[:, 0] + self._state[:, 1]
+        half_w, half_h = self._size[:, 0] / 2, self._size[:, 1] / 2
+        wanted = None if track_ids is None else set(track_ids)
+
+        detections = []
+        for i in np.flatnonzero(self._hits >= self.n_init):
+            if wanted is not None and self._ids[i] not in wanted:
+                continue
+            detections.append({
+                'id': self._ids[i],
+                'bbox': [int(predicted_cx[i] - half_w[i]), int(self._cy[i] - half_h[i]),
+                         int(predicted_cx[i] + half_w[i]), int(self._cy[i] + half_h[i])],
+                'conf': float(self._conf[i]),
+                'label': self._labels[i]
+            })
+        return detections
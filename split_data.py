@@ -1,10 +1,85 @@
 import os
 import random
 import shutil
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
 SOURCE_DIR = 'data'
 TRAIN_RATIO = 0.8
+SEED = 0
+# 'manifest' writes train.txt/val.txt listing the images (what dataset.yaml
+# points at) and leaves the data untouched. 'hardlink' builds train/ and val/
+# directories out of hardlinks, 'move' is the original destructive split.
+SPLIT_MODE = 'manifest'
+# Keep each class's share the same in train and val, using the dominant class
+# in every label file (frames without labels form their own group).
+STRATIFY = True
+NUM_WORKERS = 16
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def dominant_class(label_path):
+    try:
+        with open(label_path) as f:
+            classes = Counter(line.split(maxsplit=1)[0] for line in f if line.strip())
+    except FileNotFoundError:
+        return None
+    return classes.most_common(1)[0][0] if classes else None
+
+
+def split_filenames(filenames, labels_dir, rng):
+    if not STRATIFY:
+        filenames = sorted(filenames)
+        rng.shuffle(filenames)
+        split_index = int(len(filenames) * TRAIN_RATIO)
+        return filenames[:split_index], filenames[split_index:]
+
+    label_paths = [os.path.join(labels_dir, f"{os.path.splitext(f)[0]}.txt") for f in filenames]
+    with ThreadPoolExecutor(NUM_WORKERS) as pool:
+        classes = list(tqdm(pool.map(dominant_class, label_paths), total=len(label_paths), desc="Reading labels"))
+
+    groups = defaultdict(list)
+    for filename, class_id in zip(filenames, classes):
+        groups[class_id].append(filename)
+
+    train_files, val_files = [], []
+    for class_id in sorted(groups, key=str):
+        group = sorted(groups[class_id])
+        rng.shuffle(group)
+        split_index = int(len(group) * TRAIN_RATIO)
+        train_files += group[:split_index]
+        val_files += group[split_index:]
+        print(f"  class {class_id if class_id is not None else 'none'}: "
+              f"{split_index} train / {len(group) - split_index} val")
+    return train_files, val_files
+
+
+def write_manifest(path, filenames):
+    # Ultralytics resolves './' entries relative to the manifest's directory and
+    # finds each label by swapping 'images' for 'labels' in the path.
+    with open(path, 'w') as f:
+        f.writelines(f"./images/{filename}\n" for filename in sorted(filenames))
+
+
+def transfer_files(filenames, images_dir, labels_dir, img_dest, lbl_dest, transfer):
+    def transfer_one(filename):
+        base_name = os.path.splitext(filename)[0]
+        transfer(os.path.join(images_dir, filename), os.path.join(img_dest, filename))
+
+        label_src_path = os.path.join(labels_dir, f"{base_name}.txt")
+        if os.path.exists(label_src_path):
+            transfer(label_src_path, os.path.join(lbl_dest, f"{base_name}.txt"))
+
+    with ThreadPoolExecutor(NUM_WORKERS) as pool:
+        list(tqdm(pool.map(transfer_one, filenames), total=len(filenames)))
+
+
+def hardlink(src, dst):
+    if os.path.exists(dst):
+        os.remove(dst)
+    os.link(src, dst)
+
 
 def split_dataset():
     images_dir = os.path.join(SOURCE_DIR, 'images')
@@ -15,6 +90,24 @@ def split_dataset():
         print("Please run the generate_data.py script first.")
         return
 
+    filenames = [f for f in os.listdir(images_dir) if f.endswith(IMAGE_EXTENSIONS)]
+    rng = random.Random(SEED)
+    train_files, val_files = split_filenames(filenames, labels_dir, rng)
+
+    print(f"Total images: {len(filenames)}")
+    print(f"Training images: {len(train_files)}")
+    print(f"Validation images: {len(val_files)}")
+
+    if SPLIT_MODE == 'manifest':
+        write_manifest(os.path.join(SOURCE_DIR, 'train.txt'), train_files)
+        write_manifest(os.path.join(SOURCE_DIR, 'val.txt'), val_files)
+        print(f"\nWrote '{SOURCE_DIR}/train.txt' and '{SOURCE_DIR}/val.txt'. Source data left in place.")
+        return
+
+    if SPLIT_MODE not in ('hardlink', 'move'):
+        print(f"Error: Unknown SPLIT_MODE '{SPLIT_MODE}'. Use 'manifest', 'hardlink' or 'move'.")
+        return
+
     train_img_dir = os.path.join(SOURCE_DIR, 'train', 'images')
     train_lbl_dir = os.path.join(SOURCE_DIR, 'train', 'labels')
     val_img_dir = os.path.join(SOURCE_DIR, 'val', 'images')
@@ -23,45 +116,24 @@ def split_dataset():
     for path in [train_img_dir, train_lbl_dir, val_img_dir, val_lbl_dir]:
         os.makedirs(path, exist_ok=True)
 
-    filenames = [f for f in os.listdir(images_dir) if f.endswith('.png')]
-    random.shuffle(filenames)
-
-    split_index = int(len(filenames) * TRAIN_RATIO)
-
-    train_files = filenames[:split_index]
-    val_files = filenames[split_index:]
-
-    print(f"Total images: {len(filenames)}")
-    print(f"Training images: {len(train_files)}")
-    print(f"Validation images: {len(val_files)}")
-    print("\nMoving training files...")
-    for filename in tqdm(train_files):
-        base_name = os.path.splitext(filename)[0]
-        
-        shutil.move(os.path.join(images_dir, filename), os.path.join(train_img_dir, filename))
-        
-        label_src_path = os.path.join(labels_dir, f"{base_name}.txt")
-        if os.path.exists(label_src_path):
-            shutil.move(label_src_path, os.path.join(train_lbl_dir, f"{base_name}.txt"))
-
-    print("\nMoving validation files...")
-    for filename in tqdm(val_files):
-        base_name = os.path.splitext(filename)[0]
-        shutil.move(os.path.join(images_dir, filename), os.path.join(val_img_dir, filename))
+    transfer = hardlink if SPLIT_MODE == 'hardlink' else shutil.move
+    verb = "Linking" if SPLIT_MODE == 'hardlink' else "Moving"
 
-        label_src_path = os.path.join(labels_dir, f"{base_name}.txt")
-        if os.path.exists(label_src_path):
-            shutil.move(label_src_path, os.path.join(val_lbl_dir, f"{base_name}.txt"))
+    print(f"\n{verb} training files...")
+    transfer_files(train_files, images_dir, labels_dir, train_img_dir, train_lbl_dir, transfer)
 
+    print(f"\n{verb} validation files...")
+    transfer_files(val_files, images_dir, labels_dir, val_img_dir, val_lbl_dir, transfer)
 
     print("\nDataset successfully split into training and validation sets.")
-   
-    try:
-        os.rmdir(images_dir)
-        os.rmdir(labels_dir)
-    except OSError as e:
-        print(f"Note: Could not remove original directories (they may not be empty): {e}")
+
+    if SPLIT_MODE == 'move':
+        try:
+            os.rmdir(images_dir)
+            os.rmdir(labels_dir)
+        except OSError as e:
+            print(f"Note: Could not remove original directories (they may not be empty): {e}")
 
 
 if __name__ == '__main__':
-    split_dataset()
\ No newline at end of file
+    split_dataset()
@@ -0,0 +1,107 @@
+import threading
+import time
+
+# Origin of the startup report: the moment this module was first imported,
+# which main.py does before anything else.
+PROCESS_STARTED = time.perf_counter()
+
+# Detection mode of frames that arrive before the detector has loaded.
+WARMING_UP = 'warming_up'
+
+
+class StartupTimer:
+    # Collects how long each startup phase took. Phases may overlap (the
+    # models load in parallel with each other and with the first frames), so
+    # each one is reported with its start offset as well as its duration.
+    def __init__(self, started=PROCESS_STARTED):
+        self.started = started
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, started, finished=None):
+        finished = time.perf_counter() if finished is None else finished
+        with self._lock:
+            self.phases.setdefault(name, (started - self.started, finished - started))
+
+    def mark(self, name):
+        # A milestone such as the first frame: a phase that began at startup.
+        self.record(name, self.started)
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def elapsed(self, name):
+        with self._lock:
+            offset, duration = self.phases.get(name, (None, None))
+        return None if offset is None else offset + duration
+
+    def register(self, metrics):
+        metrics.gauge('startup_seconds', lambda: self.elapsed('first_frame') or 0.0, milestone='first_frame')
+        metrics.gauge('startup_seconds', lambda: self.elapsed('first_detection') or 0.0, milestone='first_detection')
+
+    def report(self):
+        with self._lock:
+            phases = sorted(self.phases.items(), key=lambda item: (item[1][0], item[1][1]))
+        return [f"{name:<24} starts {offset * 1000:>8.1f} ms  takes {duration * 1000:>8.1f} ms"
+                for name, (offset, duration) in phases]
+
+
+class _Phase:
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.record(self.name, self.started)
+
+
+class Deferred:
+    # Builds an expensive component (a model, a tracker with an embedder, an
+    # LLM client) on a background thread so several of them load at once
+    # while the pipeline is already producing frames. Stages poll ready()
+    # and skip the component until it is there; get() waits for it.
+    def __init__(self, name, factory, timer=None):
+        self.name = name
+        self._factory = factory
+        self._timer = timer
+        self._value = None
+        self._error = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._build, name=f'load-{name}', daemon=True)
+        self._thread.start()
+
+    def _build(self):
+        started = time.perf_counter()
+        try:
+            self._value = self._factory()
+        except Exception as e:
+            self._error = e
+            print(f"[STARTUP] Could not load {self.name}: {e}")
+        finally:
+            if self._timer is not None:
+                self._timer.record(self.name, started)
+            self._done.set()
+
+    def ready(self):
+        return self._done.is_set() and self._error is None
+
+    def failed(self):
+        return self._done.is_set() and self._error is not None
+
+    def get(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"{self.name} is still loading.")
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def peek(self):
+        # The component if it has loaded, None while it is still loading.
+        # Raises the load error if loading failed.
+        if not self._done.is_set():
+            return None
+        return self.get()
@@ -0,0 +1,413 @@
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import numpy as np
+from multiprocessing import shared_memory
+import main as app
+from startup import StartupTimer, Deferred
+from metrics import MetricsRegistry, MetricsExporter
+from simulation_elements import compose_environment, WIDTH, HEIGHT
+
+FRAME_SHAPE = (HEIGHT, WIDTH, 3)
+END_OF_STREAM = 'END_OF_STREAM'
+# Process layouts. 'stages' gives every line a source, a detect and a track
+# process; 'lines' runs the whole line in one process. Either way the parent
+# only annotates and sinks the finished frames.
+LAYOUTS = {
+    'stages': (('render',), ('detect',), ('track',)),
+    'lines': (('render', 'detect', 'track'),)
+}
+HEARTBEAT_TIMEOUT = 10.0
+
+
+class SharedFrameRing:
+    # A block of shared memory cut into fixed FRAME_SHAPE slots. A slot index
+    # travels with each packet through multiprocessing queues; the frame
+    # itself is written once by the source process and every later process
+    # maps the same pixels, so frames are never pickled. Free slot indices
+    # live in a queue, which bounds the frames in flight and makes the source
+    # wait when every slot is taken.
+    def __init__(self, slots=8, shape=FRAME_SHAPE, name=None, free_slots=None):
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.slot_bytes = int(np.prod(self.shape))
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=slots * self.slot_bytes)
+            self.free_slots = mp.get_context('spawn').Queue()
+            for slot in range(slots):
+                self.free_slots.put(slot)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.free_slots = free_slots
+            self.owner = False
+        self._frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=self.shm.buf)
+
+    def handle(self):
+        # Everything a child process needs to attach to the same ring.
+        return {'name': self.shm.name, 'slots': self.slots, 'shape': self.shape, 'free_slots': self.free_slots}
+
+    @classmethod
+    def attach(cls, handle):
+        return cls(handle['slots'], handle['shape'], handle['name'], handle['free_slots'])
+
+    def acquire(self, stop_event, on_wait=None):
+        # on_wait is called every 0.1 s while all slots are in use.
+        while not stop_event.is_set():
+            try:
+                return self.free_slots.get(timeout=0.1)
+            except queue.Empty:
+                if on_wait is not None:
+                    on_wait()
+        return None
+
+    def release(self, slot):
+        self.free_slots.put(slot)
+
+    def frame(self, slot):
+        return self._frames[slot]
+
+    def close(self):
+        self._frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class GateFeedback:
+    # Stands in for the MotionGate in a track process that is separate from
+    # the detect process: the tracker's predicted boxes are sent back, and the
+    # detect process applies the newest ones before deciding on a frame.
+    def __init__(self, feedback_queue):
+        self.queue = feedback_queue
+
+    def set_predicted_boxes(self, boxes):
+        try:
+            self.queue.put_nowait([list(map(int, box)) for box in boxes])
+        except queue.Full:
+            pass
+
+
+def _apply_feedback(gate, feedback_queue):
+    boxes = None
+    while True:
+        try:
+            boxes = feedback_queue.get_nowait()
+        except queue.Empty:
+            break
+    if boxes is not None:
+        gate.set_predicted_boxes(boxes)
+
+
+def _build_stages(stage_names, line_id, static_background, feedback_queue, metrics, timer):
+    # Builds this process's share of the line with the same factories the
+    # threaded main.py uses. The source is returned separately since it
+    # produces packets instead of transforming them.
+    # Only the processes that render or gate frames need the environment, and
+    # only the one running the source builds it (and its scenario).
+    environment = None
+    if 'render' in stage_names or 'detect' in stage_names:
+        environment = compose_environment(static_background, app.line_layout())
+    gate = app.create_line_gate(environment) if 'detect' in stage_names else GateFeedback(feedback_queue)
+
+    stages = []
+    closers = []
+    if 'detect' in stage_names:
+        detect = app.make_detect_stage(Deferred('detector', app.create_detector, timer), gate, metrics, line=line_id)
+        if 'track' not in stage_names:
+            motion_gate = gate
+
+            def detect_with_feedback(packet):
+                _apply_feedback(motion_gate, feedback_queue)
+                return detect(packet)
+
+            stages.append(('detect', detect_with_feedback))
+        else:
+            stages.append(('detect', detect))
+    if 'track' in stage_names:
+        llm_reasoner = app.create_llm_reasoner(metrics, timer)
+        recorder = app.create_line_recorder(line_id)
+        events = app.create_event_store()
+        stages.append(('track', app.create_line_track_stage(line_id, llm_reasoner, gate, metrics, recorder, timer,
+                                                            events)))
+        closers.append(llm_reasoner.shutdown)
+        if events is not None:
+            closers.append(events.close)
+        if recorder is not None:
+            closers.append(recorder.close)
+    if 'render' in stage_names:
+        source_name, source = app.create_line_source(line_id, environment)
+        if hasattr(source, 'stop'):
+            closers.append(source.stop)
+        return (source_name, source), stages, closers
+    return None, stages, closers
+
+
+def _run_worker(name, line_id, stage_names, static_background, ring_handle, in_queue, out_queue,
+                feedback_queue, status_queue, stop_event, health_interval):
+    timer = StartupTimer()
+    ring = SharedFrameRing.attach(ring_handle)
+    metrics = MetricsRegistry()
+    processed = 0
+    error = None
+    started = last_report = time.time()
+
+    def heartbeat():
+        nonlocal last_report
+        if time.time() - last_report >= health_interval:
+            report()
+            last_report = time.time()
+
+    def report(final=False):
+        elapsed = time.time() - started
+        status_queue.put({
+            'name': name,
+            'pid': os.getpid(),
+            'processed': processed,
+            'fps': processed / elapsed if elapsed > 0 else 0.0,
+            'error': repr(error) if error else None,
+            'final': final,
+            'first_frame_ms': round((timer.elapsed('first_frame') or 0.0) * 1000, 1),
+            'time': time.time(),
+            'latency_ms': {key: round(summary['p50'] * 1000, 2)
+                           for key, summary in metrics.snapshot()['histograms'].items()
+                           if key.startswith(('stage_seconds', 'step_seconds'))}
+        })
+
+    def report_until_first_frame():
+        # Building the stages and the first frame may wait on model loads or
+        # on upstream processes for longer than the heartbeat timeout, inside
+        # calls the loop below cannot interrupt. Report from here until then.
+        while processed == 0 and not stop_event.wait(health_interval):
+            report()
+
+    threading.Thread(target=report_until_first_frame, name='warmup-heartbeat', daemon=True).start()
+    source, stages, closers = None, [], []
+    try:
+        source, stages, closers = _build_stages(stage_names, line_id, static_background, feedback_queue, metrics,
+                                                 timer)
+        stage_latency = {stage: metrics.histogram('stage_seconds', stage=stage, line=line_id)
+                         for stage, _ in ([source] if source else []) + stages}
+        while not stop_event.is_set():
+            if source is not None:
+                source_name, read = source
+                t0 = time.perf_counter()
+                packet = read()
+                stage_latency[source_name].observe(time.perf_counter() - t0)
+                if packet is None:
+                    break
+                # Waiting for downstream to free a slot is not a stall here.
+                slot = ring.acquire(stop_event, on_wait=heartbeat)
+                if slot is None:
+                    break
+                # The single copy of the frame: into its shared slot.
+                frame = ring.frame(slot)
+                np.copyto(frame, packet['frame'])
+                packet['frame'] = frame
+            else:
+                try:
+                    message = in_queue.get(timeout=0.1)
+                except queue.Empty:
+                    # Still healthy while waiting for the first frames, e.g.
+                    # during model warm-up upstream.
+                    heartbeat()
+                    continue
+                if message == END_OF_STREAM:
+                    break
+                slot, packet = message
+                packet['frame'] = ring.frame(slot)
+
+            for stage, fn in stages:
+                t0 = time.perf_counter()
+                packet = fn(packet)
+                stage_latency[stage].observe(time.perf_counter() - t0)
+
+            del packet['frame']
+            out_queue.put((slot, packet))
+            processed += 1
+            if processed == 1:
+                timer.mark('first_frame')
+            heartbeat()
+    except Exception as e:
+        error = e
+        print(f"[SUPERVISOR] Process '{name}' failed: {e}")
+        stop_event.set()
+    finally:
+        out_queue.put(END_OF_STREAM)
+        for close in closers:
+            try:
+                close()
+            except Exception as e:
+                print(f"[SUPERVISOR] Process '{name}' did not close cleanly: {e}")
+        report(final=True)
+        ring.close()
+
+
+class Supervisor:
+    # Runs every line as a chain of processes connected by queues of slot
+    # indices, watches their heartbeats and shuts them down together. The
+    # parent process only annotates and sinks finished frames.
+    def __init__(self, layout, static_background, num_lines=1, ring_slots=8, health_interval=5.0):
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown process layout '{layout}'. Use one of {tuple(LAYOUTS)}.")
+        self.layout = layout
+        self.static_background = static_background
+        self.num_lines = num_lines
+        self.ring_slots = ring_slots
+        self.health_interval = health_interval
+        self.context = mp.get_context('spawn')
+        self.stop_event = self.context.Event()
+        self.status_queue = self.context.Queue()
+        self.processes = {}
+        self.health = {}
+        self.rings = {}
+        self.outputs = {}
+        self._queues = []
+
+    def start(self):
+        groups = LAYOUTS[self.layout]
+        for line_id in range(1, self.num_lines + 1):
+            ring = SharedFrameRing(self.ring_slots)
+            self.rings[line_id] = ring
+            feedback_queue = self.context.Queue(maxsize=4)
+            in_queue = None
+            for stage_names in groups:
+                out_queue = self.context.Queue()
+                self._queues += [out_queue, feedback_queue]
+                name = f"line{line_id}-{'+'.join(stage_names)}"
+                process = self.context.Process(
+                    target=_run_worker, name=name, daemon=True,
+                    args=(name, line_id, stage_names, self.static_background, ring.handle(), in_queue, out_queue,
+                          feedback_queue, self.status_queue, self.stop_event, self.health_interval)
+                )
+                process.start()
+                self.processes[name] = process
+                self.health[name] = {'name': name, 'pid': process.pid, 'processed': 0, 'time': time.time()}
+                in_queue = out_queue
+            self.outputs[line_id] = in_queue
+        return self
+
+    def poll(self, line_id, timeout=0.01, copy_frame=True):
+        # Returns the next finished packet of a line with its frame copied out
+        # of the ring (the slot is handed back straight away), None if nothing
+        # is ready, or END_OF_STREAM once the line's last process has finished.
+        # Without copy_frame, e.g. for a sink that takes no frames, the packet's
+        # frame is None and the slot is released without reading it.
+        try:
+            message = self.outputs[line_id].get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if message == END_OF_STREAM:
+            return END_OF_STREAM
+        slot, packet = message
+        ring = self.rings[line_id]
+        packet['frame'] = ring.frame(slot).copy() if copy_frame else None
+        ring.release(slot)
+        return packet
+
+    def update_health(self):
+        while True:
+            try:
+                status = self.status_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.health[status['name']] = status
+        now = time.time()
+        for name, process in self.processes.items():
+            status = self.health[name]
+            status['alive'] = process.is_alive()
+            status['exitcode'] = process.exitcode
+            status['stale'] = process.is_alive() and now - status['time'] > max(HEARTBEAT_TIMEOUT,
+                                                                               3 * self.health_interval)
+        return self.health
+
+    def failed(self):
+        return [name for name, status in self.update_health().items()
+                if status.get('error') or (status['exitcode'] not in (None, 0))]
+
+    def print_health(self):
+        for name, status in sorted(self.update_health().items()):
+            state = 'alive' if status['alive'] else f"exited ({status['exitcode']})"
+            if status.get('stale'):
+                state += ', no heartbeat'
+            if status.get('error'):
+                state += f", error {status['error']}"
+            print(f"[SUPERVISOR] {name} (pid {status['pid']}): {state}, {status['processed']} frames, "
+                  f"{status.get('fps', 0.0):.1f} fps, first frame after {status.get('first_frame_ms', 0.0)} ms, p50 latency {status.get('latency_ms', {})}")
+
+    def stop(self, timeout=5.0):
+        self.stop_event.set()
+        deadline = time.time() + timeout
+        # Keep draining the outputs so no process blocks on a full pipe.
+        while any(p.is_alive() for p in self.processes.values()) and time.time() < deadline:
+            for line_id in self.outputs:
+                packet = self.poll(line_id, timeout=0.01, copy_frame=False)
+                if packet is END_OF_STREAM:
+                    continue
+        for name, process in self.processes.items():
+            process.join(max(0.0, deadline - time.time()))
+            if process.is_alive():
+                print(f"[SUPERVISOR] Terminating unresponsive process '{name}'.")
+                process.terminate()
+                process.join(1.0)
+        self.update_health()
+        for q in self._queues + [self.status_queue]:
+            q.cancel_join_thread()
+        for ring in self.rings.values():
+            ring.close()
+
+
+def run(layout, static_background):
+    # Multi-process counterpart of main.main(): same sinks and metrics, with
+    # every line's stages spread over child processes.
+    metrics = MetricsRegistry()
+    supervisor = Supervisor(layout, static_background, app.NUM_LINES, app.RING_SLOTS, app.HEALTH_INTERVAL)
+    for name in [f"line{line_id}-{'+'.join(group)}" for line_id in range(1, app.NUM_LINES + 1)
+                 for group in LAYOUTS[layout]]:
+        metrics.gauge('process_alive', lambda name=name: int(supervisor.health[name].get('alive', False)),
+                      process=name)
+        metrics.counter('process_frames', lambda name=name: supervisor.health[name]['processed'], process=name)
+    exporter = MetricsExporter(metrics, jsonl_path=app.METRICS_JSONL_PATH, interval=app.METRICS_INTERVAL,
+                               prometheus_port=app.METRICS_PORT).start()
+
+    sinks, latency = {}, {}
+    for line_id in range(1, app.NUM_LINES + 1):
+        window_name = app.WINDOW_NAME if app.NUM_LINES == 1 else f"{app.WINDOW_NAME} [Line {line_id}]"
+        sinks[line_id] = app.create_frame_sink(app.FRAME_SINK, window_name=window_name,
+                                               path=app.line_path(app.OUTPUT_VIDEO_PATH, line_id), fps=app.TARGET_FPS)
+        latency[line_id] = metrics.histogram('frame_latency_seconds', line=line_id)
+
+    print(f"Starting {app.NUM_LINES} line(s) in '{layout}' process layout...")
+    supervisor.start()
+    running = set(sinks)
+    last_report = time.time()
+    try:
+        while running and not supervisor.stop_event.is_set():
+            for line_id in list(running):
+                packet = supervisor.poll(line_id, copy_frame=sinks[line_id].wants_frames)
+                if packet is END_OF_STREAM:
+                    running.discard(line_id)
+                elif packet is not None:
+                    if sinks[line_id].wants_frames:
+                        sinks[line_id].write(app.annotate_frame(packet))
+                    latency[line_id].observe(time.perf_counter() - packet['created'])
+            if any(sink.stop_requested() for sink in sinks.values()):
+                break
+            if time.time() - last_report >= app.HEALTH_INTERVAL:
+                supervisor.print_health()
+                last_report = time.time()
+    finally:
+        supervisor.stop()
+        for sink in sinks.values():
+            sink.close()
+        exporter.stop()
+
+    supervisor.print_health()
+    for line_id, histogram in latency.items():
+        print(f"[Line {line_id}] Render-to-display latency: p95 {histogram.quantile(0.95) * 1000:.1f} ms")
+    failed = supervisor.failed()
+    if failed:
+        print(f"[SUPERVISOR] Processes with errors: {', '.join(failed)}")
+    return supervisor
@@ -0,0 +1,55 @@
+from alerts import AlertManager, RAISED, CLEARED
+
+
+def stuck(bottle_id=1):
+    return {'bottle_id': bottle_id, 'type': 'Stuck bottle'}
+
+
+def test_flickering_anomaly_raises_once_within_the_dedup_window():
+    manager = AlertManager(dedup_window=10, clear_after=1)
+    events = []
+    manager.subscribe(lambda event, alert: events.append((event, alert['raised_at'])))
+
+    raised, _ = manager.update([stuck()], 0)
+    assert len(raised) == 1
+    _, cleared = manager.update([], 1)
+    assert len(cleared) == 1
+    raised, _ = manager.update([stuck()], 5)
+    assert raised == []
+    assert manager.suppressed == 1
+
+    raised, _ = manager.update([stuck()], 10)
+    assert len(raised) == 1
+    assert events == [(RAISED, 0), (CLEARED, 0), (RAISED, 10)]
+
+
+def test_cooldown_overrides_the_dedup_window_per_type():
+    manager = AlertManager(dedup_window=100, cooldowns={'Stuck bottle': 3}, clear_after=1)
+    manager.update([stuck(), {'bottle_id': 1, 'type': 'Label missing'}], 0)
+    manager.update([], 1)
+
+    raised, _ = manager.update([stuck(), {'bottle_id': 1, 'type': 'Label missing'}], 3)
+    assert [alert['type'] for alert in raised] == ['Stuck bottle']
+
+
+def test_alert_clears_only_after_it_was_not_seen_for_clear_after_frames():
+    manager = AlertManager(clear_after=3)
+    manager.update([stuck()], 0)
+    for frame_index in (1, 2, 3):
+        _, cleared = manager.update([stuck()], frame_index)
+        assert cleared == []
+
+    assert manager.update([], 5)[1] == []
+    _, cleared = manager.update([], 6)
+    assert [alert['cleared_at'] for alert in cleared] == [6]
+    assert manager.snapshot() == {}
+    assert manager.stats()['active'] == 0
+
+
+def test_expired_suppression_entries_are_dropped():
+    manager = AlertManager(dedup_window=5, clear_after=1, max_entries=2)
+    manager.update([stuck(bottle_id) for bottle_id in range(4)], 0)
+    assert manager.stats()['tracked_keys'] == 2
+
+    manager.update([], 5)
+    assert manager.stats()['tracked_keys'] == 0
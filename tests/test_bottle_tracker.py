@@ -0,0 +1,53 @@
+from bottle_tracker import BottleTracker
+
+
+def bottle(bottle_id, x, label='bottle_empty'):
+    return {'id': bottle_id, 'label': label, 'bbox': [x - 10, 100, x + 10, 140]}
+
+
+def test_history_keeps_the_latest_samples_in_order_after_the_ring_wraps():
+    tracker = BottleTracker(max_history=4, stale_after=None)
+    labels = ['bottle_empty', 'bottle_filling', 'bottle_filled', 'bottle_capped', 'bottle_labeled', 'bottle_empty']
+    for frame_index, label in enumerate(labels):
+        tracker.update([bottle(1, 100 + 10 * frame_index, label)], frame_index=frame_index)
+
+    assert tracker.get_state_history(1) == labels[-4:]
+    assert tracker.get_position_history(1) == [(120, 120), (130, 120), (140, 120), (150, 120)]
+    assert tracker.get_frame_indices(1).tolist() == [2, 3, 4, 5]
+    assert tracker.get_position(1) == (150, 120)
+
+
+def test_short_history_before_the_ring_fills():
+    tracker = BottleTracker(max_history=4, stale_after=None)
+    tracker.update([bottle(1, 100)], frame_index=0)
+    tracker.update([bottle(1, 102, 'bottle_filling')], frame_index=1)
+
+    assert tracker.get_state_history(1) == ['bottle_empty', 'bottle_filling']
+    assert tracker.get_state_history(2) == []
+    assert tracker.get_position(2) is None
+
+
+def test_stale_tracks_are_evicted_and_their_slot_reused():
+    tracker = BottleTracker(max_history=4, stale_after=2, initial_capacity=2)
+    tracker.update([bottle(1, 100), bottle(2, 300)], frame_index=0)
+    for frame_index in (1, 2, 3):
+        tracker.update([bottle(2, 300 + frame_index)], frame_index=frame_index)
+
+    assert tracker.get_all_bottles() == [2]
+    assert tracker.get_state_history(1) == []
+    assert tracker.get_last_seen(2) == 3
+
+    tracker.update([bottle(3, 500, 'bottle_capped')], frame_index=4)
+    assert sorted(tracker.get_all_bottles()) == [2, 3]
+    assert tracker.get_state_history(3) == ['bottle_capped']
+    assert tracker._capacity == 2
+
+
+def test_capacity_grows_without_losing_histories():
+    tracker = BottleTracker(max_history=3, stale_after=None, initial_capacity=1)
+    for frame_index in range(3):
+        tracker.update([bottle(bottle_id, 100 * bottle_id + frame_index) for bottle_id in range(1, 4)],
+                       frame_index=frame_index)
+
+    assert len(tracker) == 3
+    assert tracker.get_position_history(3) == [(300, 120), (301, 120), (302, 120)]
@@ -0,0 +1,60 @@
+import os
+
+from detection_log import DetectionLog, DetectionLogWriter, list_parts
+from line_layout import LineLayout
+from motion_gate import DETECT, PREDICT
+
+LABELS = ['bottle_empty', 'bottle_filling', 'bottle_filled', 'bottle_capped', 'bottle_labeled']
+
+
+def recorded_frames(count):
+    # Each frame introduces new labels, track ids and modes, so every part
+    # has its own vocabulary. Confidences are exact in float32.
+    frames = []
+    for frame_index in range(count):
+        label = LABELS[frame_index % len(LABELS)]
+        mode = PREDICT if frame_index % 3 == 2 else DETECT
+        box = [10 * frame_index, 100, 10 * frame_index + 40, 180]
+        frames.append({
+            'frame_index': frame_index,
+            'detection_mode': mode,
+            'detections': None if mode == PREDICT else [{'bbox': box, 'conf': 0.75, 'label': label}],
+            'tracked_objects': [{'id': str(frame_index // 2), 'label': label, 'bbox': box, 'conf': 0.5}],
+            'ground_truth_states': {frame_index // 2: label}
+        })
+    return frames
+
+
+def write_log(path, frames, chunk_frames):
+    layout = LineLayout([{'name': 'filling', 'x_range': [20, 60], 'state': 'bottle_filling',
+                          'after': 'bottle_filled'}], width=640)
+    writer = DetectionLogWriter(path, layout=layout, frame_width=640, chunk_frames=chunk_frames)
+    for frame in frames:
+        writer.record(frame['frame_index'], frame['detections'], frame['tracked_objects'],
+                      frame['ground_truth_states'], frame['detection_mode'])
+    assert writer.close() == len(frames)
+    return layout
+
+
+def test_parts_read_back_as_one_log(tmp_path):
+    path = str(tmp_path / 'recording.npz')
+    frames = recorded_frames(8)
+    layout = write_log(path, frames, chunk_frames=3)
+
+    assert [os.path.basename(part) for part in list_parts(path)] == [
+        'recording.00000.npz', 'recording.00001.npz', 'recording.00002.npz']
+    log = DetectionLog(path)
+    assert len(log) == len(frames)
+    assert list(log) == frames
+    assert log.frame_width == 640
+    assert log.layout.to_dict() == layout.to_dict()
+
+
+def test_new_recording_replaces_the_parts_of_an_old_one(tmp_path):
+    path = str(tmp_path / 'recording.npz')
+    write_log(path, recorded_frames(8), chunk_frames=3)
+    frames = recorded_frames(2)
+    write_log(path, frames, chunk_frames=3)
+
+    assert len(list_parts(path)) == 1
+    assert list(DetectionLog(path)) == frames
@@ -0,0 +1,73 @@
+import contextlib
+import io
+import os
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_line(stride, frames=1500, seed=4):
+    # Stepped simulation with a ground-truth detector, run serially through
+    # the same track stage as main.py. Returns the anomalies raised.
+    import main
+    from alerts import AlertManager, RAISED
+    from anomaly_detector import AnomalyDetector
+    from bottle_tracker import BottleTracker
+    from llm_reasoner import LLMReasoner, TemplateBackend
+    from metrics import MetricsRegistry
+    from motion_gate import MotionGate, DETECT
+    from scenario_generator import ScenarioGenerator
+    from sim_clock import SteppedClock
+    from simulation_elements import compose_environment, default_layout, WIDTH, HEIGHT
+    from sort_tracker import SortTracker
+    from startup import Deferred
+
+    layout = default_layout()
+    environment = compose_environment(np.full((HEIGHT, WIDTH, 3), (60, 60, 60), dtype=np.uint8), layout)
+    gate = MotionGate(environment, stride=stride)
+    alert_manager = AlertManager()
+    raised = set()
+    alert_manager.subscribe(lambda event, alert: raised.add((alert['bottle_id'], alert['type']))
+                            if event == RAISED else None)
+    reasoner = LLMReasoner(backend=TemplateBackend(), cache=None)
+    track = main.make_track_stage(
+        Deferred('tracker', SortTracker), BottleTracker(max_history=main.HISTORY_LENGTH),
+        AnomalyDetector(layout=layout, history_window=main.HISTORY_LENGTH), alert_manager, reasoner, gate,
+        MetricsRegistry()
+    )
+
+    clock = SteppedClock()
+    scenario = ScenarioGenerator(total_bottles=5, spawn_interval=4, clock=clock, seed=seed, layout=layout)
+    for frame_index in range(frames):
+        clock.advance(main.FRAME_DURATION)
+        bottles = scenario.update()
+        frame = environment.copy()
+        for bottle in bottles:
+            bottle.update_position(main.FRAME_DURATION)
+            bottle.update_state()
+            bottle.draw(frame)
+        bottles[:] = [b for b in bottles if b.x < WIDTH]
+
+        mode = gate.decide(frame)
+        detections = None
+        if mode == DETECT:
+            detections = [{'bbox': b.get_tracker_format()['bbox'], 'conf': 0.99, 'label': b.state}
+                          for b in bottles]
+        track({'frame_index': frame_index, 'frame': frame, 'detection_mode': mode, 'detections': detections,
+               'ground_truth_states': {b.id: b.state for b in bottles}})
+        if scenario.is_complete():
+            break
+    reasoner.shutdown()
+    return raised
+
+
+def test_skipping_detections_raises_the_same_anomalies(monkeypatch):
+    import main
+    monkeypatch.chdir(REPO_ROOT)
+    monkeypatch.setattr(main, 'SIMULATION_CLOCK', 'stepped')
+    with contextlib.redirect_stdout(io.StringIO()):
+        every_frame = run_line(stride=1)
+        strided = run_line(stride=3)
+    assert every_frame
+    assert strided == every_frame
@@ -0,0 +1,41 @@
+import pytest
+
+from line_layout import LineLayout, NO_STATION
+
+
+def station(name, lo, hi, state=None):
+    return {'name': name, 'x_range': [lo, hi], 'state': state}
+
+
+@pytest.mark.parametrize('stations', [
+    [station('filling', 200, 100)],
+    [station('filling', 100, 100)],
+    [station('filling', 100, 300), station('capping', 250, 400)],
+    [station('capping', 400, 500), station('filling', 100, 300)],
+    [station('filling', -10, 100)],
+    [station('labeling', 600, 700)],
+], ids=['inverted', 'empty', 'overlapping', 'out-of-order', 'negative', 'past-the-belt'])
+def test_invalid_stations_are_rejected(stations):
+    with pytest.raises(ValueError):
+        LineLayout(stations, width=640)
+
+
+def test_adjacent_stations_are_accepted():
+    layout = LineLayout([station('filling', 100, 300, 'bottle_filling'), station('capping', 300, 640)], width=640)
+    assert layout.zone(299) == 0
+    assert layout.zone(300) == 1
+    assert layout.zone(639) == 1
+    assert layout.zone(640) == NO_STATION
+
+
+def test_yaml_layout_is_validated_on_load(tmp_path):
+    path = tmp_path / 'line_layout.yaml'
+    path.write_text(
+        "stations:\n"
+        "  - name: filling\n"
+        "    x_range: [250, 450]\n"
+        "  - name: capping\n"
+        "    x_range: [400, 600]\n"
+    )
+    with pytest.raises(ValueError, match="capping"):
+        LineLayout.load(str(path))
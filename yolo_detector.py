@@ -1,25 +1,284 @@
-import torch
-from ultralytics import YOLO
+import ast
+import os
+import time
+import cv2
+import numpy as np
+from box_utils import iou_matrix, assign_by_iou, non_max_suppression
+
+TILE_NMS_IOU = 0.5
+# Ultralytics' own NMS defaults, so the ONNX path post-processes like predict().
+NMS_IOU = 0.7
+MAX_DETECTIONS = 300
+LETTERBOX_STRIDE = 32
+LETTERBOX_COLOR = (114, 114, 114)
+DEFAULT_IMGSZ = 640
+
+
+def letterbox(image, input_size):
+    # Resize keeping the aspect ratio and pad to input_size (h, w), centred,
+    # the same way ultralytics' LetterBox does. Returns the padded image, the
+    # scale and the (left, top) padding.
+    height, width = image.shape[:2]
+    target_h, target_w = input_size
+    scale = min(target_h / height, target_w / width)
+    new_w, new_h = int(round(width * scale)), int(round(height * scale))
+    if (new_w, new_h) != (width, height):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    pad_w, pad_h = (target_w - new_w) / 2, (target_h - new_h) / 2
+    top, bottom = int(round(pad_h - 0.1)), int(round(pad_h + 0.1))
+    left, right = int(round(pad_w - 0.1)), int(round(pad_w + 0.1))
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=LETTERBOX_COLOR)
+    return image, scale, (left, top)
+
+
+def fixed_input_size(rois, imgsz=None):
+    # With equally sized ROIs every crop letterboxes to the same rectangle, so
+    # a static model only needs that (h, w) instead of a padded square.
+    imgsz = imgsz or DEFAULT_IMGSZ
+    if not rois or len({(x2 - x1, y2 - y1) for x1, y1, x2, y2 in rois}) != 1:
+        return (imgsz, imgsz)
+    x1, y1, x2, y2 = rois[0]
+    scale = imgsz / max(x2 - x1, y2 - y1)
+    return tuple(int(np.ceil(side * scale / LETTERBOX_STRIDE) * LETTERBOX_STRIDE) for side in (y2 - y1, x2 - x1))
+
+
+def compare_detections(reference, candidate, iou_threshold=0.5):
+    iou = iou_matrix([d['bbox'] for d in reference], [d['bbox'] for d in candidate])
+    matches = assign_by_iou(iou, iou_threshold, method='greedy')
+    same_label = sum(1 for r, c in matches if reference[r]['label'] == candidate[c]['label'])
+    return {
+        'reference': len(reference),
+        'candidate': len(candidate),
+        'matched': len(matches),
+        'recall': len(matches) / len(reference) if reference else 1.0,
+        'precision': len(matches) / len(candidate) if candidate else 1.0,
+        'mean_iou': float(np.mean([iou[r, c] for r, c in matches])) if matches else 0.0,
+        'max_conf_diff': max((abs(reference[r]['conf'] - candidate[c]['conf']) for r, c in matches), default=0.0),
+        'label_agreement': same_label / len(matches) if matches else 1.0
+    }
+
+
+class TorchBackend:
+    def __init__(self, model_path, confidence_threshold, imgsz=None):
+        import torch
+        from ultralytics import YOLO
 
-class YoloDetector:
-    def __init__(self, model_path, confidence_threshold=0.5):
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
         print(f"YOLO Detector using device: {self.device}")
-        
         self.model = YOLO(model_path)
+        self.names = self.model.names
+        self.confidence_threshold = confidence_threshold
+        self.imgsz = imgsz
+
+    def infer(self, images):
+        kwargs = {'conf': self.confidence_threshold, 'verbose': False}
+        if self.imgsz is not None:
+            kwargs['imgsz'] = self.imgsz
+        return [result.boxes.data.cpu().numpy() for result in self.model(images, **kwargs)]
+
+
+class OnnxBackend:
+    # Static-shape ONNX Runtime session on the CPU. Images are letterboxed to
+    # input_size and run one at a time (the export has batch size 1); decoding
+    # and class-aware NMS follow ultralytics so results match the torch path.
+    def __init__(self, onnx_path, confidence_threshold, input_size, intra_op_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata['names']) if 'names' in metadata else {}
+        self.confidence_threshold = confidence_threshold
+        self.input_size = tuple(input_size)
+        print(f"YOLO Detector using ONNX Runtime on CPU: {onnx_path}, input {self.input_size}, "
+              f"{intra_op_threads or 'default'} intra-op threads")
+
+    def infer(self, images):
+        return [self._infer_one(image) for image in images]
+
+    def _infer_one(self, image):
+        padded, scale, (pad_x, pad_y) = letterbox(image, self.input_size)
+        blob = np.ascontiguousarray(padded[:, :, ::-1].transpose(2, 0, 1))[None].astype(np.float32) / 255.0
+        output = self.session.run(None, {self.input_name: blob})[0][0]
+        if output.shape[0] > output.shape[1]:
+            output = output.T
+        # (4 + classes, anchors): centre-xywh then one score per class.
+        scores = output[4:]
+        class_ids = scores.argmax(axis=0)
+        confidences = scores[class_ids, np.arange(scores.shape[1])]
+        keep = confidences > self.confidence_threshold
+        if not keep.any():
+            return np.zeros((0, 6), dtype=np.float32)
+
+        cx, cy, w, h = output[:4, keep]
+        boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+        confidences, class_ids = confidences[keep], class_ids[keep]
+
+        # Offsetting boxes per class keeps NMS from suppressing across classes.
+        offsets = class_ids[:, None].astype(np.float32) * 7680
+        kept = non_max_suppression(boxes + offsets, confidences, NMS_IOU)[:MAX_DETECTIONS]
+        boxes = boxes[kept]
+        boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad_x) / scale
+        boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad_y) / scale
+        height, width = image.shape[:2]
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+        return np.column_stack([boxes, confidences[kept], class_ids[kept]]).astype(np.float32)
+
+
+def export_onnx(model_path, input_size, quantize=False):
+    # Exports best.pt once per input size and reuses the file until the
+    # weights change. quantize adds dynamic int8 weights on top of it.
+    base = f"{os.path.splitext(model_path)[0]}_{input_size[0]}x{input_size[1]}"
+    onnx_path = base + '.onnx'
+    if not os.path.exists(onnx_path) or os.path.getmtime(onnx_path) < os.path.getmtime(model_path):
+        from ultralytics import YOLO
+
+        print(f"Exporting {model_path} to ONNX at {input_size}...")
+        exported = YOLO(model_path).export(format='onnx', imgsz=list(input_size), dynamic=False, simplify=True)
+        os.replace(exported, onnx_path)
+
+    if not quantize:
+        return onnx_path
+    quantized_path = base + '.int8.onnx'
+    if not os.path.exists(quantized_path) or os.path.getmtime(quantized_path) < os.path.getmtime(onnx_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        print(f"Quantizing {onnx_path} to dynamic int8...")
+        quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QUInt8)
+    return quantized_path
+
+
+class YoloDetector:
+    # backend='torch' runs best.pt through ultralytics. backend='onnx' exports
+    # it once to a static-shape ONNX model (optionally int8-quantized) and runs
+    # it with ONNX Runtime on the CPU. Both return the same detections.
+    def __init__(self, model_path, confidence_threshold=0.5, rois=None, imgsz=None, backend='torch',
+                 intra_op_threads=None, quantize=False, warmup_runs=2):
+        self.model_path = model_path
         self.confidence_threshold = confidence_threshold
+        # Regions of interest as (x1, y1, x2, y2) in frame coordinates. When
+        # set, only these crops are sent to the model; imgsz letterboxes each
+        # crop to a smaller fixed inference size.
+        self.rois = [tuple(int(v) for v in roi) for roi in rois] if rois else None
+        self.imgsz = imgsz
+        self.backend_name = backend
+
+        if backend == 'torch':
+            self.backend = TorchBackend(model_path, confidence_threshold, imgsz)
+        elif backend == 'onnx':
+            input_size = fixed_input_size(self.rois, imgsz)
+            onnx_path = export_onnx(model_path, input_size, quantize)
+            self.backend = OnnxBackend(onnx_path, confidence_threshold, input_size, intra_op_threads)
+        else:
+            raise ValueError(f"Unknown detector backend '{backend}'. Use 'torch' or 'onnx'.")
+        self.names = self.backend.names
+        self.warmup(warmup_runs)
+
+    def warmup(self, runs=2):
+        # The first inferences allocate buffers and pick kernels; do that at
+        # load time instead of on the first live frame.
+        if runs <= 0:
+            return
+        if self.rois:
+            x1, y1, x2, y2 = self.rois[0]
+            width, height = x2 + 1, y2 + 1
+        else:
+            width, height = self.imgsz or DEFAULT_IMGSZ, self.imgsz or DEFAULT_IMGSZ
+        blank = np.full((height, width, 3), LETTERBOX_COLOR, dtype=np.uint8)
+        started = time.perf_counter()
+        for _ in range(runs):
+            self.detect(blank)
+        print(f"YOLO Detector warmed up in {time.perf_counter() - started:.2f}s")
 
     def detect(self, frame):
-        results = self.model(frame, conf=self.confidence_threshold, verbose=False)
-        
+        return self.detect_batch([frame])[0]
+
+    def detect_batch(self, frames):
+        # Every frame (or every ROI crop of every frame) goes through the model
+        # in a single call, and the results are split back per frame.
+        if not frames:
+            return []
+        if not self.rois:
+            return [self._to_detections(result) for result in self._infer(list(frames))]
+
+        crops, owners = [], []
+        for frame_index, frame in enumerate(frames):
+            for crop, offset in self._crop_rois(frame):
+                crops.append(crop)
+                owners.append((frame_index, offset))
+
+        per_frame = [[] for _ in frames]
+        if crops:
+            for result, (frame_index, (offset_x, offset_y)) in zip(self._infer(crops), owners):
+                per_frame[frame_index].extend(self._to_detections(result, offset_x, offset_y))
+
+        if len(self.rois) > 1:
+            per_frame = [self._merge_tiles(detections) for detections in per_frame]
+        return per_frame
+
+    def _infer(self, images):
+        return self.backend.infer(images)
+
+    def _to_detections(self, rows, offset_x=0, offset_y=0):
         detections = []
-        for result in results[0].boxes.data.tolist():
-            x1, y1, x2, y2, score, class_id = result
-            
+        for x1, y1, x2, y2, score, class_id in rows.tolist():
             detections.append({
-                'bbox': [int(x1), int(y1), int(x2), int(y2)],
+                'bbox': [int(x1) + offset_x, int(y1) + offset_y, int(x2) + offset_x, int(y2) + offset_y],
                 'conf': score,
-                'label': self.model.names[int(class_id)]
+                'label': self.names[int(class_id)]
             })
-            
-        return detections
\ No newline at end of file
+        return detections
+
+    def _detect_full(self, frame):
+        return self._to_detections(self._infer([frame])[0])
+
+    def _crop_rois(self, frame):
+        height, width = frame.shape[:2]
+        crops = []
+        for x1, y1, x2, y2 in self.rois:
+            x1, x2 = max(0, x1), min(width, x2)
+            y1, y2 = max(0, y1), min(height, y2)
+            if x2 <= x1 or y2 <= y1:
+                continue
+            crops.append((np.ascontiguousarray(frame[y1:y2, x1:x2]), (x1, y1)))
+        return crops
+
+    def _merge_tiles(self, detections):
+        if len(detections) < 2:
+            return detections
+        # Bottles straddling overlapping tiles are seen twice.
+        keep = non_max_suppression([d['bbox'] for d in detections], [d['conf'] for d in detections], TILE_NMS_IOU)
+        return [detections[i] for i in sorted(keep)]
+
+    def compare_with_full_frame(self, frame, iou_threshold=0.5):
+        report = compare_detections(self._detect_full(frame), self.detect(frame), iou_threshold)
+        report['full_frame'] = report.pop('reference')
+        report['roi'] = report.pop('candidate')
+        return report
+
+    def compare_with_torch(self, frames, iou_threshold=0.5):
+        # Parity check for the ONNX path: runs the same frames through the
+        # ultralytics model and reports agreement and per-frame latency.
+        reference = YoloDetector(self.model_path, self.confidence_threshold, self.rois, self.imgsz, backend='torch')
+        totals = {'torch_seconds': 0.0, f'{self.backend_name}_seconds': 0.0}
+        reports = []
+        for frame in frames:
+            started = time.perf_counter()
+            expected = reference.detect(frame)
+            totals['torch_seconds'] += time.perf_counter() - started
+            started = time.perf_counter()
+            actual = self.detect(frame)
+            totals[f'{self.backend_name}_seconds'] += time.perf_counter() - started
+            reports.append(compare_detections(expected, actual, iou_threshold))
+
+        summary = {key: float(np.mean([r[key] for r in reports])) if reports else 0.0
+                   for key in ('recall', 'precision', 'mean_iou', 'label_agreement')}
+        summary['max_conf_diff'] = max((r['max_conf_diff'] for r in reports), default=0.0)
+        summary.update({key.replace('_seconds', '_ms_per_frame'): value / max(len(frames), 1) * 1000
+                        for key, value in totals.items()})
+        return summary